@@ -0,0 +1,81 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Benchmark of drawing a fading 20-user voice channel
+
+Renders the 200 steps of a fade-out, as set up by fade_out_inactive,
+and compares it against the same number of fully opaque frames.
+
+Run with: python -m benchmarks.bench_fade"""
+import math
+import random
+from time import perf_counter
+import cairo
+from discover_overlay.image_getter import draw_img_to_rect, from_pil, to_pil
+
+USERS = 20
+STEPS = 200
+AVATAR_SIZE = 48
+
+
+def make_avatar(size=128):
+    """A round, randomly coloured avatar"""
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgba(random.random(), random.random(), random.random(), 1.0)
+    ctx.arc(size / 2, size / 2, size / 2, 0, 2 * math.pi)
+    ctx.fill()
+    return surface
+
+
+def legacy_draw(img, ctx, pos_x, pos_y, size, alpha):
+    """How draw_img_to_rect used to apply alpha"""
+    ctx.save()
+    ctx.translate(pos_x, pos_y)
+    ctx.scale(size / img.get_width(), size / img.get_height())
+    ctx.set_source_surface(from_pil(to_pil(img), alpha)[0], 0, 0)
+    ctx.rectangle(0, 0, img.get_width(), img.get_height())
+    ctx.fill()
+    ctx.restore()
+
+
+def render(avatars, draw, fade):
+    """Render STEPS frames, returning seconds taken"""
+    target = cairo.ImageSurface(cairo.FORMAT_ARGB32, 400, USERS * AVATAR_SIZE)
+    ctx = cairo.Context(target)
+    start = perf_counter()
+    for step in range(STEPS):
+        alpha = 1.0 - (0.7 * step / STEPS) if fade else 1.0
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        ctx.set_source_rgba(0, 0, 0, 0)
+        ctx.paint()
+        ctx.set_operator(cairo.OPERATOR_OVER)
+        for (idx, avatar) in enumerate(avatars):
+            draw(avatar, ctx, 0, idx * AVATAR_SIZE, AVATAR_SIZE, alpha)
+    return perf_counter() - start
+
+
+def main():
+    """Entry point"""
+    avatars = [make_avatar() for _i in range(USERS)]
+
+    def current(img, ctx, pos_x, pos_y, size, alpha):
+        draw_img_to_rect(img, ctx, pos_x, pos_y, size, size, alpha=alpha)
+    for (name, draw) in (("current", current), ("legacy", legacy_draw)):
+        static = render(avatars, draw, False)
+        fading = render(avatars, draw, True)
+        print(f"{name:8} static {static / STEPS * 1000:8.3f} ms/frame"
+              f"  fading {fading / STEPS * 1000:8.3f} ms/frame")
+
+
+if __name__ == "__main__":
+    main()
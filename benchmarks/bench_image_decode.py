@@ -0,0 +1,71 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Micro-benchmark of mask generation & premultiplication in image_getter
+
+Run with: python -m benchmarks.bench_image_decode [--slow]
+--slow also times the pure-Python fallback, which takes minutes at 4K"""
+import sys
+import random
+from time import perf_counter
+from discover_overlay import image_getter
+
+SIZES = {
+    "emoji": (48, 48),
+    "avatar": (96, 96),
+    "attachment 4K": (3840, 2160),
+}
+
+
+def make_pixels(width, height):
+    """Half transparent, half random pixel data"""
+    row = bytearray(random.getrandbits(8) for _ in range(width * 4))
+    arr = bytearray(width * 4 * height)
+    for y in range(height // 2, height):
+        arr[y * width * 4:(y + 1) * width * 4] = row
+    return arr
+
+
+def bench(name, func, arr, repeat):
+    """Time func over a fresh copy of arr, repeat times"""
+    total = 0
+    for _i in range(repeat):
+        data = bytearray(arr)
+        start = perf_counter()
+        func(data)
+        total += perf_counter() - start
+    print(f"  {name:8} {total / repeat * 1000:10.3f} ms")
+
+
+def main():
+    """Entry point"""
+    slow = "--slow" in sys.argv
+    for (label, (width, height)) in SIZES.items():
+        arr = make_pixels(width, height)
+        repeat = 3 if width > 1000 else 200
+        print(f"{label} ({width}x{height})")
+        methods = ["pil"]
+        if image_getter.numpy is not None:
+            methods.insert(0, "numpy")
+        if slow or width < 1000:
+            methods.append("python")
+        for method in methods:
+            count = repeat
+            if method == "python":
+                count = 1 if width > 1000 else 5
+            bench(method, lambda data, w=width, h=height, m=method:
+                  image_getter.premultiply_and_mask(data, w, h, 0.5, method=m),
+                  arr, count)
+
+
+if __name__ == "__main__":
+    main()
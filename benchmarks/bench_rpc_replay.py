@@ -0,0 +1,166 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Benchmark of replaying RPC frames through DiscordConnector.on_message
+
+Frames are read from a file with one JSON message per line, as received
+from the websocket. Without a file, a busy voice channel is synthesised:
+users joining, a long run of speaking start/stop, mute changes and
+text messages. Overlays are replaced by objects that accept and ignore
+every call, so only the connector is measured.
+
+Run with: python -m benchmarks.bench_rpc_replay [frames.jsonl] [--repeat N]"""
+import argparse
+import json
+import random
+from configparser import ConfigParser
+from time import perf_counter
+from discover_overlay.discord_connector import DiscordConnector
+from discover_overlay.models import Guild
+
+USERS = 25
+SPEAKING = 20000
+MESSAGES = 200
+CHANNEL = "1000"
+TEXT_CHANNEL = "2000"
+GUILD = "3000"
+
+
+class Ignore:
+    """Accepts any method call and does nothing"""
+
+    def __getattr__(self, _name):
+        return self
+
+    def __call__(self, *_args, **_kwargs):
+        return None
+
+    def __bool__(self):
+        return True
+
+
+class ReplayDiscover:
+    """The parts of Discover the connector talks to"""
+
+    def __init__(self):
+        self.voice_overlay = Ignore()
+        self.text_overlay = Ignore()
+        self.notification_overlay = Ignore()
+        self.audio_assist = Ignore()
+        self.text_overlay.popup_style = False
+
+    def config(self):
+        """Empty config"""
+        return ConfigParser()
+
+    def set_audio_devices(self, _sink, _source):
+        """Ignore audio device changes"""
+
+    def config_set(self, _section, _key, _value):
+        """Ignore config changes"""
+
+    def exit(self):
+        """Ignore exit requests"""
+
+
+def voice_state(user_id, mute=False, deaf=False):
+    """A VOICE_STATE_* dispatch for user_id"""
+    return {"cmd": "DISPATCH", "evt": "VOICE_STATE_UPDATE", "nonce": None,
+            "data": {"nick": f"User {user_id}",
+                     "user": {"id": user_id, "username": f"user{user_id}",
+                              "avatar": None},
+                     "voice_state": {"mute": False, "self_mute": mute,
+                                     "suppress": False, "deaf": False,
+                                     "self_deaf": deaf}}}
+
+
+def synthesise():
+    """Return a list of frames resembling a busy channel"""
+    rng = random.Random(1)
+    users = [str(10000 + idx) for idx in range(USERS)]
+    frames = []
+    for user_id in users:
+        frame = voice_state(user_id)
+        frame["evt"] = "VOICE_STATE_CREATE"
+        frames.append(frame)
+    for idx in range(SPEAKING):
+        user_id = rng.choice(users)
+        evt = "SPEAKING_START" if idx % 2 == 0 else "SPEAKING_STOP"
+        frames.append({"cmd": "DISPATCH", "evt": evt, "nonce": None,
+                       "data": {"user_id": user_id,
+                                "channel_id": CHANNEL}})
+        if idx % 100 == 0:
+            frames.append(voice_state(user_id, mute=rng.random() < 0.5))
+        if idx % (SPEAKING // MESSAGES) == 0:
+            frames.append({"cmd": "DISPATCH", "evt": "MESSAGE_CREATE",
+                           "nonce": None,
+                           "data": {"channel_id": TEXT_CHANNEL,
+                                    "message": {
+                                        "id": str(idx),
+                                        "author": {"username": f"user{user_id}"},
+                                        "timestamp": "2024-01-01T12:00:00.000000+00:00",
+                                        "content": "hello",
+                                        "content_parsed": [{"type": "text",
+                                                            "content": "hello"}],
+                                        "attachments": []}}})
+    return [json.dumps(frame) for frame in frames]
+
+
+def make_connector():
+    """A connector that believes it is in CHANNEL and TEXT_CHANNEL"""
+    connector = DiscordConnector(ReplayDiscover())
+    connector.websocket = Ignore()
+    connector.user = {"id": "1", "username": "me"}
+    connector.current_voice = CHANNEL
+    connector.current_guild = GUILD
+    connector.current_text = TEXT_CHANNEL
+    connector.guilds[GUILD] = Guild(GUILD, "Guild")
+    return connector
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("frames", nargs="?",
+                        help="file of JSON frames, one per line")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if args.frames:
+        with open(args.frames, "r", encoding="utf-8") as file:
+            frames = [line for line in file if line.strip()]
+    else:
+        frames = synthesise()
+
+    best = None
+    for _run in range(args.repeat):
+        connector = make_connector()
+        start = perf_counter()
+        for frame in frames:
+            connector.on_message(frame)
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, connector.event_stats)
+
+    (elapsed, stats) = best
+    print(f"{len(frames)} frames in {elapsed * 1000:.1f} ms, "
+          f"{len(frames) / elapsed:,.0f} events/s")
+    for ((cmd, evt), (count, total, worst)) in sorted(
+            stats.items(), key=lambda item: -item[1][0]):
+        print(f"{cmd:>12} {evt or '':24} {count:7d}"
+              f"  mean {total / count * 1e6:7.2f} us"
+              f"  max {worst * 1e6:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Benchmark of start up time for invocations that don't show an overlay
+
+Each case runs entrypoint in a fresh interpreter, with its config
+directory pointed at a temporary one, and reports the best time over
+several runs. It fails if any case imported GTK, the overlays or the
+network and audio libraries, which only the overlay itself needs.
+
+Run with: python -m benchmarks.bench_startup [--repeat N]"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Modules that must not be imported unless an overlay is shown
+HEAVY = ("gi", "cairo", "PIL", "requests", "websocket", "pulsectl",
+         "pulsectl_asyncio", "pkg_resources",
+         "discover_overlay.settings_window", "discover_overlay.voice_overlay",
+         "discover_overlay.text_overlay", "discover_overlay.notification_overlay",
+         "discover_overlay.discord_connector", "discover_overlay.audio_assist")
+
+CASES = (
+    ("import", None),
+    ("--help", ["--help"]),
+    ("--version", ["--version"]),
+    ("--mute", ["--mute"]),
+    ("--moveto=", ["--moveto=123456789"]),
+)
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+args = json.loads(sys.argv[1])
+heavy_names = json.loads(sys.argv[2])
+import discover_overlay.discover_overlay as main
+if args is not None:
+    sys.argv = ["discover-overlay"] + args
+    try:
+        main.entrypoint()
+    except Exception as error:  # pylint: disable=broad-except
+        print(repr(error), file=sys.stderr)
+elapsed = time.perf_counter() - start
+heavy = sorted(name for name in heavy_names if name in sys.modules)
+print(json.dumps({"elapsed": elapsed, "heavy": heavy}), file=sys.stderr)
+"""
+
+
+def run_case(args, config_home):
+    """Run one case in a new interpreter, returning (seconds, heavy modules)"""
+    env = dict(os.environ, XDG_CONFIG_HOME=config_home)
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD, json.dumps(args), json.dumps(HEAVY)],
+        env=env, capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(f"{args} failed:\n{result.stderr}")
+    report = json.loads(result.stderr.strip().splitlines()[-1])
+    return (report["elapsed"], report["heavy"])
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as config_home:
+        for (name, case_args) in CASES:
+            best = None
+            heavy = []
+            for _run in range(args.repeat):
+                (elapsed, heavy) = run_case(case_args, config_home)
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:10} {best * 1000:8.1f} ms"
+                  + (f"  imported {', '.join(heavy)}" if heavy else ""))
+            failed = failed or bool(heavy)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Benchmark of keeping a 500-user voice channel sorted during a speaking storm
+
+Each socket wakeup applies a few speaking start/stop events and then
+sorts the user list, as set_user_list does. The connector hands over
+the same list of members each time. UserOrder is compared against
+sorting the whole list every time.
+
+Run with: python -m benchmarks.bench_user_order"""
+import locale
+import random
+from time import perf_counter
+from discover_overlay.models import VoiceUser
+from discover_overlay.user_order import UserOrder, ORDER_NAME, ORDER_ID, ORDER_SPOKEN
+
+USERS = 500
+WAKEUPS = 2000
+EVENTS_PER_WAKEUP = 4
+
+
+def legacy_sort(in_list, order):
+    """How sort_list used to order users"""
+    in_list = in_list[:]
+    if order == ORDER_ID:
+        in_list.sort(key=lambda x: x.id)
+    elif order == ORDER_SPOKEN:
+        in_list.sort(key=lambda x: x.lastspoken, reverse=True)
+        in_list.sort(key=lambda x: x.speaking, reverse=True)
+    else:
+        in_list.sort(key=lambda x: locale.strxfrm(x.friendlyname))
+    return in_list
+
+
+def make_users(rng):
+    """USERS users with random names"""
+    return [VoiceUser(str(100000 + idx),
+                      "".join(rng.choice("abcdefghijklmnopqrstuvwxyz")
+                              for _i in range(rng.randint(4, 16))))
+            for idx in range(USERS)]
+
+
+def storm(order, sort):
+    """Run WAKEUPS wakeups of speaking events, returning seconds taken"""
+    rng = random.Random(1)
+    users = make_users(rng)
+    clock = 0.0
+    start = perf_counter()
+    for _wakeup in range(WAKEUPS):
+        for _event in range(EVENTS_PER_WAKEUP):
+            user = rng.choice(users)
+            clock += 0.01
+            if user.set_speaking(not user.speaking) and user.speaking:
+                user.set_lastspoken(clock)
+        sort(users, order)
+        # set_user_list clears the change flags once they are handled
+        for user in users:
+            user.changed = 0
+    return perf_counter() - start
+
+
+def main():
+    """Entry point"""
+    locale.setlocale(locale.LC_ALL, "")
+    for (name, order) in (("name", ORDER_NAME), ("id", ORDER_ID),
+                          ("spoken", ORDER_SPOKEN)):
+        user_order = UserOrder()
+
+        def incremental(users, order, user_order=user_order):
+            return user_order.sort(users, order)
+        legacy = storm(order, legacy_sort)
+        current = storm(order, incremental)
+        print(f"{name:7} full sort {legacy / WAKEUPS * 1e6:8.1f} us/wakeup"
+              f"  incremental {current / WAKEUPS * 1e6:8.1f} us/wakeup")
+
+
+if __name__ == "__main__":
+    main()
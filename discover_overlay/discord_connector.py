@@ -22,16 +22,26 @@ CHANNEL - Often called 'Rooms'. Both voice and text channels are types of channe
 """
 import select
 import time
+from collections import deque
 import json
 import logging
 import calendar
 import websocket
 import requests
-
-from gi.repository import GLib
+import gi
+from . import rpc_codec
+from .markup import message_to_markup
+from .text_store import TextStore
+from .models import VoiceUser, Channel, Guild, TextMessage, CHANGED_AVATAR
+gi.require_version("GLib", "2.0")
+# pylint: disable=wrong-import-position
+from gi.repository import GLib  # nopep8
 
 log = logging.getLogger(__name__)
 
+# Notifications kept for a notification overlay that is not yet created
+MISSED_NOTIFICATIONS = 10
+
 
 class DiscordConnector:
     """
@@ -51,14 +61,19 @@ class DiscordConnector:
         self.channels = {}
         self.user = {}
         self.userlist = {}
-        self.in_room = []
+        # Ids of users in the voice channel, in the order they joined
+        self.in_room = {}
+        # VoiceUsers in the voice channel, rebuilt when someone joins or leaves
+        self.room_members = None
         self.current_guild = "0"
         self.current_voice = "0"
         self.current_text = "0"
         self.current_text_guild = "0"
         self.list_altered = False
         self.text_altered = False
-        self.text = []
+        self.text = TextStore()
+        # (time received, event) of notifications while there's no overlay
+        self.missed_notifications = deque(maxlen=MISSED_NOTIFICATIONS)
         self.authed = False
         self.last_rate_limit_send = 0
         self.muted = False
@@ -69,6 +84,11 @@ class DiscordConnector:
         self.rate_limited_channels = []
         self.reconnect_cb = None
 
+        # (cmd, evt) -> [count, total seconds, longest seconds]
+        self.event_stats = {}
+        self.handlers = {}
+        self.register_handlers()
+
     def get_access_token_stage1(self):
         """
         First stage of getting an access token. Request authorization from Discord client
@@ -86,7 +106,7 @@ class DiscordConnector:
             },
             "nonce": "deadbeef"
         }
-        self.websocket.send(json.dumps(cmd))
+        self.websocket.send(rpc_codec.encode(cmd))
 
     def get_access_token_stage2(self, code1):
         """
@@ -123,7 +143,7 @@ class DiscordConnector:
             self.current_voice = "0"
             self.current_guild = "0"
             self.discover.voice_overlay.set_blank()
-            self.in_room = []
+            self.clear_room()
             return
         if channel != self.current_voice:
             if self.current_voice != "0":
@@ -152,16 +172,42 @@ class DiscordConnector:
             if need_req:
                 self.req_channel_details(channel)
 
+    def set_text_limit(self, limit):
+        """
+        Set how many of the most recent text messages are shown
+        """
+        if limit != self.text.limit:
+            self.text.set_limit(limit)
+            self.text_altered = True
+
     def set_in_room(self, userid, present):
         """
         Set user currently in given room
         """
         if present:
             if userid not in self.in_room:
-                self.in_room.append(userid)
+                self.in_room[userid] = None
+                self.room_members = None
         else:
             if userid in self.in_room:
-                self.in_room.remove(userid)
+                del self.in_room[userid]
+                self.room_members = None
+
+    def clear_room(self):
+        """
+        Forget everyone in the room
+        """
+        self.in_room = {}
+        self.room_members = None
+
+    def get_room_members(self):
+        """
+        Return the VoiceUsers in the room, in the order they joined
+        """
+        if self.room_members is None:
+            self.room_members = [self.userlist[userid]
+                                 for userid in self.in_room if userid in self.userlist]
+        return self.room_members
 
     def add_text(self, message):
         """
@@ -184,40 +230,30 @@ class DiscordConnector:
         if "author_color" in message:
             colour = message["author_color"]
 
-        self.text.append({'id': message["id"],
-                          'content': self.get_message_from_message(message),
-                          'nick': username,
-                          'nick_col': colour,
-                          'time': epoch_time,
-                          'attach': self.get_attachment_from_message(message),
-                          })
+        content = self.get_message_from_message(message)
+        (markup, images) = message_to_markup(username, colour, content)
+        self.text.append(TextMessage(message["id"], content, username, colour,
+                                     epoch_time,
+                                     self.get_attachment_from_message(message),
+                                     markup, images))
         self.text_altered = True
 
     def update_text(self, message_in):
         """
         Update a line of text
         """
-        for idx, message in enumerate(self.text):
-            if message['id'] == message_in['id']:
-                new_message = {'id': message['id'],
-                               'content': self.get_message_from_message(message_in),
-                               'nick': message['nick'],
-                               'nick_col': message['nick_col'],
-                               'time': message['time'],
-                               'attach': message['attach']}
-                self.text[idx] = new_message
-                self.text_altered = True
-                return
+        message = self.text.get(message_in['id'])
+        if message and message.merge(self.get_message_from_message(message_in)):
+            (message.markup, message.images) = message_to_markup(
+                message.nick, message.nick_col, message.content)
+            self.text_altered = True
 
     def delete_text(self, message_in):
         """
         Delete a line of text
         """
-        for idx, message in enumerate(self.text):
-            if message['id'] == message_in['id']:
-                del self.text[idx]
-                self.text_altered = True
-                return
+        if self.text.remove(message_in['id']):
+            self.text_altered = True
 
     def get_message_from_message(self, message):
         """
@@ -248,230 +284,329 @@ class DiscordConnector:
 
     def update_user(self, user):
         """
-        Update user information
-        Pass along our custom user information from version to version
-        """
-        if user["id"] in self.userlist:
-            olduser = self.userlist[user["id"]]
-            if "mute" not in user and "mute" in olduser:
-                user["mute"] = olduser["mute"]
-            if "deaf" not in user and "deaf" in olduser:
-                user["deaf"] = olduser["deaf"]
-            if "speaking" not in user and "speaking" in olduser:
-                user["speaking"] = olduser["speaking"]
-            if "nick" not in user and "nick" in olduser:
-                user["nick"] = olduser["nick"]
-            if "lastspoken" not in user and "lastspoken" in olduser:
-                user["lastspoken"] = olduser["lastspoken"]
-            if olduser["avatar"] != user["avatar"]:
-                self.discover.voice_overlay.delete_avatar(user["id"])
-        if "lastspoken" not in user:  # Still nothing?
-            user["lastspoken"] = 0  # EEEEPOOCH EEEEEPOCH! BELIEVE MEEEE
-        if "speaking" not in user:
-            user["speaking"] = False
-        self.userlist[user["id"]] = user
+        Update user information from an RPC user dict
+        Anything not given is kept from what we already knew
+        """
+        olduser = self.userlist.get(user["id"])
+        if olduser is None:
+            self.userlist[user["id"]] = VoiceUser.from_dict(user)
+            if user["id"] in self.in_room:
+                self.room_members = None
+        elif olduser.merge(user) & CHANGED_AVATAR:
+            self.discover.voice_overlay.delete_avatar(user["id"])
+
+    def register_handlers(self):
+        """
+        Build the table of websocket message handlers, keyed by (cmd, evt).
+        An evt of None catches any event not listed for that cmd
+        """
+        self.handlers = {
+            ("AUTHORIZE", None): self.handle_authorize,
+            ("DISPATCH", "READY"): self.handle_ready,
+            ("DISPATCH", "VOICE_STATE_UPDATE"): self.handle_voice_state_update,
+            ("DISPATCH", "VOICE_STATE_CREATE"): self.handle_voice_state_create,
+            ("DISPATCH", "VOICE_STATE_DELETE"): self.handle_voice_state_delete,
+            ("DISPATCH", "SPEAKING_START"): self.handle_speaking_start,
+            ("DISPATCH", "SPEAKING_STOP"): self.handle_speaking_stop,
+            ("DISPATCH", "VOICE_CHANNEL_SELECT"): self.handle_voice_channel_select,
+            ("DISPATCH", "VOICE_CONNECTION_STATUS"): self.handle_voice_connection_status,
+            ("DISPATCH", "MESSAGE_CREATE"): self.handle_message_create,
+            ("DISPATCH", "MESSAGE_UPDATE"): self.handle_message_update,
+            ("DISPATCH", "MESSAGE_DELETE"): self.handle_message_delete,
+            ("DISPATCH", "CHANNEL_CREATE"): self.handle_channel_create,
+            ("DISPATCH", "NOTIFICATION_CREATE"): self.handle_notification_create,
+            ("DISPATCH", "VOICE_SETTINGS_UPDATE"): self.handle_voice_settings_update,
+            ("AUTHENTICATE", "ERROR"): self.handle_authenticate_error,
+            ("AUTHENTICATE", None): self.handle_authenticate,
+            ("GET_GUILDS", None): self.handle_get_guilds,
+            ("GET_GUILD", None): self.handle_get_guild,
+            ("GET_CHANNELS", "ERROR"): self.handle_error,
+            ("GET_CHANNELS", None): self.handle_get_channels,
+            ("SUBSCRIBE", None): self.handle_subscribe,
+            ("UNSUBSCRIBE", None): self.handle_ignored,
+            ("GET_SELECTED_VOICE_CHANNEL", None): self.handle_get_selected_voice_channel,
+            ("GET_CHANNEL", "ERROR"): self.handle_get_channel_error,
+            ("GET_CHANNEL", None): self.handle_get_channel,
+            ("SELECT_VOICE_CHANNEL", None): self.handle_ignored,
+            ("SET_VOICE_SETTINGS", None): self.handle_set_voice_settings,
+            ("GET_VOICE_SETTINGS", None): self.handle_ignored,
+        }
 
     def on_message(self, message):
         """
-        Recieve websocket message super-function
+        Recieve websocket message and pass it to the registered handler
         """
-        j = json.loads(message)
-        if j["cmd"] == "AUTHORIZE":
-            if 'data' in j and 'code' in j['data']:
-                self.get_access_token_stage2(j["data"]["code"])
-            else:
-                log.error("Authorization rejected")
-                self.discover.exit()
+        try:
+            j = rpc_codec.decode(message)
+        except rpc_codec.MalformedEvent as error:
+            log.warning("Skipped malformed message : %s", error)
+            log.debug(message)
             return
-        elif j["cmd"] == "DISPATCH":
-            if j["evt"] == "READY":
-                self.req_auth()
-            elif j["evt"] == "VOICE_STATE_UPDATE":
-                self.list_altered = True
-                thisuser = j["data"]["user"]
-                nick = j["data"]["nick"]
+        key = (j["cmd"], j.get("evt"))
+        handler = self.handlers.get(key)
+        if handler is None:
+            key = (j["cmd"], None)
+            handler = self.handlers.get(key)
+            if handler is None:
+                log.warning(j)
+                return
+        start = time.perf_counter()
+        handler(j)
+        elapsed = time.perf_counter() - start
+        stats = self.event_stats.get(key)
+        if stats is None:
+            self.event_stats[key] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+    def log_event_stats(self):
+        """Log how many of each message were handled, and how long they took"""
+        for ((cmd, evt), (count, total, worst)) in sorted(
+                self.event_stats.items(), key=lambda item: -item[1][1]):
+            log.debug("%s %s: %d handled, %.1fus mean, %.1fus max",
+                      cmd, evt or "", count, total / count * 1e6, worst * 1e6)
+
+    def handle_authorize(self, j):
+        """Authorization response. Continue with the code, or give up"""
+        if 'code' in (j.get('data') or {}):
+            self.get_access_token_stage2(j["data"]["code"])
+        else:
+            log.error("Authorization rejected")
+            self.discover.exit()
+
+    def handle_ready(self, _j):
+        """Discord is ready to talk. Authenticate"""
+        self.req_auth()
+
+    def handle_voice_state_update(self, j):
+        """A user in the room has changed mute or deaf state"""
+        self.list_altered = True
+        data = j["data"]
+        thisuser = data.user
+        thisuser["nick"] = data.nick
+        thisuser["mute"] = data.mute
+        thisuser["deaf"] = data.deaf
+        if self.current_voice != "0":
+            self.update_user(thisuser)
+        self.set_in_room(thisuser["id"], True)
+
+    def handle_voice_state_create(self, j):
+        """A user has joined the room"""
+        self.list_altered = True
+        thisuser = j["data"].user
+        thisuser["nick"] = j["data"].nick
+        self.update_user(thisuser)
+        # We've joined a room... but where?
+        if thisuser["id"] == self.user["id"]:
+            self.find_user()
+        self.userlist[thisuser["id"]].set_lastspoken(time.perf_counter())
+
+    def handle_voice_state_delete(self, j):
+        """A user has left the room"""
+        self.list_altered = True
+        user_id = j["data"].user["id"]
+        self.set_in_room(user_id, False)
+        if user_id == self.user["id"]:
+            self.clear_room()
+            self.find_user()
+            self.discover.voice_overlay.set_channel_title(None)
+            self.discover.voice_overlay.set_channel_icon(None)
+            # User might have been forcibly moved room
+
+    def handle_speaking_start(self, j):
+        """A user has started talking"""
+        self.list_altered = True
+        user_id = j["data"].user_id
+        user = self.userlist[user_id]
+        user.set_speaking(True)
+        user.set_lastspoken(time.perf_counter())
+        self.set_in_room(user_id, True)
+
+    def handle_speaking_stop(self, j):
+        """A user has stopped talking"""
+        self.list_altered = True
+        user_id = j["data"].user_id
+        if user_id in self.userlist:
+            user = self.userlist[user_id]
+            if user.set_speaking(False):
+                user.set_lastspoken(time.perf_counter())
+        self.set_in_room(user_id, True)
+
+    def handle_voice_channel_select(self, j):
+        """We have moved voice channel"""
+        if j["data"]["channel_id"]:
+            self.set_channel(j["data"]["channel_id"],
+                             j["data"]["guild_id"])
+        else:
+            self.set_channel(None, None)
+
+    def handle_voice_connection_status(self, j):
+        """Voice connection state has changed"""
+        self.discover.voice_overlay.set_connection_status(j["data"])
+
+    def handle_message_create(self, j):
+        """A text message was sent"""
+        if self.current_text == j["data"]["channel_id"]:
+            self.add_text(j["data"]["message"])
+
+    def handle_message_update(self, j):
+        """A text message was edited"""
+        if self.current_text == j["data"]["channel_id"]:
+            self.update_text(j["data"]["message"])
+
+    def handle_message_delete(self, j):
+        """A text message was deleted"""
+        if self.current_text == j["data"]["channel_id"]:
+            self.delete_text(j["data"]["message"])
+
+    def handle_channel_create(self, j):
+        """A channel was created"""
+        # We haven't been told what guild this is in
+        self.req_channel_details(j["data"]["id"], 'new')
+
+    def handle_notification_create(self, j):
+        """A notification was sent"""
+        if self.discover.notification_overlay:
+            self.discover.notification_overlay.add_notification_message(j)
+        else:
+            self.missed_notifications.append((time.time(), j))
+
+    def handle_voice_settings_update(self, j):
+        """Audio devices or settings changed"""
+        source = j['data']['input']['device_id']
+        sink = j['data']['output']['device_id']
+        if sink == 'default':
+            for available_sink in j['data']['output']['available_devices']:
+                if available_sink['id'] == 'default':
+                    sink = available_sink['name'][9:]
+        if source == 'default':
+            for available_source in j['data']['input']['available_devices']:
+                if available_source['id'] == 'default':
+                    source = available_source['name'][9:]
+        self.discover.set_audio_devices(sink, source)
+
+    def handle_authenticate_error(self, _j):
+        """Access token rejected. Ask for a new one"""
+        self.access_token = None
+        self.get_access_token_stage1()
+
+    def handle_authenticate(self, j):
+        """Logged in"""
+        self.discover.config_set(
+            "cache", "access_token", self.access_token)
+        self.req_guilds()
+        self.user = j["data"]["user"]
+        log.info(
+            "ID is %s", self.user["id"])
+        log.info(
+            "Logged in as %s", self.user["username"])
+        self.authed = True
+        self.on_connected()
+
+    def handle_get_guilds(self, j):
+        """List of guilds"""
+        for guild in j["data"]["guilds"]:
+            if guild["id"] in self.guilds:
+                self.guilds[guild["id"]].merge(guild)
+            else:
+                self.guilds[guild["id"]] = Guild.from_dict(guild)
+        self.dump_channel_data()
+
+    def handle_get_guild(self, _j):
+        """Details of one guild"""
+        # We currently only get here because of a "CHANNEL_CREATE" event.
+        # Stupidly long winded way around
+        self.dump_channel_data()
+
+    def handle_error(self, j):
+        """Log an error response"""
+        log.error('%s', j['data']['message'])
+
+    def handle_get_channels(self, j):
+        """List of channels in a guild"""
+        guild = self.guilds[j['nonce']]
+        guild.channels = []
+        for channel_data in j["data"]["channels"]:
+            channel_data['guild_id'] = guild.id
+            channel_data['guild_name'] = guild.name
+            channel = self.channels.get(channel_data["id"])
+            if channel is None:
+                channel = Channel.from_dict(channel_data)
+                self.channels[channel.id] = channel
+            else:
+                channel.merge(channel_data)
+            guild.channels.append(channel)
+            if channel.type == 2:
+                self.req_channel_details(channel.id)
+        self.dump_channel_data()
+
+    def handle_subscribe(self, j):
+        """Subscription response"""
+        # Only log errors
+        if j['evt']:
+            log.warning(j)
+
+    def handle_ignored(self, _j):
+        """Response that needs no action"""
+
+    def handle_get_selected_voice_channel(self, j):
+        """The voice channel we are in, and who is in it"""
+        if 'data' in j and j['data'] and 'id' in j['data']:
+            self.set_channel(j['data']['id'], j['data']['guild_id'])
+            self.discover.voice_overlay.set_channel_title(
+                j["data"]["name"])
+            if (self.current_guild in self.guilds and
+               self.guilds[self.current_guild].icon_url):
+                self.discover.voice_overlay.set_channel_icon(
+                    self.guilds[self.current_guild].icon_url)
+            else:
+                self.discover.voice_overlay.set_channel_icon(None)
+            self.list_altered = True
+            self.clear_room()
+            for u in j['data']['voice_states']:
+                thisuser = u["user"]
+                nick = u["nick"]
                 thisuser["nick"] = nick
-                mute = (j["data"]["voice_state"]["mute"] or
-                        j["data"]["voice_state"]["self_mute"] or
-                        j["data"]["voice_state"]["suppress"])
-                deaf = j["data"]["voice_state"]["deaf"] or j["data"]["voice_state"]["self_deaf"]
+                mute = (u["voice_state"]["mute"] or
+                        u["voice_state"]["self_mute"] or
+                        u["voice_state"]["suppress"])
+                deaf = u["voice_state"]["deaf"] or u["voice_state"]["self_deaf"]
                 thisuser["mute"] = mute
                 thisuser["deaf"] = deaf
-                if self.current_voice != "0":
-                    self.update_user(thisuser)
-                self.set_in_room(thisuser["id"], True)
-            elif j["evt"] == "VOICE_STATE_CREATE":
-                self.list_altered = True
-                thisuser = j["data"]["user"]
-                nick = j["data"]["nick"]
-                thisuser["nick"] = nick
                 self.update_user(thisuser)
-                # We've joined a room... but where?
-                if j["data"]["user"]["id"] == self.user["id"]:
-                    self.find_user()
-                self.userlist[thisuser["id"]]["lastspoken"] = time.perf_counter()
-            elif j["evt"] == "VOICE_STATE_DELETE":
-                self.list_altered = True
-                self.set_in_room(j["data"]["user"]["id"], False)
-                if j["data"]["user"]["id"] == self.user["id"]:
-                    self.in_room = []
-                    self.find_user()
-                    self.discover.voice_overlay.set_channel_title(None)
-                    self.discover.voice_overlay.set_channel_icon(None)
-                    # User might have been forcibly moved room
-            elif j["evt"] == "SPEAKING_START":
-                self.list_altered = True
-                self.userlist[j["data"]["user_id"]]["speaking"] = True
-                self.userlist[j["data"]["user_id"]]["lastspoken"] = time.perf_counter()
-                self.set_in_room(j["data"]["user_id"], True)
-            elif j["evt"] == "SPEAKING_STOP":
-                self.list_altered = True
-                if j["data"]["user_id"] in self.userlist:
-                    self.userlist[j["data"]["user_id"]]["speaking"] = False
-                self.set_in_room(j["data"]["user_id"], True)
-            elif j["evt"] == "VOICE_CHANNEL_SELECT":
-                if j["data"]["channel_id"]:
-                    self.set_channel(j["data"]["channel_id"],
-                                     j["data"]["guild_id"])
-                else:
-                    self.set_channel(None, None)
-            elif j["evt"] == "VOICE_CONNECTION_STATUS":
-                self.discover.voice_overlay.set_connection_status(j["data"])
-            elif j["evt"] == "MESSAGE_CREATE":
-                if self.current_text == j["data"]["channel_id"]:
-                    self.add_text(j["data"]["message"])
-            elif j["evt"] == "MESSAGE_UPDATE":
-                if self.current_text == j["data"]["channel_id"]:
-                    self.update_text(j["data"]["message"])
-            elif j["evt"] == "MESSAGE_DELETE":
-                if self.current_text == j["data"]["channel_id"]:
-                    self.delete_text(j["data"]["message"])
-            elif j["evt"] == "CHANNEL_CREATE":
-                # We haven't been told what guild this is in
-                self.req_channel_details(j["data"]["id"], 'new')
-            elif j["evt"] == "NOTIFICATION_CREATE":
-                self.discover.notification_overlay.add_notification_message(j)
-            elif j["evt"] == "VOICE_SETTINGS_UPDATE":
-                source = j['data']['input']['device_id']
-                sink = j['data']['output']['device_id']
-                if sink == 'default':
-                    for available_sink in j['data']['output']['available_devices']:
-                        if available_sink['id'] == 'default':
-                            sink = available_sink['name'][9:]
-                if source == 'default':
-                    for available_source in j['data']['input']['available_devices']:
-                        if available_source['id'] == 'default':
-                            source = available_source['name'][9:]
-                self.discover.audio_assist.set_devices(sink, source)
-
-            else:
-                log.warning(j)
-            return
-        elif j["cmd"] == "AUTHENTICATE":
-            if j["evt"] == "ERROR":
-                self.access_token = None
-                self.get_access_token_stage1()
-                return
-            else:
-                self.discover.config_set(
-                    "cache", "access_token", self.access_token)
-                self.req_guilds()
-                self.user = j["data"]["user"]
-                log.info(
-                    "ID is %s", self.user["id"])
-                log.info(
-                    "Logged in as %s", self.user["username"])
-                self.authed = True
-                self.on_connected()
-                return
-        elif j["cmd"] == "GET_GUILDS":
-            for guild in j["data"]["guilds"]:
-                self.guilds[guild["id"]] = guild
-                self.dump_channel_data()
-            return
-        elif j["cmd"] == "GET_GUILD":
-            # We currently only get here because of a "CHANNEL_CREATE" event.
-            # Stupidly long winded way around
-            if j["data"]:
-                guild = j["data"]
-            self.dump_channel_data()
-
-            return
-        elif j["cmd"] == "GET_CHANNELS":
-            if j['evt'] == 'ERROR':
-                log.error('%s', j['data']['message'])
-                return
-            self.guilds[j['nonce']]["channels"] = j["data"]["channels"]
-            for channel in j["data"]["channels"]:
-                channel['guild_id'] = j['nonce']
-                channel['guild_name'] = self.guilds[j['nonce']]["name"]
-                self.channels[channel["id"]] = channel
-                if channel["type"] == 2:
-                    self.req_channel_details(channel["id"])
-            self.dump_channel_data()
-            return
-        elif j["cmd"] == "SUBSCRIBE":
-            # Only log errors
-            if j['evt']:
-                log.warning(j)
-            return
-        elif j["cmd"] == "UNSUBSCRIBE":
-            return
-        elif j["cmd"] == "GET_SELECTED_VOICE_CHANNEL":
-            if 'data' in j and j['data'] and 'id' in j['data']:
-                self.set_channel(j['data']['id'], j['data']['guild_id'])
-                self.discover.voice_overlay.set_channel_title(
-                    j["data"]["name"])
-                if (self.current_guild in self.guilds and
-                   'icon_url' in self.guilds[self.current_guild]):
-                    self.discover.voice_overlay.set_channel_icon(
-                        self.guilds[self.current_guild]['icon_url'])
-                else:
-                    self.discover.voice_overlay.set_channel_icon(None)
-                self.list_altered = True
-                self.in_room = []
-                for u in j['data']['voice_states']:
-                    thisuser = u["user"]
-                    nick = u["nick"]
-                    thisuser["nick"] = nick
-                    mute = (u["voice_state"]["mute"] or
-                            u["voice_state"]["self_mute"] or
-                            u["voice_state"]["suppress"])
-                    deaf = u["voice_state"]["deaf"] or u["voice_state"]["self_deaf"]
-                    thisuser["mute"] = mute
-                    thisuser["deaf"] = deaf
-                    self.update_user(thisuser)
-                    self.set_in_room(thisuser["id"], True)
-            return
-        elif j["cmd"] == "GET_CHANNEL":
-            if j["evt"] == "ERROR":
-                log.info(
-                    "Could not get room")
-                return
-            if j["nonce"] == "new":
-                self.req_channels(j["data"]["guild_id"])
-            if j["data"]["type"] == 0:  # Text channel
-                if self.current_text == j["data"]["id"]:
-                    self.text = []
-                    for message in j["data"]["messages"]:
-                        self.add_text(message)
+                self.set_in_room(thisuser["id"], True)
 
-            return
-        elif j["cmd"] == "SELECT_VOICE_CHANNEL":
-            return
-        elif j["cmd"] == "SET_VOICE_SETTINGS":
-            self.muted = j['data']['mute']
-            self.deafened = j['data']['deaf']
-            return
-        elif j["cmd"] == "GET_VOICE_SETTINGS":
-            return
-        log.warning(j)
+    def handle_get_channel_error(self, _j):
+        """Channel details could not be fetched"""
+        log.info(
+            "Could not get room")
+
+    def handle_get_channel(self, j):
+        """Details of one channel"""
+        if j["nonce"] == "new":
+            self.req_channels(j["data"]["guild_id"])
+        if j["data"]["type"] == 0:  # Text channel
+            if self.current_text == j["data"]["id"]:
+                self.text.clear()
+                for message in j["data"]["messages"]:
+                    self.add_text(message)
+
+    def handle_set_voice_settings(self, j):
+        """Our own mute and deaf state"""
+        self.muted = j['data']['mute']
+        self.deafened = j['data']['deaf']
 
     def dump_channel_data(self):
         """ Write all channel data out to file"""
         with open(self.discover.channel_file, 'w', encoding="utf-8") as f:
             f.write(json.dumps(
-                {'channels': self.channels, 'guild': self.guilds}))
+                {'channels': {channel_id: channel.to_dict()
+                              for (channel_id, channel) in self.channels.items()},
+                 'guild': {guild_id: guild.to_dict()
+                           for (guild_id, guild) in self.guilds.items()}}))
 
     def on_connected(self):
         """
@@ -493,6 +628,7 @@ class DiscordConnector:
         Called when connection is closed
         """
         log.warning("Connection closed")
+        self.log_event_stats()
         if self.socket_watch:
             GLib.source_remove(self.socket_watch)
             self.socket_watch = None
@@ -512,7 +648,7 @@ class DiscordConnector:
             },
             "nonce": "deadbeef"
         }
-        self.websocket.send(json.dumps(cmd))
+        self.websocket.send(rpc_codec.encode(cmd))
 
     def req_guild(self, guild_id, nonce):
         """
@@ -523,7 +659,7 @@ class DiscordConnector:
             "args": {"guild_id": guild_id},
             "nonce": nonce
         }
-        self.websocket.send(json.dumps(cmd))
+        self.websocket.send(rpc_codec.encode(cmd))
 
     def req_guilds(self):
         """
@@ -534,7 +670,7 @@ class DiscordConnector:
             "args": {},
             "nonce": "deadbeef"
         }
-        self.websocket.send(json.dumps(cmd))
+        self.websocket.send(rpc_codec.encode(cmd))
 
     def req_channels(self, guild):
         """
@@ -562,7 +698,7 @@ class DiscordConnector:
             },
             "nonce": nonce
         }
-        self.websocket.send(json.dumps(cmd))
+        self.websocket.send(rpc_codec.encode(cmd))
 
     def find_user(self):
         """
@@ -576,7 +712,7 @@ class DiscordConnector:
             },
             "nonce": "test"
         }
-        self.websocket.send(json.dumps(cmd))
+        self.websocket.send(rpc_codec.encode(cmd))
 
     def sub_raw(self, event, args, nonce):
         """
@@ -588,7 +724,7 @@ class DiscordConnector:
             "evt": event,
             "nonce": nonce
         }
-        self.websocket.send(json.dumps(cmd))
+        self.websocket.send(rpc_codec.encode(cmd))
 
     def unsub_raw(self, event, args, nonce):
         """
@@ -600,7 +736,7 @@ class DiscordConnector:
             "evt": event,
             "nonce": nonce
         }
-        self.websocket.send(json.dumps(cmd))
+        self.websocket.send(rpc_codec.encode(cmd))
 
     def sub_server(self):
         """
@@ -675,7 +811,7 @@ class DiscordConnector:
             "nonce": "deadbeef"
         }
         if self.websocket:
-            self.websocket.send(json.dumps(cmd))
+            self.websocket.send(rpc_codec.encode(cmd))
 
     def set_mute(self, muted):
         """ Set client muted status """
@@ -685,7 +821,7 @@ class DiscordConnector:
             "nonce": "deadbeef"
         }
         if self.websocket:
-            self.websocket.send(json.dumps(cmd))
+            self.websocket.send(rpc_codec.encode(cmd))
         return False
 
     def set_deaf(self, deaf):
@@ -696,7 +832,7 @@ class DiscordConnector:
             "nonce": "deadbeef"
         }
         if self.websocket:
-            self.websocket.send(json.dumps(cmd))
+            self.websocket.send(rpc_codec.encode(cmd))
         return False
 
     def change_voice_room(self, room_id):
@@ -712,7 +848,7 @@ class DiscordConnector:
             "nonce": "deadbeef"
         }
         if self.websocket:
-            self.websocket.send(json.dumps(cmd))
+            self.websocket.send(rpc_codec.encode(cmd))
 
     def change_text_room(self, room_id):
         """
@@ -726,7 +862,7 @@ class DiscordConnector:
             "nonce": "deadbeef"
         }
         if self.websocket:
-            self.websocket.send(json.dumps(cmd))
+            self.websocket.send(rpc_codec.encode(cmd))
 
     def update_overlays_from_data(self):
         """Send new data out to overlay windows"""
@@ -737,17 +873,13 @@ class DiscordConnector:
             if self.discover.notification_overlay:
                 self.discover.notification_overlay.set_blank()
             return
-        newlist = []
-        for userid in self.in_room:
-            newlist.append(self.userlist[userid])
-        self.discover.voice_overlay.set_user_list(newlist, self.list_altered)
+        self.discover.voice_overlay.set_user_list(
+            self.get_room_members(), self.list_altered)
         self.list_altered = False
         # Update text list
-        if self.discover.text_overlay.popup_style:
-            self.text_altered = True
-        if self.text_altered:
+        if self.text_altered and self.discover.text_overlay:
             self.discover.text_overlay.set_text_list(
-                self.text, self.text_altered)
+                self.text.messages(), self.text_altered)
             self.text_altered = False
 
         if self.authed and len(self.rate_limited_channels) > 0:
@@ -762,7 +894,7 @@ class DiscordConnector:
                     },
                     "nonce": guild
                 }
-                self.websocket.send(json.dumps(cmd))
+                self.websocket.send(rpc_codec.encode(cmd))
                 self.last_rate_limit_send = now
 
     def start_listening_text(self, channel):
@@ -841,7 +973,7 @@ class DiscordConnector:
                         break
                     recv, _w, _e = select.select(
                         (self.websocket.sock,), (), (), 0)
-                except (websocket.WebSocketConnectionClosedException, json.decoder.JSONDecodeError):
+                except (websocket.WebSocketConnectionClosedException, *rpc_codec.DECODE_ERRORS):
                     self.on_close()
                     break
             self.update_overlays_from_data()
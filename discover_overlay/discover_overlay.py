@@ -10,7 +10,12 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
-"""Main application class"""
+"""Main application class
+
+Only the standard library is imported here. GTK, the overlays, the
+Discord connection and audio assist are imported once they are needed,
+so that controller invocations such as --mute return quickly"""
+# pylint: disable=import-outside-toplevel
 import gettext
 import os
 import sys
@@ -20,19 +25,6 @@ import logging
 import json
 import signal
 from configparser import ConfigParser
-import gi
-import pkg_resources
-
-from .settings_window import MainSettingsWindow
-from .voice_overlay import VoiceOverlayWindow
-from .text_overlay import TextOverlayWindow
-from .notification_overlay import NotificationOverlayWindow
-from .discord_connector import DiscordConnector
-from .audio_assist import DiscoverAudioAssist
-
-gi.require_version("Gtk", "3.0")
-# pylint: disable=wrong-import-position,wrong-import-order
-from gi.repository import Gtk, GLib, Gio  # nopep8
 
 try:
     from xdg.BaseDirectory import xdg_config_home
@@ -41,14 +33,35 @@ except ModuleNotFoundError:
 
 log = logging.getLogger(__name__)
 t = gettext.translation(
-    'default', pkg_resources.resource_filename('discover_overlay', 'locales'), fallback=True)
+    'default', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales'),
+    fallback=True)
 _ = t.gettext
 
 
+def get_version():
+    """Return the installed version of discover-overlay"""
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        return version('discover-overlay')
+    except PackageNotFoundError:
+        return "unknown, not installed"
+
+
+def require_gtk():
+    """Import GTK 3"""
+    import gi
+    gi.require_version("Gtk", "3.0")
+
+
 class Discover:
     """Main application class"""
 
     def __init__(self, rpc_file, config_file, channel_file, debug_file, args):
+        require_gtk()
+        from gi.repository import Gtk, Gio
+        from .frame_scheduler import FrameScheduler
+        from .discord_connector import DiscordConnector
+
         self.mix_settings = False
         self.ind = None
         self.tray = None
@@ -56,6 +69,11 @@ class Discover:
         self.connection = None
         self.show_settings_delay = False
         self.settings = None
+        # Created once enabled in config
+        self.text_overlay = None
+        self.notification_overlay = None
+        self.audio_assist = None
+        self.audio_devices = (None, None)
 
         self.debug_file = debug_file
         self.channel_file = channel_file
@@ -74,12 +92,12 @@ class Discover:
                 settings.set_property(
                     "gtk-application-prefer-dark-theme", Gtk.true)
 
+        self.frame_scheduler = FrameScheduler()
         self.create_gui()
 
         self.connection = DiscordConnector(self)
 
         self.connection.connect()
-        self.audio_assist = DiscoverAudioAssist(self)
 
         rpc_file_gio = Gio.File.new_for_path(rpc_file)
         monitor = rpc_file_gio.monitor_file(0, None)
@@ -278,115 +296,131 @@ class Discover:
         )
 
         # Set Text overlay options
-        self.text_overlay.set_enabled(config.getboolean(
-            "text", "enabled", fallback=False))
-        self.text_overlay.set_align_x(config.getboolean(
-            "text", "rightalign", fallback=True))
-        self.text_overlay.set_align_y(
-            config.getint("text", "topalign", fallback=2))
-        floating = config.getboolean("text", "floating", fallback=True)
-        floating_x = config.getfloat("text", "floating_x", fallback=0.0)
-        floating_y = config.getfloat("text", "floating_y", fallback=0.0)
-        floating_w = config.getfloat("text", "floating_w", fallback=0.1)
-        floating_h = config.getfloat("text", "floating_h", fallback=0.1)
+        text_enabled = config.getboolean("text", "enabled", fallback=False)
+        notification_enabled = config.getboolean(
+            "notification", "enabled", fallback=False)
+        self.create_optional_overlays(text_enabled, notification_enabled)
 
         channel = config.get("text", "channel", fallback="0")
         guild = config.get("text", "guild", fallback="0")
         self.connection.set_text_channel(channel, guild)
+        line_limit = config.getint("text", "line_limit", fallback=20)
+        self.connection.set_text_limit(line_limit)
 
-        self.font = config.get("text", "font", fallback=None)
-        self.text_overlay.set_bg(json.loads(config.get(
-            "text", "bg_col", fallback="[0.0,0.0,0.0,0.5]")))
-        self.text_overlay.set_fg(json.loads(config.get(
-            "text", "fg_col", fallback="[1.0,1.0,1.0,1.0]")))
-        self.text_overlay.set_popup_style(config.getboolean(
-            "text", "popup_style", fallback=False))
-        self.text_overlay.set_text_time(
-            config.getint("text", "text_time", fallback=30))
-        self.text_overlay.set_show_attach(config.getboolean(
-            "text", "show_attach", fallback=True))
-        self.text_overlay.set_line_limit(
-            config.getint("text", "line_limit", fallback=20))
-        self.text_overlay.set_hide_on_mouseover(
-            config.getboolean("text", "autohide", fallback=False))
-        self.text_overlay.set_mouseover_timer(
-            config.getint("text", "autohide_timer", fallback=1))
-
-        self.text_overlay.set_monitor(
-            config.get("text", "monitor", fallback="Any")
-        )
-        self.text_overlay.set_floating(
-            floating, floating_x, floating_y, floating_w, floating_h)
-
-        if self.font:
-            self.text_overlay.set_font(self.font)
+        if self.text_overlay:
+            self.text_overlay.set_enabled(text_enabled)
+            self.text_overlay.set_align_x(config.getboolean(
+                "text", "rightalign", fallback=True))
+            self.text_overlay.set_align_y(
+                config.getint("text", "topalign", fallback=2))
+            floating = config.getboolean("text", "floating", fallback=True)
+            floating_x = config.getfloat("text", "floating_x", fallback=0.0)
+            floating_y = config.getfloat("text", "floating_y", fallback=0.0)
+            floating_w = config.getfloat("text", "floating_w", fallback=0.1)
+            floating_h = config.getfloat("text", "floating_h", fallback=0.1)
+
+            self.font = config.get("text", "font", fallback=None)
+            self.text_overlay.set_bg(json.loads(config.get(
+                "text", "bg_col", fallback="[0.0,0.0,0.0,0.5]")))
+            self.text_overlay.set_fg(json.loads(config.get(
+                "text", "fg_col", fallback="[1.0,1.0,1.0,1.0]")))
+            self.text_overlay.set_popup_style(config.getboolean(
+                "text", "popup_style", fallback=False))
+            self.text_overlay.set_text_time(
+                config.getint("text", "text_time", fallback=30))
+            self.text_overlay.set_show_attach(config.getboolean(
+                "text", "show_attach", fallback=True))
+            self.text_overlay.set_line_limit(line_limit)
+            self.text_overlay.set_hide_on_mouseover(
+                config.getboolean("text", "autohide", fallback=False))
+            self.text_overlay.set_mouseover_timer(
+                config.getint("text", "autohide_timer", fallback=1))
+
+            self.text_overlay.set_monitor(
+                config.get("text", "monitor", fallback="Any")
+            )
+            self.text_overlay.set_floating(
+                floating, floating_x, floating_y, floating_w, floating_h)
+
+            if self.font:
+                self.text_overlay.set_font(self.font)
 
         # Set Notification overlay options
-        self.notification_overlay.set_enabled(config.getboolean(
-            "notification", "enabled", fallback=False))
-        self.notification_overlay.set_align_x(config.getboolean(
-            "notification", "rightalign", fallback=True))
-        self.notification_overlay.set_align_y(
-            config.getint("notification", "topalign", fallback=2))
-        floating = config.getboolean(
-            "notification", "floating", fallback=False)
-        floating_x = config.getfloat(
-            "notification", "floating_x", fallback=0.0)
-        floating_y = config.getfloat(
-            "notification", "floating_y", fallback=0.0)
-        floating_w = config.getfloat(
-            "notification", "floating_w", fallback=0.1)
-        floating_h = config.getfloat(
-            "notification", "floating_h", fallback=0.1)
-        font = config.get("notification", "font", fallback=None)
-        self.notification_overlay.set_bg(json.loads(config.get(
-            "notification", "bg_col", fallback="[0.0,0.0,0.0,0.5]")))
-        self.notification_overlay.set_fg(json.loads(config.get(
-            "notification", "fg_col", fallback="[1.0,1.0,1.0,1.0]")))
-        self.notification_overlay.set_text_time(config.getint(
-            "notification", "text_time", fallback=10))
-        self.notification_overlay.set_show_icon(config.getboolean(
-            "notification", "show_icon", fallback=True))
-        self.notification_overlay.set_reverse_order(config.getboolean(
-            "notification", "rev", fallback=False))
-        self.notification_overlay.set_limit_width(config.getint(
-            "notification", "limit_width", fallback=400))
-        self.notification_overlay.set_icon_left(config.getboolean(
-            "notification", "icon_left", fallback=True))
-        self.notification_overlay.set_icon_pad(config.getint(
-            "notification", "icon_padding", fallback=8))
-        self.notification_overlay.set_icon_size(config.getint(
-            "notification", "icon_size", fallback=32))
-        self.notification_overlay.set_padding(config.getint(
-            "notification", "padding", fallback=8))
-        self.notification_overlay.set_border_radius(config.getint(
-            "notification", "border_radius", fallback=8))
-        self.notification_overlay.set_testing(config.getboolean(
-            "notification", "show_dummy", fallback=False))
-        self.font = config.get("notification", "font", fallback=None)
-
-        if self.font:
-            self.notification_overlay.set_font(self.font)
-
-        self.notification_overlay.set_monitor(
-            config.get("notification", "monitor", fallback="Any")
-        )
-        self.notification_overlay.set_floating(
-            floating, floating_x, floating_y, floating_w, floating_h)
-        if self.font:
-            self.notification_overlay.set_font(self.font)
+        if self.notification_overlay:
+            self.notification_overlay.set_enabled(notification_enabled)
+            self.notification_overlay.set_align_x(config.getboolean(
+                "notification", "rightalign", fallback=True))
+            self.notification_overlay.set_align_y(
+                config.getint("notification", "topalign", fallback=2))
+            floating = config.getboolean(
+                "notification", "floating", fallback=False)
+            floating_x = config.getfloat(
+                "notification", "floating_x", fallback=0.0)
+            floating_y = config.getfloat(
+                "notification", "floating_y", fallback=0.0)
+            floating_w = config.getfloat(
+                "notification", "floating_w", fallback=0.1)
+            floating_h = config.getfloat(
+                "notification", "floating_h", fallback=0.1)
+            font = config.get("notification", "font", fallback=None)
+            self.notification_overlay.set_bg(json.loads(config.get(
+                "notification", "bg_col", fallback="[0.0,0.0,0.0,0.5]")))
+            self.notification_overlay.set_fg(json.loads(config.get(
+                "notification", "fg_col", fallback="[1.0,1.0,1.0,1.0]")))
+            self.notification_overlay.set_text_time(config.getint(
+                "notification", "text_time", fallback=10))
+            self.notification_overlay.set_show_icon(config.getboolean(
+                "notification", "show_icon", fallback=True))
+            self.notification_overlay.set_reverse_order(config.getboolean(
+                "notification", "rev", fallback=False))
+            self.notification_overlay.set_limit_width(config.getint(
+                "notification", "limit_width", fallback=400))
+            self.notification_overlay.set_icon_left(config.getboolean(
+                "notification", "icon_left", fallback=True))
+            self.notification_overlay.set_icon_pad(config.getint(
+                "notification", "icon_padding", fallback=8))
+            self.notification_overlay.set_icon_size(config.getint(
+                "notification", "icon_size", fallback=32))
+            self.notification_overlay.set_padding(config.getint(
+                "notification", "padding", fallback=8))
+            self.notification_overlay.set_border_radius(config.getint(
+                "notification", "border_radius", fallback=8))
+            self.notification_overlay.set_testing(config.getboolean(
+                "notification", "show_dummy", fallback=False))
+            self.font = config.get("notification", "font", fallback=None)
+
+            if self.font:
+                self.notification_overlay.set_font(self.font)
+
+            self.notification_overlay.set_monitor(
+                config.get("notification", "monitor", fallback="Any")
+            )
+            self.notification_overlay.set_floating(
+                floating, floating_x, floating_y, floating_w, floating_h)
+            if self.font:
+                self.notification_overlay.set_font(self.font)
 
         # Set Core settings
         self.set_force_xshape(
             config.getboolean("general", "xshape", fallback=False))
+        self.frame_scheduler.set_max_fps(
+            config.getint("general", "max_fps", fallback=60))
 
         hidden = config.getboolean("general", "hideoverlay", fallback=False)
         self.voice_overlay.set_hidden(hidden)
-        self.text_overlay.set_hidden(hidden)
-        self.notification_overlay.set_hidden(hidden)
+        if self.text_overlay:
+            self.text_overlay.set_hidden(hidden)
+        if self.notification_overlay:
+            self.notification_overlay.set_hidden(hidden)
 
-        self.audio_assist.set_enabled(config.getboolean(
-            "general", "audio_assist", fallback=False))
+        audio_assist = config.getboolean(
+            "general", "audio_assist", fallback=False)
+        if audio_assist and not self.audio_assist:
+            from .audio_assist import DiscoverAudioAssist
+            self.audio_assist = DiscoverAudioAssist(self)
+            self.audio_assist.set_devices(*self.audio_devices)
+        if self.audio_assist:
+            self.audio_assist.set_enabled(audio_assist)
 
     def parse_guild_ids(self, guild_ids_str):
         """Parse the guild_ids from a str and return them in a list"""
@@ -401,20 +435,48 @@ class Discover:
         """
         Create Systray & associated menu, overlays & settings windows
         """
+        from .voice_overlay import VoiceOverlayWindow
         self.voice_overlay = VoiceOverlayWindow(self)
 
-        if self.steamos:
-            self.text_overlay = TextOverlayWindow(self, self.voice_overlay)
-            self.notification_overlay = NotificationOverlayWindow(
-                self, self.text_overlay)
-        else:
-            self.text_overlay = TextOverlayWindow(self)
-            self.notification_overlay = NotificationOverlayWindow(self)
-
         if self.mix_settings:
+            from .settings_window import MainSettingsWindow
             MainSettingsWindow(
                 self.config_file, self.rpc_file, self.channel_file, [])
 
+    def create_optional_overlays(self, text_enabled, notification_enabled):
+        """
+        Create the text and notification overlays the first time they are enabled.
+        On SteamOS the notification overlay piggybacks on the text overlay,
+        so it needs one to exist even if it is not shown
+        """
+        if not self.text_overlay and (text_enabled or (
+                self.steamos and notification_enabled)):
+            from .text_overlay import TextOverlayWindow
+            if self.steamos:
+                self.text_overlay = TextOverlayWindow(self, self.voice_overlay)
+            else:
+                self.text_overlay = TextOverlayWindow(self)
+            # Show the messages that arrived before it existed
+            self.text_overlay.set_text_list(
+                self.connection.text.messages(), True)
+        if not self.notification_overlay and notification_enabled:
+            from .notification_overlay import NotificationOverlayWindow
+            if self.steamos:
+                self.notification_overlay = NotificationOverlayWindow(
+                    self, self.text_overlay)
+            else:
+                self.notification_overlay = NotificationOverlayWindow(self)
+            missed = self.connection.missed_notifications
+            while missed:
+                (received, j) = missed.popleft()
+                self.notification_overlay.add_notification_message(j, received)
+
+    def set_audio_devices(self, sink, source):
+        """Set the names of the audio devices Discord is using"""
+        self.audio_devices = (sink, source)
+        if self.audio_assist:
+            self.audio_assist.set_devices(sink, source)
+
     def toggle_show(self, _obj=None):
         """Toggle all overlays off or on"""
         if self.voice_overlay:
@@ -429,6 +491,7 @@ class Discover:
         """
         End of the program
         """
+        from gi.repository import Gtk
         Gtk.main_quit()
 
     def set_force_xshape(self, force):
@@ -454,11 +517,13 @@ class Discover:
     def set_mute_async(self, mute):
         """Set mute status from another thread"""
         if mute is not None:
+            from gi.repository import GLib
             GLib.idle_add(self.connection.set_mute, mute)
 
     def set_deaf_async(self, deaf):
         """Set deaf status from another thread"""
         if deaf is not None:
+            from gi.repository import GLib
             GLib.idle_add(self.connection.set_deaf, deaf)
 
 def show_help():
@@ -490,7 +555,7 @@ def show_help():
         print(_("For gamescope compatibility ensure ENV has 'GDK_BACKEND=x11'"))
 
 def show_version():
-        print(pkg_resources.get_distribution('discover_overlay').version)
+        print(get_version())
 
 def is_a_controller(argv):
 
@@ -547,6 +612,9 @@ def entrypoint():
     debug_file = os.path.join(config_dir, "output.txt")
 
     if "-c" in sys.argv or "--configure" in sys.argv:
+        require_gtk()
+        from gi.repository import Gtk
+        from .settings_window import MainSettingsWindow
         _settings = MainSettingsWindow(config_file, rpc_file, channel_file, sys.argv[1:])
         Gtk.main()
         return
@@ -566,7 +634,7 @@ def entrypoint():
     else:
         logging.basicConfig(format=log_format)
     log.info("Starting Discover Overlay: %s",
-             pkg_resources.get_distribution('discover_overlay').version)
+             get_version())
 
     # Hedge against the bet gamescope ships with some WAYLAND_DISPLAY
     # Compatibility and we're not ready yet
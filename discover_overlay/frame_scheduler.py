@@ -0,0 +1,143 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Redraw scheduling shared by all overlays"""
+import heapq
+import logging
+import math
+from time import perf_counter
+from gi.repository import GLib
+
+log = logging.getLogger(__name__)
+
+# Range accepted for the frame rate limit
+MIN_FPS = 1
+MAX_FPS = 240
+
+
+class FrameScheduler:
+    """
+    Coalesces redraw requests from all overlays into at most one paint
+    per frame, and keeps a single timer for the next redraw deadline
+    """
+
+    def __init__(self, max_fps=60):
+        self.max_fps = None
+        self.set_max_fps(max_fps)
+        self.pending = []
+        self.frame_source = None
+        self.last_frame = 0
+
+        # Heap of (time, sequence, overlay, area)
+        self.deadlines = []
+        self.deadline_sequence = 0
+        self.deadline_source = None
+        self.deadline_time = None
+        self.last_deadline = {}
+
+    def set_max_fps(self, max_fps):
+        """Config option: Limit how often overlays are painted.
+        Clamped to MIN_FPS..MAX_FPS"""
+        self.max_fps = min(MAX_FPS, max(MIN_FPS, max_fps))
+
+    def frame_time(self):
+        """Return the minimum time between two frames, in seconds"""
+        return 1.0 / self.max_fps
+
+    def request_redraw(self, overlay):
+        """Schedule overlay to be redrawn in the next frame"""
+        while overlay.piggyback_parent:
+            overlay = overlay.piggyback_parent
+        if overlay not in self.pending:
+            self.pending.append(overlay)
+        if self.frame_source is None:
+            delay = self.last_frame + self.frame_time() - perf_counter()
+            if delay <= 0:
+                self.frame_source = GLib.idle_add(self.frame)
+            else:
+                self.frame_source = GLib.timeout_add(
+                    math.ceil(delay * 1000), self.frame)
+
+    def frame(self):
+        """Redraw every overlay that asked since the last frame"""
+        self.frame_source = None
+        self.last_frame = perf_counter()
+        pending = self.pending
+        self.pending = []
+        for overlay in pending:
+            overlay.redraw()
+        return False
+
+    def add_deadline(self, overlay, when, area=None):
+        """Redraw overlay at the time when, as given by perf_counter.
+        Without an area the overlay is told to expire() and redrawn in
+        full, otherwise only the window-space area is redrawn.
+        A deadline less than a frame before one already set for the same
+        overlay and area is merged into it"""
+        last = self.last_deadline.get((overlay, area))
+        if last is not None and 0 <= last - when < self.frame_time():
+            return
+        self.last_deadline[(overlay, area)] = when
+        self.deadline_sequence += 1
+        heapq.heappush(self.deadlines,
+                       (when, self.deadline_sequence, overlay, area))
+        self.update_deadline_timer()
+
+    def animation_clock(self):
+        """Return the time, in seconds, every animation takes its frame from"""
+        return perf_counter()
+
+    def add_animation_frame(self, overlay, animation, area):
+        """Return the frame of animation to draw now in area of overlay,
+        and redraw the area when the frame changes"""
+        now = self.animation_clock()
+        (frame, remaining) = animation.frame_at(now)
+        self.add_deadline(overlay, now + remaining, area)
+        return frame
+
+    def update_deadline_timer(self):
+        """Make sure the one timer is set for the earliest deadline"""
+        if not self.deadlines:
+            if self.deadline_source:
+                GLib.source_remove(self.deadline_source)
+            self.deadline_source = None
+            self.deadline_time = None
+            return
+        earliest = self.deadlines[0][0]
+        if self.deadline_source and self.deadline_time <= earliest:
+            return
+        if self.deadline_source:
+            GLib.source_remove(self.deadline_source)
+        delay = max(0, earliest - perf_counter())
+        self.deadline_source = GLib.timeout_add(
+            math.ceil(delay * 1000), self.deadline_reached)
+        self.deadline_time = earliest
+
+    def deadline_reached(self):
+        """Timer callback. Redraw every overlay whose deadline has passed"""
+        self.deadline_source = None
+        self.deadline_time = None
+        now = perf_counter()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            (when, _sequence, overlay, area) = heapq.heappop(self.deadlines)
+            if self.last_deadline.get((overlay, area)) == when:
+                del self.last_deadline[(overlay, area)]
+            if area is not None:
+                overlay.set_needs_redraw(area=area)
+                continue
+            overlay.expire()
+            while overlay.piggyback_parent:
+                overlay = overlay.piggyback_parent
+            overlay.damage_full = True
+            self.request_redraw(overlay)
+        self.update_deadline_timer()
+        return False
@@ -15,42 +15,430 @@ import threading
 import logging
 import os
 import copy
+import math
+import json
+import struct
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import gi
 import requests
+from requests.adapters import HTTPAdapter
 import cairo
 import PIL
 import PIL.Image as Image
 gi.require_version('GdkPixbuf', '2.0')
 gi.require_version("Gtk", "3.0")
 # pylint: disable=wrong-import-position
-from gi.repository import Gtk  # nopep8
+from gi.repository import Gtk, GLib  # nopep8
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from xdg.BaseDirectory import xdg_cache_home
+except ModuleNotFoundError:
+    from xdg import XDG_CACHE_HOME as xdg_cache_home
 
 log = logging.getLogger(__name__)
 
 
+class ImageCache():
+    """On-disk cache of decoded images, keyed by URL and the size decoded at.
+
+    Each entry holds the premultiplied ARGB32 pixel data as produced by
+    pil_to_data along with the HTTP validators needed to revalidate it.
+    Least recently used entries are removed once the cache grows past max_size"""
+
+    MAGIC = b"DOIC"
+    HEADER = struct.Struct("<4sIIBI")
+
+    def __init__(self, path, max_size=64 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = None
+        self.total_size = 0
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _scan(self):
+        """Build the LRU index from the files already on disk"""
+        if self.entries is not None:
+            return
+        self.entries = OrderedDict()
+        self.total_size = 0
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            files = []
+            for name in os.listdir(self.path):
+                if name.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(self.path, name))
+                files.append((stat.st_mtime, name, stat.st_size))
+        except OSError as error:
+            log.warning("Unable to use image cache %s : %s", self.path, error)
+            return
+        for (_mtime, name, size) in sorted(files):
+            self.entries[name] = size
+            self.total_size += size
+
+    def load(self, url):
+        """Return (data, width, height, has_alpha, meta) for url or None"""
+        key = self._key(url)
+        filename = os.path.join(self.path, key)
+        with self.lock:
+            self._scan()
+            if key not in self.entries:
+                return None
+            try:
+                with open(filename, "rb") as file:
+                    (magic, width, height, has_alpha, meta_len) = self.HEADER.unpack(
+                        file.read(self.HEADER.size))
+                    meta = json.loads(file.read(meta_len))
+                    data = bytearray(file.read())
+                os.utime(filename)
+            except (OSError, ValueError, struct.error):
+                self._remove(key)
+                return None
+            if magic != self.MAGIC or meta.get("url") != url or len(data) != width * height * 4:
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+        return (data, width, height, bool(has_alpha), meta)
+
+    def store(self, url, data, width, height, has_alpha, etag=None, last_modified=None):
+        """Write decoded pixel data for url, evicting old entries if needed"""
+        key = self._key(url)
+        filename = os.path.join(self.path, key)
+        meta = json.dumps({"url": url, "etag": etag,
+                           "last_modified": last_modified}).encode("utf-8")
+        with self.lock:
+            self._scan()
+            try:
+                with open(filename + ".tmp", "wb") as file:
+                    file.write(self.HEADER.pack(self.MAGIC, width, height,
+                                                1 if has_alpha else 0, len(meta)))
+                    file.write(meta)
+                    file.write(data)
+                os.replace(filename + ".tmp", filename)
+                size = os.stat(filename).st_size
+            except OSError as error:
+                log.warning("Unable to write to image cache : %s", error)
+                return
+            if key in self.entries:
+                self.total_size -= self.entries[key]
+            self.entries[key] = size
+            self.entries.move_to_end(key)
+            self.total_size += size
+            while self.total_size > self.max_size and len(self.entries) > 1:
+                (old_key, _size) = next(iter(self.entries.items()))
+                self._remove(old_key)
+
+    def touch(self, url):
+        """Mark url as recently used without reading it"""
+        key = self._key(url)
+        with self.lock:
+            self._scan()
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                try:
+                    os.utime(os.path.join(self.path, key))
+                except OSError:
+                    pass
+
+    def _remove(self, key):
+        """Drop an entry from disk and the index. Lock must be held"""
+        if key in self.entries:
+            self.total_size -= self.entries.pop(key)
+        try:
+            os.remove(os.path.join(self.path, key))
+        except OSError:
+            pass
+
+
+class SurfaceCache():
+    """In-memory cache of cairo surfaces, keyed by URL.
+
+    Least recently used surfaces are dropped once their pixel data adds
+    up to more than max_bytes. A key may be held with no surface, to mark
+    an image as already requested.
+
+    Keys used while drawing a frame are kept until the next frame is
+    finished, even if that goes over budget. Otherwise an image that is
+    on screen could be dropped and fetched again on every frame.
+
+    At most max_animations Animations are kept. Beyond that the least
+    recently used is replaced by its first frame. So is an Animation
+    that would not fit alongside the images in use"""
+
+    def __init__(self, max_bytes, max_animations=None):
+        self.max_bytes = max_bytes
+        self.max_animations = max_animations
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        # Keys used by the frame being drawn, and by the last one drawn
+        self.drawing = set()
+        self.shown = set()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """Return the surface for key, or None, marking it recently used"""
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, surface):
+        """Store surface for key, evicting the least recently used if over budget"""
+        self.total_bytes -= surface_bytes(self.entries.pop(key, None))
+        if isinstance(surface, Animation) and not self.fits(surface):
+            log.info("Showing %s still, its frames don't fit in memory", key)
+            surface = surface.frames[0]
+        self.entries[key] = surface
+        self.total_bytes += surface_bytes(surface)
+        if isinstance(surface, Animation) and self.max_animations is not None:
+            self.limit_animations()
+        for old_key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if old_key == key or old_key in self.drawing or old_key in self.shown:
+                continue
+            self.total_bytes -= surface_bytes(self.entries.pop(old_key))
+            log.debug("Dropped %s from memory", old_key)
+
+    def fits(self, surface):
+        """True if surface fits in the budget without dropping images in use"""
+        in_use = sum(surface_bytes(self.entries.get(key))
+                     for key in self.drawing | self.shown)
+        return in_use + surface_bytes(surface) <= self.max_bytes
+
+    def begin_frame(self):
+        """Start recording which keys are used to draw a frame"""
+        self.drawing = set()
+
+    def keep(self, key):
+        """Mark key as used by the frame being drawn"""
+        self.drawing.add(key)
+
+    def end_frame(self):
+        """Finish drawing a frame. Keys it didn't use may be dropped again"""
+        self.shown = self.drawing
+
+    def limit_animations(self):
+        """Replace the least recently used Animations by stills until
+        no more than max_animations are left"""
+        animations = [key for (key, surface) in self.entries.items()
+                      if isinstance(surface, Animation)]
+        for key in animations[:max(0, len(animations) - self.max_animations)]:
+            animation = self.entries[key]
+            self.total_bytes -= surface_bytes(animation)
+            self.entries[key] = animation.frames[0]
+            self.total_bytes += surface_bytes(animation.frames[0])
+
+    def clear(self):
+        """Drop every surface"""
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+def surface_bytes(surface):
+    """Memory used by the pixels of an image surface or Animation, or 0 for None"""
+    if surface is None:
+        return 0
+    if isinstance(surface, Animation):
+        return sum(surface_bytes(frame) for frame in surface.frames)
+    return surface.get_stride() * surface.get_height()
+
+
+class Animation():
+    """Decoded frames of an animated image, and how long each is shown.
+
+    Which frame is shown is worked out from a clock shared by every
+    animation, so each loops at its own speed without needing a timer"""
+
+    def __init__(self, frames, delays):
+        self.frames = frames
+        self.delays = delays
+        self.duration = sum(delays)
+
+    def get_width(self):
+        """Width of the frames"""
+        return self.frames[0].get_width()
+
+    def get_height(self):
+        """Height of the frames"""
+        return self.frames[0].get_height()
+
+    def frame_at(self, clock):
+        """Return (frame surface, seconds until the next frame) at clock seconds"""
+        position = clock % self.duration
+        for (frame, delay) in zip(self.frames, self.delays):
+            if position < delay:
+                return (frame, delay - position)
+            position -= delay
+        return (self.frames[-1], self.delays[-1])
+
+
+IMAGE_CACHE = ImageCache(os.path.join(xdg_cache_home, "discover_overlay", "images"))
+
+# Sizes accepted by the ?size= parameter of cdn.discordapp.com
+CDN_SIZES = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+# Frames decoded from one animated image at most
+MAX_ANIMATION_FRAMES = 200
+
+# All downloads share a small pool of workers and one keep-alive session
+DOWNLOAD_WORKERS = 4
+download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS,
+                                   thread_name_prefix="image_getter")
+session = requests.Session()
+session.headers.update({
+    'Referer': 'https://streamkit.discord.com/overlay/voice',
+    'User-Agent': 'Mozilla/5.0'
+})
+session.mount("https://", HTTPAdapter(
+    pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS))
+
+
+class CompletionQueue():
+    """Hands decoded images from the download workers to the GTK main loop.
+
+    Everything that arrived since the last drain is applied in one go,
+    after which each overlay that received an image is redrawn once"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.source = None
+
+    def put(self, func, identifier, surface, mask):
+        """Queue func(identifier, surface, mask) to be called on the main loop.
+        Safe to call from any thread"""
+        with self.lock:
+            self.pending.append((func, identifier, surface, mask))
+            if self.source is None:
+                self.source = GLib.idle_add(
+                    self.drain, priority=GLib.PRIORITY_HIGH_IDLE)
+
+    def drain(self):
+        """Apply all arrived images, then request one redraw per receiver"""
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+            self.source = None
+        receivers = []
+        for (func, identifier, surface, mask) in pending:
+            func(identifier, surface, mask)
+            receiver = getattr(func, "__self__", None)
+            if receiver is not None and receiver not in receivers:
+                receivers.append(receiver)
+        for receiver in receivers:
+            if hasattr(receiver, "set_needs_redraw"):
+                receiver.set_needs_redraw()
+        return False
+
+
+completions = CompletionQueue()
+# (URL or icon name, max_size, with_mask, animate, animation_bytes) ->
+# SurfaceGetter currently fetching it
+in_flight = {}
+in_flight_lock = threading.Lock()
+
+
 class SurfaceGetter():
     """Download and decode image using PIL and store as a cairo surface"""
 
-    def __init__(self, func, url, identifier, size):
-        self.func = func
-        self.identifier = identifier
+    def __init__(self, func, url, identifier, size, max_size=None, with_mask=True,
+                 animate=False, animation_bytes=None):
+        self.callbacks = [(func, identifier)]
         self.url = url
         self.size = size
+        # (width, height) the image will be shown at, if it is worth shrinking
+        self.max_size = max_size
+        self.with_mask = with_mask
+        # Deliver an Animation rather than the first frame if it has several
+        self.animate = animate
+        # Most memory the frames of an Animation may use
+        self.animation_bytes = animation_bytes
+        self.key = (url, max_size, with_mask, animate, animation_bytes)
+        # Images are kept on disk as decoded, so one shrunk to fit
+        # max_size is kept apart from the full size image
+        self.cache_key = url
+        if max_size:
+            self.cache_key = f"{url} {max_size[0]}x{max_size[1]}"
+        self.result = None
+
+    def add_callback(self, func, identifier):
+        """Also deliver this image to func. Returns the image if one has already been
+        delivered, as the caller would otherwise miss it. Lock must be held"""
+        self.callbacks.append((func, identifier))
+        return self.result
+
+    def deliver(self, surface, mask):
+        """Pass the decoded image to everyone who asked for it"""
+        with in_flight_lock:
+            self.result = (surface, mask)
+            callbacks = self.callbacks[:]
+        for (func, identifier) in callbacks:
+            completions.put(func, identifier, surface, mask)
+
+    def run(self):
+        """Fetch the image, from the web or an icon theme, then stop being in-flight"""
+        try:
+            if self.url.startswith('http'):
+                self.get_url()
+            else:
+                self.get_file()
+        except Exception:  # pylint: disable=broad-except
+            # Otherwise lost in the download pool's future
+            log.exception("Unable to fetch %s", self.url)
+        finally:
+            with in_flight_lock:
+                del in_flight[self.key]
 
     def get_url(self):
-        """Downloads and decodes"""
+        """Downloads and decodes, using the disk cache where possible"""
+        headers = {}
+        # Only still images are kept on disk
+        cached = None if self.animate else IMAGE_CACHE.load(self.cache_key)
+        if cached:
+            (data, width, height, has_alpha, meta) = cached
+            (surface, mask) = data_to_surfaces(data, width, height, has_alpha,
+                                               with_mask=self.with_mask)
+            self.deliver(surface, mask)
+            # Paint from cache now, but ask if it has changed since
+            if meta["etag"]:
+                headers['If-None-Match'] = meta["etag"]
+            if meta["last_modified"]:
+                headers['If-Modified-Since'] = meta["last_modified"]
         try:
-            resp = requests.get(
-                self.url, stream=True, timeout=10, headers={
-                    'Referer': 'https://streamkit.discord.com/overlay/voice',
-                    'User-Agent': 'Mozilla/5.0'
-                }
+            resp = session.get(
+                self.url, stream=True, timeout=10, headers=headers
             )
+            if cached and resp.status_code == 304:
+                IMAGE_CACHE.touch(self.cache_key)
+                return
             raw = resp.raw
             image = Image.open(raw)
-            (surface, mask) = from_pil(image)
+            if self.animate and getattr(image, "is_animated", False):
+                self.deliver(animation_from_pil(image, self.max_size,
+                                                self.animation_bytes), None)
+                return
+            if self.max_size:
+                image = reduce_to_fit(image, *self.max_size)
+            (data, has_alpha) = pil_to_data(image)
+            if resp.status_code == 200:
+                IMAGE_CACHE.store(self.cache_key, data, image.width, image.height, has_alpha,
+                                  resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+            (surface, mask) = data_to_surfaces(
+                data, image.width, image.height, has_alpha, with_mask=self.with_mask)
 
-            self.func(self.identifier, surface, mask)
+            self.deliver(surface, mask)
         except requests.HTTPError:
             log.error("Unable to open %s", self.url)
         except requests.TooManyRedirects:
@@ -79,7 +467,7 @@ class SurfaceGetter():
                 image = Image.open(icon.get_filename())
                 (surface, mask) = from_pil(image)
                 if surface:
-                    self.func(self.identifier, surface, mask)
+                    self.deliver(surface, mask)
                     return
             except ValueError:
                 errors.append("Value Error - Unable to read %s", self.url)
@@ -108,7 +496,7 @@ class SurfaceGetter():
             if image:
                 (surface, mask) = from_pil(image)
                 if surface:
-                    self.func(self.identifier, surface, mask)
+                    self.deliver(surface, mask)
                     return
         for error in errors:
             log.error(error)
@@ -120,32 +508,132 @@ def from_pil(image, alpha=1.0, image_format='BGRa'):
     :param alpha: 0..1 alpha to add to non-alpha images
     :param format: Pixel format for output surface
     """
-    arr = bytearray()
-    mask = bytearray()
+    (arr, has_alpha) = pil_to_data(image, alpha, image_format)
+    return data_to_surfaces(arr, image.width, image.height, has_alpha, alpha)
+
+
+def pil_to_data(image, alpha=1.0, image_format='BGRa'):
+    """Return the raw pixel data of a Pillow Image and if it had its own alpha band"""
     if 'A' not in image.getbands():
         image.putalpha(int(alpha * 255.0))
-        arr = bytearray(image.tobytes('raw', image_format))
+        return (bytearray(image.tobytes('raw', image_format)), False)
+    return (bytearray(image.tobytes('raw', image_format)), True)
+
+
+def animation_from_pil(image, max_size=None, max_bytes=None):
+    """Decode the frames of an animated Pillow Image into an Animation.
+
+    Frames are shrunk to fit max_size. If they would use more than
+    max_bytes, only every few frames are kept, each shown for longer"""
+    frames = []
+    delays = []
+    count = min(image.n_frames, MAX_ANIMATION_FRAMES)
+    step = 1
+    for index in range(count):
+        image.seek(index)
+        # Browsers show frames of 10ms or less for 100ms, and images expect it
+        delay = image.info.get("duration", 100) / 1000.0
+        delay = delay if delay > 0.01 else 0.1
+        if index % step:
+            delays[-1] += delay
+            continue
+        frame = image.convert("RGBA")
+        if max_size:
+            frame.thumbnail(max_size)
+        if index == 0 and max_bytes:
+            frame_bytes = frame.width * frame.height * 4
+            step = max(1, math.ceil(count * frame_bytes / max_bytes))
+        (data, has_alpha) = pil_to_data(frame)
+        (surface, _mask) = data_to_surfaces(data, frame.width, frame.height, has_alpha,
+                                            with_mask=False)
+        frames.append(surface)
+        delays.append(delay)
+    return Animation(frames, delays)
+
+
+def reduce_to_fit(image, width, height):
+    """Cheaply shrink a Pillow Image towards width x height without going below it.
+
+    JPEGs are decoded at a reduced scale, then whole multiples of the size
+    are removed with reduce. Final scaling is left to draw time"""
+    image.draft(image.mode, (width, height))
+    factor = min(image.width // max(1, width), image.height // max(1, height))
+    if factor > 1:
+        image = image.reduce(factor)
+    return image
+
+
+def data_to_surfaces(arr, width, height, has_alpha, alpha=1.0, with_mask=True):
+    """Create image & mask surfaces from pixel data made by pil_to_data.
+    The mask is None if with_mask is False"""
+    surface = cairo.ImageSurface.create_for_data(
+        arr, cairo.FORMAT_ARGB32, width, height)
+    if not with_mask:
+        if has_alpha and alpha != 1.0:
+            premultiply_and_mask(arr, width, height, alpha)
+        return (surface, None)
+    if not has_alpha:
         mask = arr
     else:
-        arr = bytearray(image.tobytes('raw', image_format))
-        mask = copy.deepcopy((arr))
-        idx = 0
-        while idx < len(arr):
-            if arr[idx] > 0:
-                mask[idx] = 255
-            else:
-                mask[idx] = 0
-            # Cairo expects the raw data to be pre-multiplied alpha
-            # This means when we change the alpha level we need to change the RGB channels equally
-            arr[idx] = int(arr[idx] * alpha)
-            idx += 1
-    surface = cairo.ImageSurface.create_for_data(
-        arr, cairo.FORMAT_ARGB32, image.width, image.height)
+        mask = premultiply_and_mask(arr, width, height, alpha)
     mask = cairo.ImageSurface.create_for_data(
-        mask, cairo.FORMAT_ARGB32, image.width, image.height)
+        mask, cairo.FORMAT_ARGB32, width, height)
     return (surface, mask)
 
 
+def premultiply_and_mask(arr, width, height, alpha=1.0, method=None):
+    """Return a mask with every non-zero byte of arr set to 255,
+    and multiply arr by alpha in-place.
+
+    Uses NumPy if available, otherwise PIL band operations. method
+    chooses "numpy", "pil" or "python" instead"""
+    if method is None:
+        method = "pil" if numpy is None else "numpy"
+    if method == "numpy":
+        return _premultiply_and_mask_numpy(arr, alpha)
+    if method == "pil":
+        try:
+            return _premultiply_and_mask_pil(arr, width, height, alpha)
+        except ValueError:
+            pass
+    return _premultiply_and_mask_python(arr, alpha)
+
+
+def _premultiply_and_mask_numpy(arr, alpha):
+    pixels = numpy.frombuffer(arr, dtype=numpy.uint8)
+    mask = bytearray(((pixels != 0).view(numpy.uint8) * numpy.uint8(255)).tobytes())
+    if alpha != 1.0:
+        alpha_table = numpy.array([int(value * alpha) for value in range(256)],
+                                  dtype=numpy.uint8)
+        numpy.take(alpha_table, pixels, out=pixels)
+    return mask
+
+
+def _premultiply_and_mask_pil(arr, width, height, alpha):
+    # The four bytes of each pixel are treated as generic bands,
+    # so the same table is applied to all of them
+    bands = Image.frombytes("RGBA", (width, height), bytes(arr))
+    mask = bytearray(bands.point(([0] + [255] * 255) * 4).tobytes())
+    if alpha != 1.0:
+        arr[:] = bands.point([int(value * alpha) for value in range(256)] * 4).tobytes()
+    return mask
+
+
+def _premultiply_and_mask_python(arr, alpha):
+    mask = copy.deepcopy((arr))
+    idx = 0
+    while idx < len(arr):
+        if arr[idx] > 0:
+            mask[idx] = 255
+        else:
+            mask[idx] = 0
+        # Cairo expects the raw data to be pre-multiplied alpha
+        # This means when we change the alpha level we need to change the RGB channels equally
+        arr[idx] = int(arr[idx] * alpha)
+        idx += 1
+    return mask
+
+
 def to_pil(surface):
     """Return a PIL Image from the Cairo surface"""
     if surface.get_format() == cairo.Format.ARGB32:
@@ -155,15 +643,57 @@ def to_pil(surface):
                             surface.get_data(), 'raw', "BGRX", surface.get_stride())
 
 
-def get_surface(func, identifier, ava, size):
-    """Download to cairo surface"""
-    image_getter = SurfaceGetter(func, identifier, ava, size)
-    if identifier.startswith('http'):
-        thread = threading.Thread(target=image_getter.get_url)
-        thread.start()
-    else:
-        thread = threading.Thread(target=image_getter.get_file)
-        thread.start()
+def get_surface(func, identifier, ava, size, max_size=None, with_mask=True,
+                animate=False, animation_bytes=None):
+    """Download to cairo surface.
+    Requests for an image already being fetched with the same options
+    share the one download.
+    max_size is a (width, height) the image may be shrunk towards while
+    decoding. Without with_mask, func is given None as the mask. With
+    animate, an animated image is given to func as an Animation, its
+    frames shrunk to max_size and using at most animation_bytes"""
+    key = (identifier, max_size, with_mask, animate, animation_bytes)
+    with in_flight_lock:
+        if key in in_flight:
+            result = in_flight[key].add_callback(func, ava)
+        else:
+            image_getter = SurfaceGetter(func, identifier, ava, size,
+                                         max_size, with_mask, animate, animation_bytes)
+            in_flight[key] = image_getter
+            download_pool.submit(image_getter.run)
+            return
+    if result:
+        completions.put(func, ava, *result)
+
+
+def get_cdn_size(size):
+    """Smallest image size the Discord CDN will serve that is at least size"""
+    for cdn_size in CDN_SIZES:
+        if cdn_size >= size:
+            return cdn_size
+    return CDN_SIZES[-1]
+
+
+def scale_surface(img, width, height, clip_round=False, scale=1):
+    """Return a copy of img rendered at exactly width x height.
+    Optionally clipped to the circle filling that size.
+    The copy has scale device pixels per unit, to be sharp on a monitor
+    with that scale factor"""
+    surface = cairo.ImageSurface(
+        cairo.FORMAT_ARGB32, math.ceil(width * scale), math.ceil(height * scale))
+    surface.set_device_scale(scale, scale)
+    ctx = cairo.Context(surface)
+    if clip_round:
+        ctx.arc(width / 2, height / 2, min(width, height) / 2, 0, 2 * math.pi)
+        ctx.clip()
+    draw_img_to_rect(img, ctx, 0, 0, width, height)
+    return surface
+
+
+def surface_size(img):
+    """Size of an image surface in units, taking its device scale into account"""
+    (scale_x, scale_y) = img.get_device_scale()
+    return (img.get_width() / scale_x, img.get_height() / scale_y)
 
 
 def get_aspected_size(img, width, height, anchor=0, hanchor=0):
@@ -214,28 +744,20 @@ def draw_img_to_rect(img, ctx,
         (offset_x, offset_y, width, height) = get_aspected_size(
             img, width, height, anchor=anchor, hanchor=hanchor)
 
+    (img_width, img_height) = surface_size(img)
     ctx.translate(pos_x + offset_x, pos_y + offset_y)
     ctx.scale(width, height)
-    ctx.scale(1 / img.get_width(), 1 / img.get_height())
-
-    if alpha != 1.0:
-        # Honestly, couldn't find a 'use-image-with-modifier' option
-        # Tried RasterSourcePattern but it appears... broken? in the python implementation
-        # Or just lacking documentation.
-
-        # Pass raw data to PIL and then back with an alpha modifier
-        ctx.set_source_surface(
-            from_pil(
-                to_pil(img),
-                alpha
-            )[0],
-            0, 0)
-    else:
-        ctx.set_source_surface(img, 0, 0)
+    ctx.scale(1 / img_width, 1 / img_height)
 
-    ctx.rectangle(0, 0, img.get_width(), img.get_height())
+    ctx.set_source_surface(img, 0, 0)
+    ctx.rectangle(0, 0, img_width, img_height)
     if not path:
-        ctx.fill()
+        if alpha != 1.0:
+            # Let cairo apply the alpha while compositing
+            ctx.clip()
+            ctx.paint_with_alpha(alpha)
+        else:
+            ctx.fill()
     ctx.restore()
     return (width, height)
 
@@ -260,11 +782,12 @@ def draw_img_to_mask(img, ctx,
         (offset_x, offset_y, width, height) = get_aspected_size(
             img, width, height, anchor=anchor, hanchor=hanchor)
 
+    (img_width, img_height) = surface_size(img)
     ctx.translate(pos_x + offset_x, pos_y + offset_y)
     ctx.scale(width, height)
-    ctx.scale(1 / img.get_width(), 1 / img.get_height())
+    ctx.scale(1 / img_width, 1 / img_height)
 
-    ctx.rectangle(0, 0, img.get_width(), img.get_height())
+    ctx.rectangle(0, 0, img_width, img_height)
     if not path:
         ctx.mask_surface(img, 0, 0)
     ctx.restore()
@@ -0,0 +1,96 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Conversion of Discord messages into Pango markup.
+
+Done once when a message arrives, rather than every time it is drawn
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;",
+                         "'": "&#39;", "\"": "&#34;"})
+
+# Opening and closing markup around the content of each parsed node type
+WRAPPERS = {
+    "strong": ("<b>", "</b>"),
+    "link": ("<u>", "</u>"),
+    "u": ("<u>", "</u>"),
+    "em": ("<i>", "</i>"),
+    "s": ("<s>", "</s>"),
+    "inlineCode": ("<span font_family=\"monospace\" background=\"#0004\">", "</span>"),
+    "codeBlock": ("<span font_family=\"monospace\" background=\"#0004\">", "</span>"),
+    "blockQuote": ("<span font_family=\"monospace\" background=\"#0004\">", "</span>"),
+    "channel": ("", ""),
+    "mention": ("", ""),
+}
+
+warned_types = set()
+
+
+def escape(string):
+    """Escape a string so that it doesn't intefere with Pango's XML format"""
+    return string.translate(ESCAPES)
+
+
+def content_to_markup(content):
+    """Return (markup, emoji image URLs) for the content of a message.
+
+    content is either plain text or the recursive JSON of content_parsed.
+    Each custom emoji is replaced by a ` in the markup, to be drawn with
+    the image at the same index in the list"""
+    parts = []
+    images = []
+    add_markup(content, parts, images)
+    return ("".join(parts), images)
+
+
+def add_markup(message, parts, images):
+    """Append the markup of one node of parsed content to parts"""
+    if isinstance(message, list):
+        for inner_message in message:
+            add_markup(inner_message, parts, images)
+        return
+    if isinstance(message, str):
+        parts.append(message.translate(ESCAPES))
+        return
+    message_type = message['type']
+    wrapper = WRAPPERS.get(message_type)
+    if wrapper:
+        parts.append(wrapper[0])
+        add_markup(message['content'], parts, images)
+        parts.append(wrapper[1])
+    elif message_type == 'text':
+        parts.append(message['content'].translate(ESCAPES))
+    elif message_type == 'emoji':
+        if 'surrogate' in message:
+            # ['src'] is SVG URL
+            parts.append(message['surrogate'])
+        else:
+            extension = "gif" if message.get('animated') else "png"
+            images.append(
+                f"https://cdn.discordapp.com/emojis/{message['emojiId']}.{extension}?v=1")
+            parts.append("`")
+    elif message_type == 'br':
+        parts.append('\n')
+    elif message_type not in warned_types:
+        log.error("Unknown text type : %s", message_type)
+        warned_types.add(message_type)
+
+
+def message_to_markup(nick, nick_col, content):
+    """Return (markup, emoji image URLs) of a whole line in the text overlay"""
+    (markup, images) = content_to_markup(content)
+    return (f"<span foreground='{escape(nick_col or '#fff')}'>{escape(nick)}</span>: {markup}",
+            images)
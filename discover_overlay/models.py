@@ -0,0 +1,208 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Data model for what the connector knows about discord.
+
+Each model is built from, and merged with, the dicts sent over the RPC
+websocket. Merging only replaces fields present in the new data, and
+records which kinds of field actually changed
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+# Change flags for VoiceUser.changed
+CHANGED_NAME = 1
+CHANGED_AVATAR = 2
+CHANGED_STATE = 4
+CHANGED_SPEAKING = 8
+CHANGED_LASTSPOKEN = 16
+CHANGED_ALL = (CHANGED_NAME | CHANGED_AVATAR | CHANGED_STATE | CHANGED_SPEAKING
+               | CHANGED_LASTSPOKEN)
+
+
+class VoiceUser:
+    """A user in the voice channel"""
+    __slots__ = ("id", "username", "nick", "avatar", "mute", "deaf",
+                 "speaking", "lastspoken", "friendlyname", "changed")
+
+    def __init__(self, user_id, username="", nick=None, avatar=None,
+                 mute=False, deaf=False, speaking=False, lastspoken=0):
+        self.id = user_id
+        self.username = username
+        self.nick = nick
+        self.avatar = avatar
+        self.mute = mute
+        self.deaf = deaf
+        self.speaking = speaking
+        self.lastspoken = lastspoken
+        self.friendlyname = nick or username
+        # Flags of what changed since the overlay last looked
+        self.changed = CHANGED_ALL
+
+    @classmethod
+    def from_dict(cls, user):
+        """Create from an RPC user dict"""
+        return cls(user["id"], user.get("username", ""), user.get("nick"),
+                   user.get("avatar"), user.get("mute", False),
+                   user.get("deaf", False), user.get("speaking", False),
+                   user.get("lastspoken", 0))
+
+    def merge(self, user):
+        """Update from an RPC user dict. Fields not in user are kept.
+        Returns flags of what changed"""
+        changed = 0
+        if "username" in user and user["username"] != self.username:
+            self.username = user["username"]
+            changed |= CHANGED_NAME
+        if "nick" in user and user["nick"] != self.nick:
+            self.nick = user["nick"]
+            changed |= CHANGED_NAME
+        if "avatar" in user and user["avatar"] != self.avatar:
+            self.avatar = user["avatar"]
+            changed |= CHANGED_AVATAR
+        if "mute" in user and user["mute"] != self.mute:
+            self.mute = user["mute"]
+            changed |= CHANGED_STATE
+        if "deaf" in user and user["deaf"] != self.deaf:
+            self.deaf = user["deaf"]
+            changed |= CHANGED_STATE
+        if "speaking" in user:
+            self.set_speaking(user["speaking"])
+        if changed & CHANGED_NAME:
+            self.friendlyname = self.nick or self.username
+        self.changed |= changed
+        return changed
+
+    def set_speaking(self, speaking):
+        """Set if the user is speaking. Returns True if this is a change"""
+        if self.speaking == speaking:
+            return False
+        self.speaking = speaking
+        self.changed |= CHANGED_SPEAKING
+        return True
+
+    def set_lastspoken(self, when):
+        """Set the time the user was last heard, as given by perf_counter"""
+        if self.lastspoken != when:
+            self.lastspoken = when
+            self.changed |= CHANGED_LASTSPOKEN
+
+    def to_dict(self):
+        """Return as a plain dict"""
+        return {"id": self.id, "username": self.username, "nick": self.nick,
+                "avatar": self.avatar, "mute": self.mute, "deaf": self.deaf,
+                "speaking": self.speaking}
+
+
+class Channel:
+    """A voice or text channel"""
+    __slots__ = ("id", "name", "type", "guild_id", "guild_name")
+
+    def __init__(self, channel_id, name="", channel_type=0,
+                 guild_id=None, guild_name=None):
+        self.id = channel_id
+        self.name = name
+        self.type = channel_type
+        self.guild_id = guild_id
+        self.guild_name = guild_name
+
+    @classmethod
+    def from_dict(cls, channel):
+        """Create from an RPC channel dict"""
+        return cls(channel["id"], channel.get("name", ""), channel.get("type", 0),
+                   channel.get("guild_id"), channel.get("guild_name"))
+
+    def merge(self, channel):
+        """Update from an RPC channel dict. Fields not in channel are kept.
+        Returns True if anything changed"""
+        changed = False
+        for key in ("name", "type", "guild_id", "guild_name"):
+            if key in channel and channel[key] != getattr(self, key):
+                setattr(self, key, channel[key])
+                changed = True
+        return changed
+
+    def to_dict(self):
+        """Return as a plain dict"""
+        return {"id": self.id, "name": self.name, "type": self.type,
+                "guild_id": self.guild_id, "guild_name": self.guild_name}
+
+
+class Guild:
+    """A guild, and the channels in it once they are known"""
+    __slots__ = ("id", "name", "icon_url", "channels")
+
+    def __init__(self, guild_id, name="", icon_url=None):
+        self.id = guild_id
+        self.name = name
+        self.icon_url = icon_url
+        self.channels = None
+
+    @classmethod
+    def from_dict(cls, guild):
+        """Create from an RPC guild dict"""
+        return cls(guild["id"], guild.get("name", ""), guild.get("icon_url"))
+
+    def merge(self, guild):
+        """Update from an RPC guild dict. Fields not in guild are kept.
+        Returns True if anything changed"""
+        changed = False
+        if "name" in guild and guild["name"] != self.name:
+            self.name = guild["name"]
+            changed = True
+        if "icon_url" in guild and guild["icon_url"] != self.icon_url:
+            self.icon_url = guild["icon_url"]
+            changed = True
+        return changed
+
+    def to_dict(self):
+        """Return as a plain dict"""
+        guild = {"id": self.id, "name": self.name}
+        if self.icon_url:
+            guild["icon_url"] = self.icon_url
+        if self.channels is not None:
+            guild["channels"] = [channel.to_dict()
+                                 for channel in self.channels]
+        return guild
+
+
+class TextMessage:
+    """A message in the text channel. markup and images are what the
+    text overlay draws, built from the rest when the message arrives"""
+    __slots__ = ("id", "content", "nick", "nick_col", "time", "attach",
+                 "markup", "images")
+
+    def __init__(self, message_id, content, nick, nick_col, epoch_time, attach,
+                 markup="", images=None):
+        self.id = message_id
+        self.content = content
+        self.nick = nick
+        self.nick_col = nick_col
+        self.time = epoch_time
+        self.attach = attach
+        self.markup = markup
+        self.images = images or []
+
+    def merge(self, content):
+        """Replace the content after an edit. Returns True if it changed"""
+        if content == self.content:
+            return False
+        self.content = content
+        return True
+
+    def to_dict(self):
+        """Return as a plain dict"""
+        return {"id": self.id, "content": self.content, "nick": self.nick,
+                "nick_col": self.nick_col, "time": self.time,
+                "attach": self.attach}
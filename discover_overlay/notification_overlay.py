@@ -19,6 +19,8 @@ import cairo
 import gi
 from .image_getter import get_surface, draw_img_to_rect
 from .overlay import OverlayWindow
+from .text_layout import font_description
+from .markup import escape
 gi.require_version('PangoCairo', '1.0')
 # pylint: disable=wrong-import-position,wrong-import-order
 from gi.repository import Pango, PangoCairo  # nopep8
@@ -116,18 +118,22 @@ class NotificationOverlayWindow(OverlayWindow):
         """Remove old messages from dataset"""
         now = time.time()
         newlist = []
-        oldsize = len(self.content)
-        # Iterate over and remove messages older than 30s
+        # Iterate over and remove messages older than text_time
         for message in self.content:
             if message['time'] + self.text_time > now:
                 newlist.append(message)
         self.content = newlist
-        # If there is still content to remove
-        if len(newlist) > 0 or oldsize != len(newlist):
-            self.set_needs_redraw()
 
-    def add_notification_message(self, data):
-        """Add new message to dataset"""
+    def schedule_expiry(self):
+        """Plan a redraw for when each message times out"""
+        if self.text_time is None:
+            return
+        for message in self.content:
+            self.add_expiry(message['time'] + self.text_time)
+
+    def add_notification_message(self, data, received=None):
+        """Add new message to dataset. received is the time.time() it
+        arrived, if that wasn't just now"""
         noti = None
         data = data['data']
         message_id = data['message']['id']
@@ -138,15 +144,17 @@ class NotificationOverlayWindow(OverlayWindow):
             if 'icon_url' in data:
                 noti = {"icon": data['icon_url'],
                         "title": data['title'],
-                        "body": data['body'], "time": time.time(),
+                        "body": data['body'], "time": received or time.time(),
                         "id": message_id}
             else:
                 noti = {"title": data['title'],
-                        "body": data['body'], "time": time.time(),
+                        "body": data['body'], "time": received or time.time(),
                         "id": message_id}
 
         if noti:
             self.content.append(noti)
+            if self.text_time is not None:
+                self.add_expiry(noti['time'] + self.text_time)
             self.set_needs_redraw()
             self.get_all_images()
 
@@ -183,8 +191,10 @@ class NotificationOverlayWindow(OverlayWindow):
 
     def set_text_time(self, timer):
         """Config option: Duration that a message will be visible for, in seconds"""
-        self.text_time = timer
-        self.timer_after_draw = timer
+        if self.text_time != timer:
+            self.text_time = timer
+            self.schedule_expiry()
+            self.set_needs_redraw()
 
     def set_limit_width(self, limit):
         """Config option: Word wrap limit, in window-space pixels
@@ -208,7 +218,6 @@ class NotificationOverlayWindow(OverlayWindow):
     def recv_icon(self, identifier, pix, _mask):
         """Callback from image_getter for icons"""
         self.image_list[identifier] = pix
-        self.set_needs_redraw()
 
     def set_fg(self, fg_col):
         """Config option: Set default text colour"""
@@ -241,15 +250,14 @@ class NotificationOverlayWindow(OverlayWindow):
             self.text_font = font
 
             self.pango_rect = Pango.Rectangle()
-            font = Pango.FontDescription(self.text_font)
+            font = font_description(self.text_font)
             self.pango_rect.width = font.get_size() * Pango.SCALE
             self.pango_rect.height = font.get_size() * Pango.SCALE
             self.set_needs_redraw()
 
-    def recv_attach(self, identifier, pix):
+    def recv_attach(self, identifier, pix, _mask):
         """Callback from image_getter for attachments"""
         self.icons[identifier] = pix
-        self.set_needs_redraw()
 
     def calc_all_height(self):
         """Return the height in window-space pixels required
@@ -272,26 +280,8 @@ class NotificationOverlayWindow(OverlayWindow):
         if self.show_icon and icon and icon in self.image_list and self.image_list[icon]:
             icon_width = self.icon_size
             icon_pad = self.icon_pad
-        message = ""
-        if 'body' in line and len(line['body']) > 0:
-            m_no_body = "<span>%s</span>\n%s"
-            message = m_no_body % (self.sanitize_string(line["title"]),
-                                   self.sanitize_string(line['body']))
-        else:
-            m_with_body = "<span>%s</span>"
-            message = m_with_body % (self.sanitize_string(line["title"]))
-        layout = self.create_pango_layout(message)
-        layout.set_auto_dir(True)
-        layout.set_markup(message, -1)
-        (_floating_x, _floating_y, floating_width,
-         _floating_height) = self.get_floating_coords()
-        width = self.limit_width if floating_width > self.limit_width else floating_width
-        layout.set_width((Pango.SCALE * (width -
-                         (self.border_radius * 4 + icon_width + icon_pad))))
-        layout.set_spacing(Pango.SCALE * 3)
-        if self.text_font:
-            font = Pango.FontDescription(self.text_font)
-            layout.set_font_description(font)
+        layout = self.get_message_layout(
+            self.get_message_markup(line), icon_width + icon_pad)
         _text_width, text_height = layout.get_pixel_size()
         if text_height < icon_width:
             text_height = icon_width
@@ -350,16 +340,7 @@ class NotificationOverlayWindow(OverlayWindow):
         if self.reverse_order:
             the_list = reversed(the_list)
         for line in the_list:
-            col = "#fff"
-            if 'body' in line and len(line['body']) > 0:
-                m_no_body = "<span foreground='%s'>%s</span>\n%s"
-                message = m_no_body % (self.sanitize_string(col),
-                                       self.sanitize_string(line["title"]),
-                                       self.sanitize_string(line['body']))
-            else:
-                m_with_body = "<span foreground='%s'>%s</span>"
-                message = m_with_body % (self.sanitize_string(col),
-                                         self.sanitize_string(line["title"]))
+            message = self.get_message_markup(line)
 
             icon = None
             # If we've got an embedded image
@@ -376,6 +357,27 @@ class NotificationOverlayWindow(OverlayWindow):
         context.restore()
         self.context = None
 
+    def get_message_markup(self, line):
+        """Return the markup shown for a notification"""
+        col = "#fff"
+        if 'body' in line and len(line['body']) > 0:
+            m_no_body = "<span foreground='%s'>%s</span>\n%s"
+            return m_no_body % (self.sanitize_string(col),
+                                self.sanitize_string(line["title"]),
+                                self.sanitize_string(line['body']))
+        m_with_body = "<span foreground='%s'>%s</span>"
+        return m_with_body % (self.sanitize_string(col),
+                              self.sanitize_string(line["title"]))
+
+    def get_message_layout(self, message, icon_space):
+        """Return the layout of a notification beside an icon icon_space wide.
+        Shared by calc_height and draw_text, so it is only shaped once"""
+        (_floating_x, _floating_y, floating_width,
+         _floating_height) = self.get_floating_coords()
+        width = self.limit_width if floating_width > self.limit_width else floating_width
+        return self.get_text_layout(message, self.text_font,
+                                    width - (self.border_radius * 4 + icon_space))
+
     def draw_text(self, pos_y, text, icon):
         """Draw a text message, returning the Y position of the next message"""
         icon_width = self.icon_size
@@ -386,20 +388,9 @@ class NotificationOverlayWindow(OverlayWindow):
             icon_pad = 0
             icon_width = 0
 
-        layout = self.create_pango_layout(text)
-        layout.set_auto_dir(True)
-        layout.set_markup(text, -1)
-        attr = layout.get_attributes()
-
         (_floating_x, _floating_y, floating_width,
          _floating_height) = self.get_floating_coords()
-        width = self.limit_width if floating_width > self.limit_width else floating_width
-        layout.set_width((Pango.SCALE * (width -
-                         (self.border_radius * 4 + icon_width + icon_pad))))
-        layout.set_spacing(Pango.SCALE * 3)
-        if self.text_font:
-            font = Pango.FontDescription(self.text_font)
-            layout.set_font_description(font)
+        layout = self.get_message_layout(text, icon_width + icon_pad)
         text_width, text_height = layout.get_pixel_size()
         self.col(self.bg_col)
         top = 0
@@ -419,6 +410,7 @@ class NotificationOverlayWindow(OverlayWindow):
         self.context.save()
         # Draw Background
         self.context.translate(left, top)
+        self.add_shape_rect(self.context, 0, 0, shape_width, shape_height)
         # self.context.rectangle(self.border_radius, 0,
         #                       shape_width - (self.border_radius*2), shape_height)
         # self.context.fill()
@@ -493,21 +485,11 @@ class NotificationOverlayWindow(OverlayWindow):
                 self.border_radius*2 + icon_width + icon_pad, self.border_radius*2)
             PangoCairo.context_set_shape_renderer(
                 self.get_pango_context(), self.render_custom, None)
-
-            text = layout.get_text()
-
-            layout.set_attributes(attr)
-
             PangoCairo.show_layout(self.context, layout)
         else:
             self.context.translate(self.border_radius*2, self.border_radius*2)
             PangoCairo.context_set_shape_renderer(
                 self.get_pango_context(), self.render_custom, None)
-
-            text = layout.get_text()
-
-            layout.set_attributes(attr)
-
             PangoCairo.show_layout(self.context, layout)
 
         self.context.restore()
@@ -538,12 +520,7 @@ class NotificationOverlayWindow(OverlayWindow):
 
     def sanitize_string(self, string):
         """Sanitize a text message so that it doesn't intefere with Pango's XML format"""
-        string = string.replace("&", "&amp;")
-        string = string.replace("<", "&lt;")
-        string = string .replace(">", "&gt;")
-        string = string.replace("'", "&#39;")
-        string = string.replace("\"", "&#34;")
-        return string
+        return escape(string)
 
     def set_testing(self, testing):
         """Toggle placeholder images for testing"""
@@ -16,11 +16,14 @@ types without copy-and-pasting too much code
 """
 import sys
 import os
+import math
 import logging
+import time
 import gi
 import cairo
 from Xlib.display import Display
 from Xlib import X, Xatom
+from .text_layout import LAYOUT_CACHE
 gi.require_version("Gtk", "3.0")
 # pylint: disable=wrong-import-position,wrong-import-order
 from gi.repository import Gtk, Gdk, GLib  # nopep8
@@ -101,11 +104,19 @@ class OverlayWindow(Gtk.Window):
         self.force_xshape = False
         self.context = None
 
-        self.redraw_id = None
         self.draw_blank = False
+        # Window-space areas drawn to in the last frame
+        self.shape_rects = []
+        # Areas to repaint on the next redraw. Anything not given an area repaints all
+        self.damage_rects = []
+        self.damage_full = False
+        self.last_damage_bounds = None
+        self.repainted_pixels = 0
+        self.repainted_since = time.perf_counter()
         self.timeout_mouse_over = 1
 
-        self.timer_after_draw = None
+        # Wall-clock times at which content is known to expire
+        self.expiries = set()
         if piggyback:
             self.set_piggyback(piggyback)
 
@@ -188,22 +199,76 @@ class OverlayWindow(Gtk.Window):
             else:
                 if not self.hidden and self.enabled:
                     self.set_gamescope_xatom(1)
-        # If we're hiding on mouseover, allow mouse-in
-        if self.hide_on_mouseover:
-            # We've mouse-overed
-            if self.draw_blank:
-                return
-            else:
-                (width, height) = self.get_size()
-                surface = cairo.ImageSurface(
-                    cairo.FORMAT_ARGB32, width, height)
-                surface_ctx = cairo.Context(surface)
-                self.overlay_draw(None, surface_ctx)
-                reg = Gdk.cairo_region_create_from_surface(surface)
-                self.input_shape_combine_region(reg)
+        # We've mouse-overed
+        if self.hide_on_mouseover and self.draw_blank:
+            return
 
+        self.shape_rects = []
         self.overlay_draw(_w, context, data)
 
+        # Cut the window down to the areas just drawn. Wherever they are,
+        # allow mouse-in if we're hiding on mouseover
+        if self.hide_on_mouseover or self.use_xshape():
+            region = cairo.Region(self.shape_rects)
+            if self.hide_on_mouseover:
+                self.input_shape_combine_region(region)
+            if self.use_xshape() and self.get_window():
+                self.get_window().shape_combine_region(region, 0, 0)
+
+    def use_xshape(self):
+        """Return true if the window should be cut to shape with XShape"""
+        return self.force_xshape or not self.get_screen().is_composited()
+
+    def needs_shape(self):
+        """Return true if the areas drawn to are used to shape the window"""
+        owner = self
+        while owner.piggyback_parent:
+            owner = owner.piggyback_parent
+        return owner.hide_on_mouseover or owner.use_xshape()
+
+    def add_shape_rect(self, context, pos_x, pos_y, width, height):
+        """Note an area drawn to in this frame, given in context's user-space.
+        These build the XShape and input shape, so that the overlay does not
+        need to be rendered a second time to find them.
+
+        Returns the area as (x, y, width, height) in window-space"""
+        owner = self
+        while owner.piggyback_parent:
+            owner = owner.piggyback_parent
+        (left, top, width, height) = self.get_window_rect(
+            context, pos_x, pos_y, width, height)
+        owner.shape_rects.append(cairo.RectangleInt(
+            math.floor(left), math.floor(top),
+            math.ceil(left + width) - math.floor(left),
+            math.ceil(top + height) - math.floor(top)))
+        return (left, top, width, height)
+
+    def add_shape_region(self, context, region, pos_x, pos_y):
+        """Note a region, with its origin at pos_x, pos_y in context's
+        user-space, as drawn to in this frame. Unlike add_shape_rect this
+        follows the outline of what was drawn, such as a round avatar"""
+        owner = self
+        while owner.piggyback_parent:
+            owner = owner.piggyback_parent
+        (left, top, _width, _height) = self.get_window_rect(
+            context, pos_x, pos_y, 0, 0)
+        region = region.copy()
+        region.translate(math.floor(left), math.floor(top))
+        for idx in range(region.num_rectangles()):
+            owner.shape_rects.append(region.get_rectangle(idx))
+
+    def get_window_rect(self, context, pos_x, pos_y, width, height):
+        """Return an area given in context's user-space as (x, y, width, height)
+        in window-space"""
+        scale = self.get_scale_factor()
+        (x_1, y_1) = context.user_to_device(pos_x, pos_y)
+        (x_2, y_2) = context.user_to_device(pos_x + width, pos_y + height)
+        left = min(x_1, x_2) / scale
+        top = min(y_1, y_2) / scale
+        right = max(x_1, x_2) / scale
+        bottom = max(y_1, y_2) / scale
+        return (left, top, right - left, bottom - top)
+
     def overlay_draw(self, _w, context, data=None):
         """
         Draw overlay
@@ -217,6 +282,14 @@ class OverlayWindow(Gtk.Window):
             self.text_font = font
             self.set_needs_redraw()
 
+    def get_text_layout(self, markup, font, width, alignment=None, prepare=None):
+        """
+        Return a shaped layout of markup, shared with every other
+        overlay drawing the same text. It must not be altered
+        """
+        return LAYOUT_CACHE.get(self.get_pango_context(), markup, font, width,
+                                alignment, prepare)
+
     def set_floating(self, floating, pos_x, pos_y, width, height):
         """
         Set if the window is floating and what dimensions to use
@@ -263,9 +336,9 @@ class OverlayWindow(Gtk.Window):
             else:
                 self.set_untouchable()
 
-    def set_mouseover_timer(self, time):
+    def set_mouseover_timer(self, timeout):
         """Set the time until the overlay reappears after mouse over"""
-        self.timeout_mouse_over = time
+        self.timeout_mouse_over = timeout
 
     def unset_shape(self):
         """
@@ -326,47 +399,93 @@ class OverlayWindow(Gtk.Window):
         else:
             return (screen_x, screen_y, screen_width, screen_height)
 
-    def set_needs_redraw(self, be_pushy=False):
+    def set_needs_redraw(self, be_pushy=False, area=None):
         """Schedule this overlay for a redraw. If part of a
-           piggyback chain, pass it up to be redrawn by topmost parent"""
+           piggyback chain, pass it up to be redrawn by topmost parent
+
+           area is an optional (x, y, width, height) in window-space
+           pixels, limiting the redraw to the part that changed"""
         if (not self.hidden and self.enabled) or be_pushy:
             if self.piggyback_parent:
                 self.piggyback_parent.set_needs_redraw(be_pushy=True)
-
-            if self.redraw_id is None:
-                self.redraw_id = GLib.idle_add(self.redraw)
             else:
-                log.debug("Already awaiting paint")
-
-            # If this overlay has data that expires after draw, plan for that here
-            if self.timer_after_draw is not None:
-                GLib.timeout_add_seconds(self.timer_after_draw, self.redraw)
+                if area is None or self.piggyback:
+                    self.damage_full = True
+                else:
+                    self.damage_rects.append(area)
+                self.discover.frame_scheduler.request_redraw(self)
+
+    def add_expiry(self, expires):
+        """Redraw this overlay once the wall-clock time expires, as
+        given by time.time(), has passed"""
+        now = time.time()
+        if expires <= now or expires in self.expiries:
+            return
+        self.expiries = {when for when in self.expiries if when > now}
+        self.expiries.add(expires)
+        self.discover.frame_scheduler.add_deadline(
+            self, time.perf_counter() + (expires - now))
+
+    def expire(self):
+        """Called when a deadline given to the frame scheduler passes,
+        before the overlay is redrawn"""
+
+    def get_damage_bounds(self):
+        """Return the window-space rectangles this overlay, and any overlay
+        piggybacking on it, can draw into"""
+        if (self.is_wayland or self.piggyback_parent or self.discover.steamos) and self.floating:
+            (floating_x, floating_y, floating_width,
+             floating_height) = self.get_floating_coords()
+            bounds = [(floating_x, floating_y, floating_width, floating_height)]
+        else:
+            (width, height) = self.get_size()
+            bounds = [(0, 0, width, height)]
+        if self.piggyback:
+            bounds.extend(self.piggyback.get_damage_bounds())
+        return bounds
+
+    def queue_damage(self):
+        """Queue the damaged areas for drawing and keep count of pixels repainted"""
+        rects = self.damage_rects
+        if self.damage_full or not rects:
+            rects = self.get_damage_bounds()
+            # Also clear wherever the overlay was before it moved
+            if self.last_damage_bounds and self.last_damage_bounds != rects:
+                rects = rects + self.last_damage_bounds
+            self.last_damage_bounds = rects
+        self.damage_rects = []
+        self.damage_full = False
+
+        scale = self.get_scale_factor()
+        for (pos_x, pos_y, width, height) in rects:
+            left = math.floor(pos_x)
+            top = math.floor(pos_y)
+            right = math.ceil(pos_x + width)
+            bottom = math.ceil(pos_y + height)
+            self.queue_draw_area(left, top, right - left, bottom - top)
+            self.repainted_pixels += (right - left) * \
+                (bottom - top) * scale * scale
+
+        now = time.perf_counter()
+        if now - self.repainted_since >= 1.0:
+            log.debug("%s repainted %d pixels/s", self.get_title(),
+                      self.repainted_pixels / (now - self.repainted_since))
+            self.repainted_pixels = 0
+            self.repainted_since = now
 
     def redraw(self):
         """
         Request a redraw.
-        If we're using XShape (optionally or forcibly) then render the image into the shape
-        so that we only cut out clear sections
+        If we're using XShape (optionally or forcibly) then the shape is set
+        from the areas drawn to, once the draw has happened
         """
-        self.redraw_id = None
         gdkwin = self.get_window()
         if self.piggyback_parent:
             self.piggyback_parent.redraw()
             return
-        if gdkwin:
-            compositing = self.get_screen().is_composited()
-            if not compositing or self.force_xshape:
-                (width, height) = self.get_size()
-                surface = cairo.ImageSurface(
-                    cairo.FORMAT_ARGB32, width, height)
-                surface_ctx = cairo.Context(surface)
-                self.overlay_draw(None, surface_ctx)
-                reg = Gdk.cairo_region_create_from_surface(surface)
-                gdkwin.shape_combine_region(reg, 0, 0)
-            else:
-                gdkwin.shape_combine_region(None, 0, 0)
-        self.queue_draw()
-        self.redraw_id = None
+        if gdkwin and not self.use_xshape():
+            gdkwin.shape_combine_region(None, 0, 0)
+        self.queue_damage()
         return False
 
     def set_hidden(self, hidden):
@@ -0,0 +1,199 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+JSON encoding and decoding for the Discord RPC websocket.
+
+Uses msgspec or orjson when installed, falling back to the json module.
+The highest frequency events, speaking and voice state changes, are
+decoded into typed objects rather than nested dicts
+"""
+import json
+import logging
+from typing import Any, Optional
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+log = logging.getLogger(__name__)
+
+
+class MalformedEvent(ValueError):
+    """A message was valid JSON, but not laid out as its event should be.
+    Only that message is affected, unlike DECODE_ERRORS"""
+
+
+if msgspec:
+    class VoiceState(msgspec.Struct):
+        """Mute and deaf flags of one user"""
+        mute: bool = False
+        self_mute: bool = False
+        suppress: bool = False
+        deaf: bool = False
+        self_deaf: bool = False
+
+    class VoiceStateData(msgspec.Struct):
+        """Data of a VOICE_STATE_CREATE, _UPDATE or _DELETE event"""
+        user: dict
+        nick: Optional[str] = None
+        voice_state: VoiceState = msgspec.field(default_factory=VoiceState)
+
+        @property
+        def mute(self):
+            """True if the user can not be heard, for any reason"""
+            state = self.voice_state
+            return state.mute or state.self_mute or state.suppress
+
+        @property
+        def deaf(self):
+            """True if the user can not hear, for any reason"""
+            return self.voice_state.deaf or self.voice_state.self_deaf
+
+    class SpeakingData(msgspec.Struct):
+        """Data of a SPEAKING_START or SPEAKING_STOP event"""
+        user_id: str
+        channel_id: Optional[str] = None
+
+    class Envelope(msgspec.Struct):
+        """Outer layer of every message, with data left undecoded"""
+        cmd: str
+        evt: Optional[str] = None
+        nonce: Any = None
+        data: msgspec.Raw = msgspec.Raw(b"null")
+
+else:
+    def check_type(value, types, name):
+        """Return value, raising TypeError if it isn't one of types.
+        Matches what msgspec accepts for the same field"""
+        if not isinstance(value, types):
+            raise TypeError(f"Expected {name} to be {types}, got {type(value).__name__}")
+        return value
+
+    class VoiceState:
+        """Mute and deaf flags of one user"""
+        __slots__ = ("mute", "self_mute", "suppress", "deaf", "self_deaf")
+
+        def __init__(self, data):
+            data = check_type(data, dict, "voice_state")
+            self.mute = check_type(data.get("mute", False), bool, "mute")
+            self.self_mute = check_type(data.get("self_mute", False), bool, "self_mute")
+            self.suppress = check_type(data.get("suppress", False), bool, "suppress")
+            self.deaf = check_type(data.get("deaf", False), bool, "deaf")
+            self.self_deaf = check_type(data.get("self_deaf", False), bool, "self_deaf")
+
+    class VoiceStateData:
+        """Data of a VOICE_STATE_CREATE, _UPDATE or _DELETE event"""
+        __slots__ = ("user", "nick", "voice_state")
+
+        def __init__(self, data):
+            data = check_type(data, dict, "data")
+            self.user = check_type(data["user"], dict, "user")
+            self.nick = check_type(data.get("nick"), (str, type(None)), "nick")
+            self.voice_state = VoiceState(data.get("voice_state", {}))
+
+        @property
+        def mute(self):
+            """True if the user can not be heard, for any reason"""
+            state = self.voice_state
+            return state.mute or state.self_mute or state.suppress
+
+        @property
+        def deaf(self):
+            """True if the user can not hear, for any reason"""
+            return self.voice_state.deaf or self.voice_state.self_deaf
+
+    class SpeakingData:
+        """Data of a SPEAKING_START or SPEAKING_STOP event"""
+        __slots__ = ("user_id", "channel_id")
+
+        def __init__(self, data):
+            data = check_type(data, dict, "data")
+            self.user_id = check_type(data["user_id"], str, "user_id")
+            self.channel_id = check_type(data.get("channel_id"), (str, type(None)),
+                                         "channel_id")
+
+# Events whose data is decoded into a typed object
+TYPED_EVENTS = {
+    "VOICE_STATE_CREATE": VoiceStateData,
+    "VOICE_STATE_UPDATE": VoiceStateData,
+    "VOICE_STATE_DELETE": VoiceStateData,
+    "SPEAKING_START": SpeakingData,
+    "SPEAKING_STOP": SpeakingData,
+}
+
+if msgspec:
+    BACKEND = "msgspec"
+    DECODE_ERRORS = (json.JSONDecodeError, msgspec.DecodeError)
+    _envelope_decoder = msgspec.json.Decoder(Envelope)
+    _data_decoder = msgspec.json.Decoder()
+    _typed_decoders = {evt: msgspec.json.Decoder(data_type)
+                       for (evt, data_type) in TYPED_EVENTS.items()}
+    _encoder = msgspec.json.Encoder()
+
+    def decode(message):
+        """Decode a websocket message into a dict of cmd, evt, nonce & data"""
+        try:
+            envelope = _envelope_decoder.decode(message)
+            decoder = _typed_decoders.get(envelope.evt, _data_decoder)
+            data = decoder.decode(envelope.data)
+        except msgspec.ValidationError as error:
+            raise MalformedEvent(str(error)) from error
+        return {"cmd": envelope.cmd, "evt": envelope.evt,
+                "nonce": envelope.nonce, "data": data}
+
+    def encode(obj):
+        """Encode a command as a JSON string"""
+        return _encoder.encode(obj).decode("utf-8")
+
+else:
+    if orjson:
+        BACKEND = "orjson"
+        DECODE_ERRORS = (json.JSONDecodeError, orjson.JSONDecodeError)
+        _loads = orjson.loads
+
+        def encode(obj):
+            """Encode a command as a JSON string"""
+            return orjson.dumps(obj).decode("utf-8")
+    else:
+        BACKEND = "json"
+        DECODE_ERRORS = (json.JSONDecodeError,)
+        _loads = json.loads
+
+        def encode(obj):
+            """Encode a command as a JSON string"""
+            return json.dumps(obj)
+
+    def decode(message):
+        """Decode a websocket message into a dict of cmd, evt, nonce & data"""
+        j = _loads(message)
+        if not isinstance(j, dict) or not isinstance(j.get("cmd"), str):
+            raise MalformedEvent("Message has no cmd")
+        if not isinstance(j.get("evt"), (str, type(None))):
+            raise MalformedEvent("Message evt is not a string")
+        # As with msgspec, every message has these keys
+        j.setdefault("nonce", None)
+        j.setdefault("data", None)
+        data_type = TYPED_EVENTS.get(j.get("evt"))
+        if data_type:
+            try:
+                j["data"] = data_type(j["data"])
+            except (KeyError, TypeError, AttributeError) as error:
+                raise MalformedEvent(f"Malformed {j['evt']}: {error!r}") from error
+        return j
+
+log.debug("Using %s for RPC messages", BACKEND)
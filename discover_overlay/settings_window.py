@@ -737,6 +737,9 @@ class MainSettingsWindow():
         self.widget['core_audio_assist'].set_active(
             config.getboolean("general", "audio_assist", fallback=False))
 
+        self.widget['core_max_fps'].set_value(
+            config.getint("general", "max_fps", fallback=60))
+
         self.loading_config = False
 
     def make_colour(self, col):
@@ -1373,3 +1376,6 @@ class MainSettingsWindow():
 
     def core_audio_assist_changed(self, button):
         self.config_set("general", "audio_assist", f"{button.get_active()}")
+
+    def core_max_fps_changed(self, button):
+        self.config_set("general", "max_fps", f"{int(button.get_value())}")
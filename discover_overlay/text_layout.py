@@ -0,0 +1,94 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Cache of shaped Pango layouts shared by all overlays.
+
+Laying out text is the most expensive part of drawing a message, and the
+same strings are drawn frame after frame. Layouts are kept keyed by
+everything that changes how they are shaped, so a new font or width
+simply misses the cache and old entries age out. Windows on the same
+screen shape text alike, so their layouts are shared
+"""
+import functools
+import logging
+from collections import OrderedDict
+import gi
+gi.require_version("Pango", "1.0")
+gi.require_version("PangoCairo", "1.0")
+# pylint: disable=wrong-import-position
+from gi.repository import Pango, PangoCairo  # nopep8
+
+log = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=32)
+def font_description(font):
+    """Return the parsed Pango.FontDescription of a font string.
+    The result is shared and must not be altered"""
+    return Pango.FontDescription(font)
+
+
+def context_key(pango_context):
+    """Return what, in a Pango context, changes how text is shaped.
+    Each window has its own context, but those on the same screen match"""
+    options = PangoCairo.context_get_font_options(pango_context)
+    return (pango_context.get_font_map(),
+            PangoCairo.context_get_resolution(pango_context),
+            options.hash() if options else None)
+
+
+class LayoutCache():
+    """Least recently used cache of Pango layouts"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, pango_context, markup, font, width, alignment=None, prepare=None):
+        """Return a layout of markup in font, wrapped to width pixels.
+
+        prepare(layout) is called once when a layout is created, to add
+        anything else that only depends on the markup. The layout is
+        shared and must not be altered afterwards.
+
+        Layouts made with a prepare method are only shared with the object
+        it belongs to. Shapes it adds are drawn by the shape renderer of
+        the context the layout was made with, which is that object's"""
+        key = (context_key(pango_context), markup, font, width, alignment,
+               getattr(prepare, "__self__", prepare))
+        layout = self.entries.get(key)
+        if layout is not None:
+            self.entries.move_to_end(key)
+            return layout
+        layout = Pango.Layout.new(pango_context)
+        layout.set_auto_dir(True)
+        layout.set_markup(markup, -1)
+        layout.set_width(int(Pango.SCALE * width))
+        layout.set_spacing(Pango.SCALE * 3)
+        if alignment is not None:
+            layout.set_alignment(alignment)
+        if font:
+            layout.set_font_description(font_description(font))
+        if prepare:
+            prepare(layout)
+        self.entries[key] = layout
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return layout
+
+    def clear(self):
+        """Forget every layout"""
+        self.entries.clear()
+
+
+LAYOUT_CACHE = LayoutCache()
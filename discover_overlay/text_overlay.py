@@ -12,12 +12,15 @@
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """Overlay window for text"""
 import logging
+import math
 import time
 import re
 import cairo
 import gi
-from .image_getter import get_surface, draw_img_to_rect, get_aspected_size
+from .image_getter import (get_surface, draw_img_to_rect, get_aspected_size,
+                           get_cdn_size, SurfaceCache, Animation)
 from .overlay import OverlayWindow
+from .text_layout import font_description
 gi.require_version("Gtk", "3.0")
 gi.require_version('PangoCairo', '1.0')
 # pylint: disable=wrong-import-position,wrong-import-order
@@ -25,6 +28,14 @@ from gi.repository import Pango, PangoCairo  # nopep8
 
 log = logging.getLogger(__name__)
 
+# Most memory, in bytes, used to hold decoded attachments and emoji
+ATTACHMENT_BUDGET = 32 * 1024 * 1024
+# Most animated attachments and emoji kept playing, the rest are shown still
+MAX_ANIMATIONS = 16
+# Most memory the frames of one animation may use. Longer animations
+# have frames skipped
+ANIMATION_BUDGET = ATTACHMENT_BUDGET // 8
+
 
 class TextOverlayWindow(OverlayWindow):
     """Overlay window for text"""
@@ -47,11 +58,11 @@ class TextOverlayWindow(OverlayWindow):
         self.connected = True
         self.bg_col = [0.0, 0.6, 0.0, 0.1]
         self.fg_col = [1.0, 1.0, 1.0, 1.0]
-        self.attachment = {}
+        # URL -> surface of attachments and emoji
+        self.attachment = SurfaceCache(ATTACHMENT_BUDGET, MAX_ANIMATIONS)
 
         self.image_list = []
         self.img_finder = re.compile(r"`")
-        self.warned_filetypes = []
         self.set_title("Discover Text")
         self.redraw()
 
@@ -60,30 +71,25 @@ class TextOverlayWindow(OverlayWindow):
         self.content = []
         self.set_needs_redraw()
 
-    def tick(self):
-        """ Check for old images """
-        if len(self.attachment) > self.line_limit:
-            # We've probably got old images!
-            oldlist = self.attachment
-            self.attachment = {}
-            log.info("Cleaning old images")
-            for message in self.content:
-                if 'attach' in message and message['attach']:
-                    url = message['attach'][0]['url']
-                    log.info("keeping %s", url)
-                    self.attachment[url] = oldlist[url]
-
     def set_text_time(self, timer):
         """Config option: Time before messages disappear from overlay"""
-        if self.text_time != timer or self.timer_after_draw != timer:
+        if self.text_time != timer:
             self.text_time = timer
-            self.timer_after_draw = timer
+            self.schedule_expiry()
             self.set_needs_redraw()
 
+    def schedule_expiry(self):
+        """Plan a redraw for when each message times out"""
+        if not self.popup_style or self.text_time is None:
+            return
+        for message in self.content:
+            self.add_expiry(message.time + self.text_time)
+
     def set_text_list(self, tlist, altered):
         """Change contents of overlay"""
-        self.content = tlist[-self.line_limit:]
+        self.content = tlist
         if altered:
+            self.schedule_expiry()
             self.set_needs_redraw()
 
     def set_fg(self, fg_col):
@@ -100,7 +106,7 @@ class TextOverlayWindow(OverlayWindow):
 
     def set_show_attach(self, attachment):
         """Config option: Show image attachments"""
-        if self.attachment != attachment:
+        if self.show_attach != attachment:
             self.show_attach = attachment
             self.set_needs_redraw()
 
@@ -108,6 +114,8 @@ class TextOverlayWindow(OverlayWindow):
         """Config option: Messages should disappear after being shown for some time"""
         if self.popup_style != boolean:
             self.popup_style = boolean
+            self.schedule_expiry()
+            self.set_needs_redraw()
 
     def set_font(self, font):
         """Config option: Set font used for rendering"""
@@ -115,7 +123,7 @@ class TextOverlayWindow(OverlayWindow):
             self.text_font = font
 
             self.pango_rect = Pango.Rectangle()
-            font = Pango.FontDescription(self.text_font)
+            font = font_description(self.text_font)
             self.pango_rect.width = font.get_size() * Pango.SCALE
             self.pango_rect.height = font.get_size() * Pango.SCALE
             self.set_needs_redraw()
@@ -125,55 +133,9 @@ class TextOverlayWindow(OverlayWindow):
         if self.line_limit != limit:
             self.line_limit = limit
 
-    def make_line(self, message):
-        """Decode a recursive JSON object into pango markup."""
-        ret = ""
-        if isinstance(message, list):
-            for inner_message in message:
-                ret = f"{ret}{self.make_line(inner_message)}"
-        elif isinstance(message, str):
-            ret = self.sanitize_string(message)
-        elif message['type'] == 'strong':
-            ret = f"<b>{self.make_line(message['content'])}</b>"
-        elif message['type'] == 'text':
-            ret = self.sanitize_string(message['content'])
-        elif message['type'] == 'link':
-            ret = f"<u>{self.make_line(message['content'])}</u>"
-        elif message['type'] == 'emoji':
-            if 'surrogate' in message:
-                # ['src'] is SVG URL
-                # ret = msg
-                ret = message['surrogate']
-            else:
-                ### Add Image ###
-                self.image_list.append(f"https://cdn.discordapp.com/emojis/{message['emojiId']}.png?v=1")
-                ret = "`"
-        elif (message['type'] == 'inlineCode' or
-              message['type'] == 'codeBlock' or
-              message['type'] == 'blockQuote'):
-            ret = f"<span font_family=\"monospace\" background=\"#0004\">{self.make_line(message['content'])}</span>"
-        elif message['type'] == 'u':
-            ret = f"<u>{self.make_line(message['content'])}</u>"
-        elif message['type'] == 'em':
-            ret = f"<i>{self.make_line(message['content'])}</i>"
-        elif message['type'] == 's':
-            ret = f"<s>{self.make_line(message['content'])}</s>"
-        elif message['type'] == 'channel':
-            ret = self.make_line(message['content'])
-        elif message['type'] == 'mention':
-            ret = self.make_line(message['content'])
-        elif message['type'] == 'br':
-            ret = '\n'
-        else:
-            if message["type"] not in self.warned_filetypes:
-                log.error("Unknown text type : %s", message["type"])
-                self.warned_filetypes.append(message['type'])
-        return ret
-
     def recv_attach(self, identifier, pix, _mask):
         """Callback from image_getter"""
-        self.attachment[identifier] = pix
-        self.set_needs_redraw()
+        self.attachment.put(identifier, pix)
 
     def has_content(self):
         """Returns true if overlay has meaningful content to render"""
@@ -197,7 +159,6 @@ class TextOverlayWindow(OverlayWindow):
             context.set_source_rgba(0.0, 0.0, 0.0, 0.0)
             context.set_operator(cairo.OPERATOR_SOURCE)
             context.paint()
-        self.tick()
         context.save()
         if self.is_wayland or self.piggyback_parent or self.discover.steamos:
             # Special case!
@@ -215,89 +176,120 @@ class TextOverlayWindow(OverlayWindow):
          floating_height) = self.get_floating_coords()
         current_y = floating_height
         tnow = time.time()
+        self.attachment.begin_frame()
         for line in reversed(self.content):
-            if self.popup_style and tnow - line['time'] > self.text_time:
+            if self.popup_style and tnow - line.time > self.text_time:
                 break
-            out_line = ""
-            self.image_list = []
-
-            col = "#fff"
-            if 'nick_col' in line and line['nick_col']:
-                col = line['nick_col']
-            for in_line in line['content']:
-                out_line = f"{out_line}{self.make_line(in_line)}"
-            if line['attach'] and self.show_attach:
-                attachment = line['attach'][0]
+            self.image_list = line.images
+            for key in line.images:
+                self.attachment.keep(key)
+            if line.attach and self.show_attach:
+                attachment = line.attach[0]
                 url = attachment['url']
                 extension = attachment['filename']
                 extension = extension.rsplit(".", 1)[1]
                 extension = extension.lower()
-                if extension in ['jpeg', 'jpg', 'png', 'gif']:
-                    if url in self.attachment:
-                        current_y = self.draw_attach(current_y, url)
-                    else:
-                        get_surface(self.recv_attach,
-                                    url,
-                                    url, None)
-                        self.attachment[url] = None  # Avoid asking repeatedly
+                if extension in ['jpeg', 'jpg', 'png', 'gif', 'webp']:
+                    (url, max_size) = self.get_attach_url(attachment)
+                    pix = self.use_attachment(url, max_size,
+                                              animate=extension in ['gif', 'webp'])
+                    if pix:
+                        current_y = self.draw_attach(current_y, pix)
                 else:
                     log.warning("Unknown file extension '%s'", extension)
                 # cy = self.draw_text(cy, "%s" % (line['attach']))
-            message = f"<span foreground='{self.sanitize_string(col)}'>{self.sanitize_string(line['nick'])}</span>: {out_line}"
-            current_y = self.draw_text(current_y, message)
+            current_y = self.draw_text(current_y, line.markup)
             if current_y <= 0:
                 # We've done enough
                 break
+        self.attachment.end_frame()
         context.restore()
         self.context = None
 
-    def draw_attach(self, pos_y, url):
+    def get_attach_url(self, attachment):
+        """Return the URL of a thumbnail of attachment at about the size it is
+        shown, and that size. Sizes are rounded up so resizing the window
+        doesn't refetch every image"""
+        proxy_url = attachment.get('proxy_url')
+        if not proxy_url:
+            return (attachment['url'], None)
+        (_floating_x, _floating_y, floating_width,
+         floating_height) = self.get_floating_coords()
+        scale = self.get_scale_factor()
+        max_width = get_cdn_size(floating_width * scale)
+        max_height = get_cdn_size(floating_height * .7 * scale)
+        width = attachment.get('width')
+        height = attachment.get('height')
+        if width and height:
+            ratio = min(max_width / width, max_height / height, 1.0)
+            max_width = max(1, math.ceil(width * ratio))
+            max_height = max(1, math.ceil(height * ratio))
+        separator = "&" if "?" in proxy_url else "?"
+        return (f"{proxy_url}{separator}width={max_width}&height={max_height}",
+                (max_width, max_height))
+
+    def use_attachment(self, url, max_size=None, animate=False):
+        """Return the surface of an attachment or emoji for the frame being
+        drawn, or None if it isn't loaded. Fetches it the first time"""
+        self.attachment.keep(url)
+        if url not in self.attachment:
+            get_surface(self.recv_attach,
+                        url,
+                        url, None, max_size, with_mask=False, animate=animate,
+                        animation_bytes=ANIMATION_BUDGET)
+            # Avoid asking repeatedly
+            self.attachment.put(url, None)
+            return None
+        return self.attachment.get(url)
+
+    def draw_attach(self, pos_y, pix):
         """Draw an attachment"""
         (_floating_x, _floating_y, floating_width,
          floating_height) = self.get_floating_coords()
-        if url in self.attachment and self.attachment[url]:
-            pix = self.attachment[url]
-            image_width = min(pix.get_width(), floating_width)
-            image_height = min(pix.get_height(), (floating_height * .7))
-            (_ax, _ay, _aw, aspect_height) = get_aspected_size(
-                pix, image_width, image_height)
-            self.col(self.bg_col)
-            self.context.rectangle(0, pos_y - aspect_height,
+        image_width = min(pix.get_width(), floating_width)
+        image_height = min(pix.get_height(), (floating_height * .7))
+        (_ax, _ay, _aw, aspect_height) = get_aspected_size(
+            pix, image_width, image_height)
+        self.col(self.bg_col)
+        self.context.rectangle(0, pos_y - aspect_height,
+                               floating_width, aspect_height)
+        area = self.add_shape_rect(self.context, 0, pos_y - aspect_height,
                                    floating_width, aspect_height)
+        if isinstance(pix, Animation):
+            pix = self.discover.frame_scheduler.add_animation_frame(
+                self, pix, area)
 
-            self.context.fill()
-            self.context.set_operator(cairo.OPERATOR_OVER)
-            _new_w, new_h = draw_img_to_rect(
-                pix, self.context, 0, pos_y - image_height, image_width, image_height, aspect=True)
-            return pos_y - new_h
-        return pos_y
+        self.context.fill()
+        self.context.set_operator(cairo.OPERATOR_OVER)
+        _new_w, new_h = draw_img_to_rect(
+            pix, self.context, 0, pos_y - image_height, image_width, image_height, aspect=True)
+        return pos_y - new_h
 
     def draw_text(self, pos_y, text):
         """Draw a text message, returning the Y position of the next message"""
-        layout = self.create_pango_layout(text)
-        layout.set_auto_dir(True)
-        layout.set_markup(text, -1)
-        attr = layout.get_attributes()
-
         (_floating_x, _floating_y, floating_width,
          _floating_height) = self.get_floating_coords()
-        layout.set_width(Pango.SCALE * floating_width)
-        layout.set_spacing(Pango.SCALE * 3)
-        if self.text_font:
-            font = Pango.FontDescription(self.text_font)
-            layout.set_font_description(font)
+        layout = self.get_text_layout(text, self.text_font, floating_width,
+                                      prepare=self.add_image_shapes)
         _tw, text_height = layout.get_pixel_size()
         self.col(self.bg_col)
         self.context.rectangle(0, pos_y - text_height,
                                floating_width, text_height)
         self.context.fill()
+        self.add_shape_rect(self.context, 0, pos_y - text_height,
+                            floating_width, text_height)
         self.context.set_operator(cairo.OPERATOR_OVER)
         self.col(self.fg_col)
 
         self.context.move_to(0, pos_y - text_height)
         PangoCairo.context_set_shape_renderer(
             self.get_pango_context(), self.render_custom, None)
+        PangoCairo.show_layout(self.context, layout)
+        return pos_y - text_height
 
+    def add_image_shapes(self, layout):
+        """Reserve space in a new layout for each inline image"""
+        attr = layout.get_attributes()
         text = layout.get_text()
         count = 0
 
@@ -316,9 +308,6 @@ class TextOverlayWindow(OverlayWindow):
             count += 1
         layout.set_attributes(attr)
 
-        PangoCairo.show_layout(self.context, layout)
-        return pos_y - text_height
-
     def render_custom(self, ctx, shape, path, _data):
         """Draw an inline image as a custom emoticon"""
         if shape.data >= len(self.image_list):
@@ -326,22 +315,17 @@ class TextOverlayWindow(OverlayWindow):
             return
         # key is the url to the image
         key = self.image_list[shape.data]
-        if key not in self.attachment:
-            get_surface(self.recv_attach,
-                        key,
-                        key, None)
+        emoji_size = math.ceil(self.text_size * self.get_scale_factor())
+        pix = self.use_attachment(key, (emoji_size, emoji_size),
+                                  animate=".gif" in key)
+        if not pix:
             return
-        pix = self.attachment[key]
         (pos_x, pos_y) = ctx.get_current_point()
+        if isinstance(pix, Animation):
+            area = self.get_window_rect(ctx, pos_x, pos_y - self.text_size,
+                                        self.text_size, self.text_size)
+            pix = self.discover.frame_scheduler.add_animation_frame(
+                self, pix, area)
         draw_img_to_rect(pix, ctx, pos_x, pos_y - self.text_size, self.text_size,
                          self.text_size, path=path)
         return True
-
-    def sanitize_string(self, string):
-        """Sanitize a text message so that it doesn't intefere with Pango's XML format"""
-        string = string.replace("&", "&amp;")
-        string = string.replace("<", "&lt;")
-        string = string .replace(">", "&gt;")
-        string = string.replace("'", "&#39;")
-        string = string.replace("\"", "&#34;")
-        return string
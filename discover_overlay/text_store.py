@@ -0,0 +1,121 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Bounded store of the most recent messages in the text channel"""
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class TextStore:
+    """
+    Ring buffer of TextMessages, oldest first, of which the newest limit
+    are shown.
+
+    Up to twice limit are held, so that when a message is deleted an
+    older one takes its place. Messages are found by id through an index
+    of their position, so edits and deletes don't search the buffer. A
+    delete leaves an empty slot, which is skipped when reading. Empty
+    slots are only compacted away once the buffer is full
+    """
+
+    def __init__(self, limit=20):
+        self.limit = max(1, limit)
+        self.capacity = self.limit * 2
+        self.slots = [None] * self.capacity
+        # Positions count every message added. Those from start up to
+        # added are in the buffer, the newest in slot (added - 1) % capacity
+        self.start = 0
+        self.added = 0
+        # Number of empty slots left by deletes between start and added
+        self.holes = 0
+        # message id -> position
+        self.index = {}
+
+    def append(self, message):
+        """Add a message as the newest, dropping the oldest if full"""
+        self.remove(message.id)
+        if self.added - self.start == self.capacity:
+            if self.holes:
+                self.compact()
+            else:
+                del self.index[self.slots[self.start % self.capacity].id]
+                self.slots[self.start % self.capacity] = None
+                self.start += 1
+        self.slots[self.added % self.capacity] = message
+        self.index[message.id] = self.added
+        self.added += 1
+
+    def get(self, message_id):
+        """Return the message with message_id, or None"""
+        position = self.index.get(message_id)
+        if position is None:
+            return None
+        return self.slots[position % self.capacity]
+
+    def remove(self, message_id):
+        """Remove the message with message_id. Returns True if it was held"""
+        position = self.index.pop(message_id, None)
+        if position is None:
+            return False
+        self.slots[position % self.capacity] = None
+        self.holes += 1
+        return True
+
+    def held(self):
+        """Return a new list of every message held, oldest first"""
+        return [message for message in
+                (self.slots[position % self.capacity]
+                 for position in range(self.start, self.added))
+                if message is not None]
+
+    def compact(self):
+        """Move the messages held together, removing empty slots"""
+        held = self.held()
+        self.clear()
+        for message in held:
+            self.append(message)
+
+    def clear(self):
+        """Remove every message"""
+        self.slots = [None] * self.capacity
+        self.start = 0
+        self.added = 0
+        self.holes = 0
+        self.index = {}
+
+    def set_limit(self, limit):
+        """Change how many messages are shown, keeping the newest"""
+        limit = max(1, limit)
+        if limit == self.limit:
+            return
+        held = self.held()
+        self.limit = limit
+        self.capacity = limit * 2
+        self.clear()
+        for message in held[-self.capacity:]:
+            self.append(message)
+
+    def messages(self):
+        """Return a new list of the newest limit messages, oldest first"""
+        newest = []
+        for position in range(self.added - 1, self.start - 1, -1):
+            message = self.slots[position % self.capacity]
+            if message is not None:
+                newest.append(message)
+                if len(newest) == self.limit:
+                    break
+        newest.reverse()
+        return newest
+
+    def __len__(self):
+        return len(self.index)
@@ -0,0 +1,114 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Sorted view of the users in a voice channel"""
+import bisect
+import locale
+import logging
+
+log = logging.getLogger(__name__)
+
+ORDER_NAME = 0
+ORDER_ID = 1
+ORDER_SPOKEN = 2
+
+
+class UserOrder:
+    """
+    Keeps a list of VoiceUsers sorted by name, id or most recently spoken,
+    moving only the users whose sort key has changed since the last call.
+
+    If given the same list as last time, only users with change flags set
+    are looked at
+    """
+
+    def __init__(self):
+        self.order = None
+        # Sorted list of (sort key, join sequence, user id)
+        self.entries = []
+        # user id -> entry in self.entries
+        self.entry_of = {}
+        self.users = {}
+        self.next_sequence = 0
+        # user id -> (friendlyname, strxfrm of friendlyname)
+        self.name_keys = {}
+        self.sorted_users = []
+        self.last_users = None
+
+    def sort_key(self, user):
+        """Return the key user is sorted by, in the current order"""
+        if self.order == ORDER_ID:
+            return user.id
+        if self.order == ORDER_SPOKEN:
+            return (not user.speaking, -user.lastspoken)
+        name_key = self.name_keys.get(user.id)
+        if name_key is None or name_key[0] != user.friendlyname:
+            name_key = (user.friendlyname, locale.strxfrm(user.friendlyname))
+            self.name_keys[user.id] = name_key
+        return name_key[1]
+
+    def sort(self, users, order):
+        """Return users sorted by order. The returned list is reused
+        until the order of users changes, and must not be altered"""
+        moved = False
+        if order != self.order:
+            self.order = order
+            self.entries = []
+            self.entry_of = {}
+            self.last_users = None
+            moved = True
+
+        if users is self.last_users:
+            for user in users:
+                if user.changed and self.place(user):
+                    moved = True
+        else:
+            self.last_users = users
+            present = set()
+            for user in users:
+                present.add(user.id)
+                self.users[user.id] = user
+                if self.place(user):
+                    moved = True
+            if len(present) != len(self.entry_of):
+                for user_id in [uid for uid in self.entry_of if uid not in present]:
+                    self.remove_entry(self.entry_of.pop(user_id))
+                    del self.users[user_id]
+                    self.name_keys.pop(user_id, None)
+                moved = True
+
+        if moved:
+            self.sorted_users = [self.users[entry[2]]
+                                 for entry in self.entries]
+        return self.sorted_users
+
+    def place(self, user):
+        """Put user where it belongs in the order. Returns True if it moved"""
+        key = self.sort_key(user)
+        entry = self.entry_of.get(user.id)
+        if entry is not None:
+            if entry[0] == key:
+                return False
+            self.remove_entry(entry)
+            sequence = entry[1]
+        else:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+        entry = (key, sequence, user.id)
+        bisect.insort(self.entries, entry)
+        self.entry_of[user.id] = entry
+        return True
+
+    def remove_entry(self, entry):
+        """Remove entry from the sorted list"""
+        idx = bisect.bisect_left(self.entries, entry)
+        del self.entries[idx]
@@ -16,17 +16,19 @@ import gettext
 import logging
 import math
 import sys
-import locale
 from time import perf_counter
 import cairo
 import pkg_resources
 from .overlay import OverlayWindow
-from .image_getter import get_surface, draw_img_to_rect, draw_img_to_mask
+from .models import (VoiceUser, CHANGED_NAME, CHANGED_AVATAR, CHANGED_STATE,
+                     CHANGED_SPEAKING)
+from .user_order import UserOrder
+from .image_getter import get_surface, draw_img_to_rect, get_cdn_size, scale_surface
 # pylint: disable=wrong-import-order
 import gi
 gi.require_version('PangoCairo', '1.0')
 # pylint: disable=wrong-import-position,wrong-import-order
-from gi.repository import Pango, PangoCairo, GLib  # nopep8
+from gi.repository import Pango, PangoCairo, GLib, Gdk  # nopep8
 
 log = logging.getLogger(__name__)
 
@@ -34,6 +36,9 @@ t = gettext.translation(
     'default', pkg_resources.resource_filename('discover_overlay', 'locales'), fallback=True)
 _ = t.gettext
 
+# Number of distinct opacities a row is re-rendered at while fading out
+FADE_STEPS = 50
+
 
 class VoiceOverlayWindow(OverlayWindow):
     """Overlay window for voice"""
@@ -43,6 +48,23 @@ class VoiceOverlayWindow(OverlayWindow):
 
         self.avatars = {}
         self.avatar_masks = {}
+        # user id -> CDN size of the avatar last asked for
+        self.avatar_sizes = {}
+        # user id, "title" or "connection" -> (row key, surface, offset x,
+        #                                      offset y, text width)
+        self.row_cache = {}
+        # row id -> window-space rectangle the row was last drawn to
+        self.row_rects = {}
+        # row id -> (row surface, region of its non-transparent pixels)
+        self.row_regions = {}
+        self.drawn_ids = []
+        # Positions of the items last drawn, and what they depended on
+        self.layout = None
+        self.layout_key = None
+        self.row_style = None
+        # identifier -> [source image, (size, scale factor), scaled image,
+        #                scaled mask, border width, border halo]
+        self.avatar_scaled = {}
 
         self.dummy_data = []
         mostly_false = [False, False, False, False, False, False, False, True]
@@ -52,16 +74,13 @@ class VoiceOverlayWindow(OverlayWindow):
             if random.randint(0, 20) == 2:
                 scream = random.randint(8, 15)*'a'
             name = f"Player {i} {scream}"
-            self.dummy_data.append({
-                "id": i,
-                "username": name,
-                "avatar": None,
-                "deaf": mostly_false[random.randint(0, 7)],
-                "mute": mostly_false[random.randint(0, 7)],
-                "speaking": speaking,
-                'lastspoken': random.randint(2000, 2100) if speaking else random.randint(10, 30),
-                'friendlyname': name,
-            })
+            self.dummy_data.append(VoiceUser(
+                i, name,
+                deaf=mostly_false[random.randint(0, 7)],
+                mute=mostly_false[random.randint(0, 7)],
+                speaking=speaking,
+                lastspoken=random.randint(2000, 2100) if speaking else random.randint(10, 30),
+            ))
         self.show_avatar = True
         self.avatar_size = 48
         self.nick_length = 32
@@ -116,6 +135,11 @@ class VoiceOverlayWindow(OverlayWindow):
         self.border_col = [0.0, 0.0, 0.0, 0.0]
         self.avatar_bg_col = [0.0, 0.0, 1.0, 1.0]
         self.userlist = []
+        # The part of userlist shown when only_speaking is set
+        self.visible_users = []
+        # Sorted views of the user list and of the dummy data
+        self.user_order = UserOrder()
+        self.dummy_order = UserOrder()
         self.connection_status = "DISCONNECTED"
         self.horizontal = False
         self.guild_ids = tuple()
@@ -124,6 +148,7 @@ class VoiceOverlayWindow(OverlayWindow):
                     "discover-overlay-default",
                     'def', self.avatar_size)
         self.set_title("Discover Voice")
+        self.connect("notify::scale-factor", self.scale_changed)
         self.redraw()
 
     def reset_action_timer(self):
@@ -187,6 +212,7 @@ class VoiceOverlayWindow(OverlayWindow):
     def set_blank(self):
         """Set data to blank and redraw"""
         self.userlist = []
+        self.visible_users = []
         self.channel_icon = None
         self.channel_icon_url = None
         self.channel_title = None
@@ -314,7 +340,9 @@ class VoiceOverlayWindow(OverlayWindow):
     def set_avatar_size(self, size):
         """Config option: Set avatar size in window-space pixels"""
         if self.avatar_size != size:
+            # Avatars are fetched again if the new size needs another resolution
             self.avatar_size = size
+            self.avatar_scaled = {}
             self.set_needs_redraw()
 
     def set_nick_length(self, size):
@@ -357,6 +385,7 @@ class VoiceOverlayWindow(OverlayWindow):
         """Config option: Mask avatar with a circle before rendering"""
         if self.round_avatar == i:
             self.round_avatar = not i
+            self.avatar_scaled = {}
             self.set_needs_redraw()
 
     def set_fancy_border(self, border):
@@ -371,24 +400,29 @@ class VoiceOverlayWindow(OverlayWindow):
          are talking and those who have stopped talking recently"""
         if self.only_speaking != only_speaking:
             self.only_speaking = only_speaking
+            self.update_visible()
             self.set_needs_redraw()
 
     def set_only_speaking_grace_period(self, grace_period):
         """Config option: How long after stopping speaking the user remains shown"""
-        self.only_speaking_grace_period = grace_period
-        self.timer_after_draw = grace_period
+        if self.only_speaking_grace_period != grace_period:
+            self.only_speaking_grace_period = grace_period
+            self.update_visible()
+            self.set_needs_redraw()
 
     def set_highlight_self(self, highlight_self):
         """Config option: Local User should be kept at top of list"""
         if self.highlight_self != highlight_self:
             self.highlight_self = highlight_self
+            self.update_visible()
             self.set_needs_redraw()
 
     def set_order(self, i):
         """Config option: Set method used to order user list"""
         if self.order != i:
             self.order = i
-            self.sort_list(self.userlist)
+            self.userlist = self.sort_list(self.userlist)
+            self.update_visible()
             self.set_needs_redraw()
 
     def set_icon_only(self, i):
@@ -443,16 +477,82 @@ class VoiceOverlayWindow(OverlayWindow):
 
     def set_user_list(self, userlist, alt):
         """Set the users in list to draw"""
-        self.userlist = userlist
-        for user in userlist:
-            if "nick" in user:
-                user["friendlyname"] = user["nick"]
-            else:
-                user["friendlyname"] = user["username"]
-        self.sort_list(self.userlist)
+        self.userlist = self.sort_list(userlist)
         if alt:
+            if not self.use_dummy:
+                in_list = set(user.id for user in userlist)
+                in_list.update(("title", "connection"))
+                for user_id in [uid for uid in self.row_cache if uid not in in_list]:
+                    del self.row_cache[user_id]
+                    self.row_regions.pop(user_id, None)
+            self.update_visible()
+            damage = self.get_row_damage(self.userlist)
+            for user in userlist:
+                user.changed = 0
             self.reset_action_timer()
-            self.set_needs_redraw()
+            if damage is None:
+                self.set_needs_redraw()
+            for area in damage or []:
+                self.set_needs_redraw(area=area)
+
+    def filter_visible(self, userlist):
+        """Return the users only_speaking leaves on screen, and the
+        perf_counter time the next of them should be hidden"""
+        self_id = None
+        if self.highlight_self and self.discover.connection:
+            self_id = self.discover.connection.user.get("id")
+        grace = self.only_speaking_grace_period
+        now = perf_counter()
+        visible = []
+        next_hide = None
+        for user in userlist:
+            if user.speaking or user.id == self_id:
+                visible.append(user)
+            elif grace > 0 and user.lastspoken and now - user.lastspoken < grace:
+                # The user spoke within the grace period, so don't hide
+                # them just yet
+                visible.append(user)
+                hide = user.lastspoken + grace
+                if next_hide is None or hide < next_hide:
+                    next_hide = hide
+        return (visible, next_hide)
+
+    def update_visible(self):
+        """Work out which users to show, and plan a redraw for when the
+        next one should disappear"""
+        if not self.only_speaking:
+            self.visible_users = self.userlist
+            return
+        (self.visible_users, next_hide) = self.filter_visible(self.userlist)
+        if next_hide is not None:
+            self.discover.frame_scheduler.add_deadline(self, next_hide)
+
+    def expire(self):
+        """A deadline has passed. Hide users whose grace period is over"""
+        self.update_visible()
+
+    def get_row_damage(self, userlist):
+        """Return the window-space areas of rows that changed since they were drawn,
+        or None if the whole overlay needs to be drawn again"""
+        if self.only_speaking or self.use_dummy or self.fade_opacity != 1.0:
+            return None
+        if [user.id for user in userlist] != self.drawn_ids:
+            return None
+        damage = []
+        margin = self.border_width + 1
+        for user in userlist:
+            cached = self.row_cache.get(user.id)
+            rect = self.row_rects.get(user.id)
+            if not cached or not rect:
+                return None
+            if (user.changed & (CHANGED_NAME | CHANGED_AVATAR)
+                    or cached[0][4] is not self.avatars.get(user.id)):
+                # Text or image size might change, moving other rows
+                return None
+            if user.changed & (CHANGED_STATE | CHANGED_SPEAKING):
+                damage.append((rect[0] - margin, rect[1] - margin,
+                               rect[2] + margin * 2, rect[3] + margin * 2))
+        return damage
 
     def set_connection_status(self, connection):
         """Set if discord has a clean connection to server"""
@@ -460,16 +560,10 @@ class VoiceOverlayWindow(OverlayWindow):
             self.connection_status = connection['state']
             self.set_needs_redraw()
 
-    def sort_list(self, in_list):
-        """Take a userlist and sort it according to config option"""
-        if self.order == 1:  # ID Sort
-            in_list.sort(key=lambda x: x["id"])
-        elif self.order == 2:  # Spoken sort
-            in_list.sort(key=lambda x: x["lastspoken"], reverse=True)
-            in_list.sort(key=lambda x: x["speaking"], reverse=True)
-        else:  # Name sort
-            in_list.sort(key=lambda x: locale.strxfrm(x['friendlyname']))
-        return in_list
+    def sort_list(self, in_list, user_order=None):
+        """Take a userlist and return it sorted according to config option.
+        Only users whose place in the order changed are moved"""
+        return (user_order or self.user_order).sort(in_list, self.order)
 
     def has_content(self):
         """Returns true if overlay has meaningful content to render"""
@@ -518,80 +612,77 @@ class VoiceOverlayWindow(OverlayWindow):
         connection = self.discover.connection
         if not connection:
             return
-        self_user = connection.user
 
         # Gather which users to draw
-        users_to_draw = self.userlist[:]
-        userlist = self.userlist
-        if self.use_dummy:  # Sorting every frame is an awful idea. Maybe put this off elsewhere?
-            users_to_draw = self.sort_list(self.dummy_data[0:self.dummy_count])
-            userlist = self.dummy_data
-        now = perf_counter()
-
-        for user in userlist:
-            # Bad object equality here, so we need to reassign
-            if "id" in self_user and user["id"] == self_user["id"]:
-                self_user = user
-
-            # Update friendly name with nick if possible
-            if "nick" in user:
-                user["friendlyname"] = user["nick"]
-            else:
-                user["friendlyname"] = user["username"]
-
-            # Remove users that haven't spoken within the grace period
+        users_to_draw = self.visible_users
+        self.drawn_ids = [user.id for user in self.userlist]
+        if self.use_dummy:
+            users_to_draw = self.sort_list(
+                self.dummy_data[0:self.dummy_count], self.dummy_order)
             if self.only_speaking:
-                speaking = "speaking" in user and user["speaking"]
+                users_to_draw = self.filter_visible(users_to_draw)[0]
 
-                # Extend timer if mid-speaking
-                if self.highlight_self and self_user == user:
-                    continue
-                if speaking:
-                    user['lastspoken'] = perf_counter()
-                else:
-                    grace = self.only_speaking_grace_period
-
-                    if (
-                        grace > 0
-                        and (last_spoke := user['lastspoken'])
-                        and (now - last_spoke) < grace
-                    ):
-                        # The user spoke within the grace period, so don't hide
-                        # them just yet
-                        pass
-
-                    elif user in users_to_draw:
-                        users_to_draw.remove(user)
+        items = []
+        if self.show_title and self.channel_title:
+            items.append("title")
+        if self.show_connection:
+            items.append("connection")
+        first_user = len(items)
+        items.extend(users_to_draw)
+        if self.highlight_self and "id" in connection.user:
+            for idx in range(first_user, len(items)):
+                if items[idx].id == connection.user["id"]:
+                    items.insert(first_user, items.pop(idx))
+                    break
+
+        self.row_style = self.get_row_style()
+        (avatar_size, line_height, layout) = self.get_layout(
+            items, width, height, floating_width)
+        for (item, pos_x, pos_y) in layout:
+            (row_id, cached) = self.item_row(
+                item, pos_x, pos_y, avatar_size, line_height)
+            self.blit_row(context, row_id, cached, pos_x, pos_y)
 
-        if self.highlight_self:
-            if self_user in users_to_draw:
-                users_to_draw.remove(self_user)
-                users_to_draw.insert(0, self_user)
+        context.restore()
+        self.context = None
 
+    def get_layout(self, items, width, height, floating_width):
+        """Return (avatar size, line height, [(item, x, y), ...]) placing
+        each item. Only worked out again when something that moves items
+        has changed"""
+        key = (tuple(item if isinstance(item, str) else item.id
+                     for item in items),
+               None if self.horizontal else tuple(
+                   item.friendlyname for item in items
+                   if not isinstance(item, str)),
+               width, height, self.channel_title, self.title_font,
+               self.connection_status,
+               self.avatar_size, self.icon_spacing, self.vert_edge_padding,
+               self.horz_edge_padding, self.align_vert, self.overflow,
+               self.use_dummy, self.row_style)
+        if key != self.layout_key:
+            self.layout = self.compute_layout(
+                items, width, height, floating_width)
+            self.layout_key = key
+        return self.layout
+
+    def compute_layout(self, items, width, height, floating_width):
+        """Place each item, wrapping or shrinking as configured"""
         avatar_size = self.avatar_size if self.show_avatar else 0
         line_height = self.avatar_size
         avatars_per_row = sys.maxsize
-
-        # Calculate height needed to show overlay
-        do_title = False
-        do_connection = False
-        if self.show_connection:
-            users_to_draw.insert(0, None)
-            do_connection = True
-        if self.show_title and self.channel_title:
-            users_to_draw.insert(0, None)
-            do_title = True
+        placed = []
 
         if self.horizontal:
-            needed_width = (len(users_to_draw) * line_height) + \
-                (len(users_to_draw) + 1) * self.icon_spacing
+            needed_width = (len(items) * line_height) + \
+                (len(items) + 1) * self.icon_spacing
 
             if needed_width > width:
                 if self.overflow == 1:  # Wrap
-                    avatars_per_row = int(
-                        width / (avatar_size+self.icon_spacing))
+                    avatars_per_row = max(1, int(
+                        width / (avatar_size+self.icon_spacing)))
                 elif self.overflow == 2:  # Shrink
-                    available_size = width / len(users_to_draw)
+                    available_size = width / len(items)
                     avatar_size = available_size - self.icon_spacing
                     if avatar_size < 8:
                         avatar_size = 8
@@ -601,13 +692,8 @@ class VoiceOverlayWindow(OverlayWindow):
             if self.align_right:  # A lie. Align bottom
                 current_y = (height - avatar_size) - self.vert_edge_padding
                 offset_y = -(avatar_size + self.icon_spacing)
-            rows_to_draw = []
-            while len(users_to_draw) > 0:
-                row = []
-                for _i in range(0, min(avatars_per_row, len(users_to_draw))):
-                    row.append(users_to_draw.pop(0))
-                rows_to_draw.append(row)
-            for row in rows_to_draw:
+            for start in range(0, len(items), avatars_per_row):
+                row = items[start:start + avatars_per_row]
                 needed_width = (len(row) * (line_height + self.icon_spacing))
                 current_x = 0 + self.horz_edge_padding
                 if self.align_vert == 1:
@@ -615,31 +701,20 @@ class VoiceOverlayWindow(OverlayWindow):
                 elif self.align_vert == 2:
                     current_x = width - needed_width - self.horz_edge_padding
 
-                for user in row:
-                    if not user:
-                        if do_title:
-                            do_title = False
-                            text_width = self.draw_title(
-                                context, current_x, current_y, avatar_size, line_height)
-                        elif do_connection:
-                            text_width = self.draw_connection(
-                                context, current_x, current_y, avatar_size, line_height)
-                            do_connection = False
-                    else:
-                        self.draw_avatar(context, user, current_x,
-                                         current_y, avatar_size, line_height)
+                for item in row:
+                    placed.append((item, current_x, current_y))
                     current_x += avatar_size + self.icon_spacing
                 current_y += offset_y
         else:
-            needed_height = ((len(users_to_draw)+0) * line_height) + \
-                (len(users_to_draw) + 1) * self.icon_spacing
+            needed_height = ((len(items)+0) * line_height) + \
+                (len(items) + 1) * self.icon_spacing
 
             if needed_height > height:
                 if self.overflow == 1:  # Wrap
-                    avatars_per_row = int(
-                        height / (avatar_size + self.icon_spacing))
+                    avatars_per_row = max(1, int(
+                        height / (avatar_size + self.icon_spacing)))
                 elif self.overflow == 2:  # Shrink
-                    available_size = height / len(users_to_draw)
+                    available_size = height / len(items)
                     avatar_size = available_size - self.icon_spacing
                     if avatar_size < 8:
                         avatar_size = 8
@@ -651,20 +726,8 @@ class VoiceOverlayWindow(OverlayWindow):
                 offset_x_mult = -1
                 current_x = floating_width - avatar_size - self.horz_edge_padding
 
-            # Choose where to start drawing
-            current_y = 0 + self.vert_edge_padding
-            if self.align_vert == 1:
-                current_y = (height / 2) - (needed_height / 2)
-            elif self.align_vert == 2:
-                current_y = height - needed_height - self.vert_edge_padding
-
-            cols_to_draw = []
-            while len(users_to_draw) > 0:
-                col = []
-                for _i in range(0, min(avatars_per_row, len(users_to_draw))):
-                    col.append(users_to_draw.pop(0))
-                cols_to_draw.append(col)
-            for col in cols_to_draw:
+            for start in range(0, len(items), avatars_per_row):
+                col = items[start:start + avatars_per_row]
                 needed_height = (len(col) * (line_height + self.icon_spacing))
                 current_y = 0 + self.vert_edge_padding
                 if self.align_vert == 1:
@@ -672,39 +735,31 @@ class VoiceOverlayWindow(OverlayWindow):
                 elif self.align_vert == 2:
                     current_y = height - needed_height - self.vert_edge_padding
                 largest_text_width = 0
-                for user in col:
-                    if not user:
-                        if do_title:
-                            # Draw header
-                            text_width = self.draw_title(
-                                context, current_x, current_y, avatar_size, line_height)
-                            largest_text_width = max(
-                                text_width, largest_text_width)
-                            current_y += line_height + self.icon_spacing
-                            do_title = False
-                        elif do_connection:
-                            # Draw header
-                            text_width = self.draw_connection(
-                                context, current_x, current_y, avatar_size, line_height)
-                            largest_text_width = max(
-                                text_width, largest_text_width)
-                            current_y += line_height + self.icon_spacing
-                            do_connection = False
-
-                    else:
-                        text_width = self.draw_avatar(
-                            context, user, current_x, current_y, avatar_size, line_height)
+                last_col = start + avatars_per_row >= len(items)
+                for item in col:
+                    placed.append((item, current_x, current_y))
+                    if not last_col:
+                        # The next column starts after the widest name in this one
+                        (_row_id, cached) = self.item_row(
+                            item, current_x, current_y, avatar_size, line_height)
                         largest_text_width = max(
-                            text_width, largest_text_width)
-                        current_y += line_height + self.icon_spacing
+                            cached[4], largest_text_width)
+                    current_y += line_height + self.icon_spacing
                 if largest_text_width > 0:
                     largest_text_width += self.text_pad
                 else:
                     largest_text_width = self.icon_spacing
                 current_x += offset_x_mult * (offset_x + largest_text_width)
+        return (avatar_size, line_height, placed)
 
-        context.restore()
-        self.context = None
+    def item_row(self, item, pos_x, pos_y, avatar_size, line_height):
+        """Return (row id, row_cache entry) for a layout item"""
+        if item == "title":
+            return ("title", self.title_row(pos_x, pos_y, avatar_size, line_height))
+        if item == "connection":
+            return ("connection", self.connection_row(
+                pos_x, pos_y, avatar_size, line_height))
+        return (item.id, self.avatar_row(item, pos_x, pos_y, avatar_size, line_height))
 
     def recv_avatar(self, identifier, pix, mask):
         """Called when image_getter has downloaded an image"""
@@ -714,23 +769,54 @@ class VoiceOverlayWindow(OverlayWindow):
         elif identifier == 'channel':
             self.channel_icon = pix
             self.channel_mask = mask
-        else:
-            self.avatars[identifier] = pix
-            self.avatar_masks[identifier] = mask
+
+    def recv_user_avatar(self, request, pix, mask):
+        """Called when image_getter has downloaded a user's avatar.
+        Ignored if a different size has been asked for since"""
+        (user_id, size) = request
+        if self.avatar_sizes.get(user_id) != size:
+            return
+        self.avatars[user_id] = pix
+        self.avatar_masks[user_id] = mask
+        self.avatar_scaled.pop(user_id, None)
         self.set_needs_redraw()
 
+    def scale_changed(self, _window, _param):
+        """Window moved to a monitor with another scale. Avatars are
+        fetched again at a resolution suiting it as rows are drawn"""
+        self.avatar_scaled = {}
+        self.set_needs_redraw()
+
+    def get_avatar_cdn_size(self):
+        """Return the size to fetch avatars at, for the avatar size and
+        the window's scale factor"""
+        return get_cdn_size(self.avatar_size * self.get_scale_factor())
+
     def delete_avatar(self, identifier):
         """Remove avatar image"""
-        if identifier in self.avatars:
-            del self.avatars[identifier]
-
-    def draw_title(self, context, pos_x, pos_y, avatar_size, line_height):
-        """Draw title at given Y position. Includes both text and image based on settings"""
+        self.avatars.pop(identifier, None)
+        self.avatar_masks.pop(identifier, None)
+        self.avatar_sizes.pop(identifier, None)
+        self.avatar_scaled.pop(identifier, None)
+
+    def title_row(self, pos_x, pos_y, avatar_size, line_height):
+        """Return the row_cache entry of the title. Includes both text and image based on settings"""
+        if not self.channel_icon and self.channel_icon_url:
+            get_surface(self.recv_avatar, self.channel_icon_url, "channel",
+                        self.avatar_size)
+        title = self.channel_title
+        if self.use_dummy:
+            title = "Dummy Title"
+        key = (title, self.title_font, self.channel_icon,
+               avatar_size, line_height, self.row_style)
+        return self.get_row("title", key, pos_x, pos_y,
+                            lambda row_context, row_x, row_y: self.draw_title_row(
+                                row_context, title, row_x, row_y, avatar_size, line_height))
+
+    def draw_title_row(self, context, title, pos_x, pos_y, avatar_size, line_height):
+        """Draw the channel title and icon"""
         tw = 0
         if not self.horizontal and not self.icon_only:
-            title = self.channel_title
-            if self.use_dummy:
-                title = "Dummy Title"
             tw = self.draw_text(
                 context, title,
                 pos_x,
@@ -742,13 +828,10 @@ class VoiceOverlayWindow(OverlayWindow):
                 self.title_font
             )
         if self.channel_icon:
-            self.draw_avatar_pix(context, self.channel_icon, self.channel_mask,
+            self.draw_avatar_pix(context, "channel", self.channel_icon, self.channel_mask,
                                  pos_x, pos_y, None, avatar_size)
         else:
             self.blank_avatar(context, pos_x, pos_y, avatar_size)
-            if self.channel_icon_url:
-                get_surface(self.recv_avatar, self.channel_icon_url, "channel",
-                            self.avatar_size)
         return tw
 
     def unused_fn_needed_translations(self):
@@ -768,8 +851,16 @@ class VoiceOverlayWindow(OverlayWindow):
         _("VOICE_CONNECTING")
         _("VOICE_CONNECTED")
 
-    def draw_connection(self, context, pos_x, pos_y, avatar_size, line_height):
-        """Draw title at given Y position. Includes both text and image based on settings"""
+    def connection_row(self, pos_x, pos_y, avatar_size, line_height):
+        """Return the row_cache entry of the connection status. Includes both text
+        and image based on settings"""
+        key = (self.connection_status, avatar_size, line_height, self.row_style)
+        return self.get_row("connection", key, pos_x, pos_y,
+                            lambda row_context, row_x, row_y: self.draw_connection_row(
+                                row_context, row_x, row_y, avatar_size, line_height))
+
+    def draw_connection_row(self, context, pos_x, pos_y, avatar_size, line_height):
+        """Draw the connection status and icon"""
         tw = 0
         if not self.horizontal and not self.icon_only:
             tw = self.draw_text(
@@ -786,18 +877,116 @@ class VoiceOverlayWindow(OverlayWindow):
         self.draw_connection_icon(context, pos_x, pos_y, avatar_size)
         return tw
 
-    def draw_avatar(self, context, user, pos_x, pos_y, avatar_size, line_height):
-        """Draw avatar at given Y position. Includes both text and image based on settings"""
-        # Ensure pixbuf for avatar
-        if user["id"] not in self.avatars and user["avatar"] and avatar_size > 0:
-            url = f"https://cdn.discordapp.com/avatars/{user['id']}/{user['avatar']}.png"
-            get_surface(self.recv_avatar, url, user["id"],
+    def get_row_style(self):
+        """Return everything besides the user that changes how a row looks"""
+        return (tuple(self.talk_col), tuple(self.text_col), tuple(self.text_hili_col),
+                tuple(self.norm_col), tuple(self.mute_col), tuple(self.mute_bg_col),
+                tuple(self.hili_col), tuple(self.border_col), tuple(self.avatar_bg_col),
+                self.text_font, self.text_pad, self.text_baseline_adj, self.nick_length,
+                self.round_avatar, self.fancy_border, self.border_width,
+                self.icon_transparency, self.show_avatar, self.icon_only, self.horizontal,
+                self.align_right, self.get_floating_coords()[2], self.def_avatar,
+                self.get_scale_factor())
+
+    def avatar_row(self, user, pos_x, pos_y, avatar_size, line_height):
+        """Return the row_cache entry of a user. Includes both text and image based on settings.
+
+        Each row is rendered once into a surface that is reused until
+        something shown in it changes"""
+        # Ensure pixbuf for avatar, at a resolution suiting its size and
+        # the monitor. Any shown already is kept until the new one arrives
+        size = self.get_avatar_cdn_size()
+        if self.avatar_sizes.get(user.id) != size and user.avatar and avatar_size > 0:
+            url = f"https://cdn.discordapp.com/avatars/{user.id}/{user.avatar}.png?size={size}"
+            get_surface(self.recv_user_avatar, url, (user.id, size),
                         self.avatar_size)
 
-            # Set the key with no value to avoid spamming requests
-            self.avatars[user["id"]] = None
-            self.avatar_masks[user["id"]] = None
-
+            # Remember what was asked for, to avoid spamming requests
+            self.avatar_sizes[user.id] = size
+            self.avatars.setdefault(user.id, None)
+            self.avatar_masks.setdefault(user.id, None)
+
+        key = (user.friendlyname, user.speaking, user.mute, user.deaf,
+               self.avatars.get(user.id), avatar_size, line_height, self.row_style)
+        return self.get_row(user.id, key, pos_x, pos_y,
+                            lambda row_context, row_x, row_y: self.draw_avatar_row(
+                                row_context, user, row_x, row_y, avatar_size, line_height))
+
+    def get_row(self, row_id, key, pos_x, pos_y, paint):
+        """Return a row from row_cache, first rendering it with paint(context, x, y)
+        if anything in key has changed"""
+        # Render with the same sub-pixel offset as the final position,
+        # so that the cached surface is always copied to whole pixels
+        (frac_x, frac_y) = (pos_x - math.floor(pos_x),
+                            pos_y - math.floor(pos_y))
+        key = key + (round(self.fade_opacity * FADE_STEPS),
+                     round(frac_x, 2), round(frac_y, 2))
+        cached = self.row_cache.get(row_id)
+        if not cached or cached[0] != key:
+            cached = self.render_row(key, paint, frac_x, frac_y)
+            self.row_cache[row_id] = cached
+        return cached
+
+    def blit_row(self, context, row_id, cached, pos_x, pos_y):
+        """Copy a rendered row to the window at pos_x, pos_y"""
+        (_key, surface, offset_x, offset_y, _text_width) = cached
+        if surface:
+            left = math.floor(pos_x) + offset_x
+            top = math.floor(pos_y) + offset_y
+            context.save()
+            context.set_source_surface(surface, left, top)
+            context.paint()
+            context.restore()
+            # Remember where this went in window-space, for partial redraws
+            scale = self.get_scale_factor()
+            self.row_rects[row_id] = self.get_window_rect(
+                context, left, top,
+                surface.get_width() / scale, surface.get_height() / scale)
+            if self.needs_shape():
+                self.add_shape_region(context, self.get_row_region(row_id, surface),
+                                      left, top)
+        else:
+            self.row_rects.pop(row_id, None)
+
+    def get_row_region(self, row_id, surface):
+        """Return the region of the non-transparent pixels of a row surface.
+        Found once per rendered row, so that rounded avatars and halos only
+        catch clicks where they are drawn"""
+        cached = self.row_regions.get(row_id)
+        if cached and cached[0] is surface:
+            return cached[1]
+        region = Gdk.cairo_region_create_from_surface(surface)
+        self.row_regions[row_id] = (surface, region)
+        return region
+
+    def render_row(self, key, paint, pos_x, pos_y):
+        """Render one row into a new surface, returning a row_cache entry"""
+        recording = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, None)
+        recording_ctx = cairo.Context(recording)
+        recording_ctx.set_antialias(cairo.ANTIALIAS_GOOD)
+        window_context = self.context
+        self.context = recording_ctx
+        text_width = paint(recording_ctx, pos_x, pos_y)
+        self.context = window_context
+
+        (ink_x, ink_y, ink_width, ink_height) = recording.ink_extents()
+        if ink_width <= 0 or ink_height <= 0:
+            return (key, None, 0, 0, text_width)
+        offset_x = math.floor(ink_x)
+        offset_y = math.floor(ink_y)
+        width = math.ceil(ink_x + ink_width) - offset_x
+        height = math.ceil(ink_y + ink_height) - offset_y
+        scale = self.get_scale_factor()
+        surface = cairo.ImageSurface(
+            cairo.FORMAT_ARGB32, width * scale, height * scale)
+        surface.set_device_scale(scale, scale)
+        surface_ctx = cairo.Context(surface)
+        surface_ctx.set_source_surface(recording, -offset_x, -offset_y)
+        surface_ctx.paint()
+        return (key, surface, offset_x, offset_y, text_width)
+
+    def draw_avatar_row(self, context, user, pos_x, pos_y, avatar_size, line_height):
+        """Draw the name, avatar and status of one user"""
         colour = None
         mute = False
         deaf = False
@@ -805,13 +994,13 @@ class VoiceOverlayWindow(OverlayWindow):
         fg_col = None
         tw = 0
 
-        if "mute" in user and user["mute"]:
+        if user.mute:
             mute = True
-        if "deaf" in user and user["deaf"]:
+        if user.deaf:
             deaf = True
-        if "speaking" in user and user["speaking"] and not deaf and not mute:
+        if user.speaking and not deaf and not mute:
             colour = self.talk_col
-        if "speaking" in user and user["speaking"] and not deaf and not mute:
+        if user.speaking and not deaf and not mute:
             bg_col = self.hili_col
             fg_col = self.text_hili_col
         else:
@@ -820,13 +1009,13 @@ class VoiceOverlayWindow(OverlayWindow):
 
         pix = None
         mask = None
-        if user["id"] in self.avatars:
-            pix = self.avatars[user["id"]]
-            mask = self.avatar_masks[user["id"]]
+        if user.id in self.avatars:
+            pix = self.avatars[user.id]
+            mask = self.avatar_masks[user.id]
         if not self.horizontal:
             if not self.icon_only:
                 tw = self.draw_text(
-                    context, user["friendlyname"],
+                    context, user.friendlyname,
                     pos_x,
                     pos_y,
                     fg_col,
@@ -835,7 +1024,7 @@ class VoiceOverlayWindow(OverlayWindow):
                     line_height,
                     self.text_font
                 )
-        self.draw_avatar_pix(context, pix, mask, pos_x,
+        self.draw_avatar_pix(context, user.id, pix, mask, pos_x,
                              pos_y, colour, avatar_size)
         if deaf:
             self.draw_deaf(context, pos_x, pos_y,
@@ -852,16 +1041,9 @@ class VoiceOverlayWindow(OverlayWindow):
             string = string[:(self.nick_length-1)] + "\u2026"
 
         context.save()
-        layout = self.create_pango_layout(string)
-        layout.set_auto_dir(True)
-        layout.set_markup(string, -1)
         (_floating_x, _floating_y, floating_width,
          _floating_height) = self.get_floating_coords()
-        layout.set_width(Pango.SCALE * floating_width)
-        layout.set_spacing(Pango.SCALE * 3)
-        if font:
-            font = Pango.FontDescription(font)
-            layout.set_font_description(font)
+        layout = self.get_text_layout(string, font, floating_width)
         (ink_rect, logical_rect) = layout.get_pixel_extents()
         text_height = logical_rect.height
         text_width = logical_rect.width
@@ -886,7 +1068,8 @@ class VoiceOverlayWindow(OverlayWindow):
                 pos_x - text_width - self.text_pad - ink_rect.x,
                 pos_y + text_y_offset
             )
-            layout.set_alignment(Pango.Alignment.RIGHT)
+            layout = self.get_text_layout(string, font, floating_width,
+                                          Pango.Alignment.RIGHT)
             PangoCairo.show_layout(self.context, layout)
         else:
             context.move_to(0, 0)
@@ -904,7 +1087,6 @@ class VoiceOverlayWindow(OverlayWindow):
                 pos_x + self.text_pad + avatar_size- ink_rect.x,
                 pos_y + text_y_offset
             )
-            layout.set_alignment(Pango.Alignment.LEFT)
             PangoCairo.show_layout(self.context, layout)
         context.restore()
         return text_width
@@ -922,7 +1104,46 @@ class VoiceOverlayWindow(OverlayWindow):
         context.fill()
         context.restore()
 
-    def draw_avatar_pix(self, context, pixbuf, mask, pos_x, pos_y, border_colour, avatar_size):
+    def get_scaled_avatar(self, identifier, pixbuf, mask, avatar_size):
+        """Return image and mask pre-rendered at avatar_size for the window's
+        scale factor, clipped to a circle if needed"""
+        scale = self.get_scale_factor()
+        entry = self.avatar_scaled.get(identifier)
+        if entry and entry[0] is pixbuf and entry[1] == (avatar_size, scale):
+            return (entry[2], entry[3])
+        scaled_pix = scale_surface(
+            pixbuf, avatar_size, avatar_size, self.round_avatar, scale)
+        scaled_mask = scale_surface(
+            mask, avatar_size, avatar_size, self.round_avatar, scale)
+        self.avatar_scaled[identifier] = [
+            pixbuf, (avatar_size, scale), scaled_pix, scaled_mask, None, None]
+        return (scaled_pix, scaled_mask)
+
+    def get_avatar_halo(self, identifier):
+        """Return the scaled avatar mask dilated by border_width.
+        Must be called after get_scaled_avatar for the same identifier"""
+        entry = self.avatar_scaled[identifier]
+        if entry[4] == self.border_width:
+            return entry[5]
+        mask = entry[3]
+        (scale, _scale_y) = mask.get_device_scale()
+        border = self.border_width * scale
+        halo = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                  mask.get_width() + border * 2,
+                                  mask.get_height() + border * 2)
+        halo.set_device_scale(scale, scale)
+        halo_ctx = cairo.Context(halo)
+        # Step one device pixel at a time, so the halo has no gaps
+        for off_x in range(0, border * 2 + 1):
+            for off_y in range(0, border * 2 + 1):
+                halo_ctx.set_source_surface(mask, off_x / scale, off_y / scale)
+                halo_ctx.paint()
+        entry[4] = self.border_width
+        entry[5] = halo
+        return halo
+
+    def draw_avatar_pix(self, context, identifier, pixbuf, mask, pos_x, pos_y,
+                        border_colour, avatar_size):
         """Draw avatar image at given position"""
         if not self.show_avatar:
             return
@@ -930,31 +1151,25 @@ class VoiceOverlayWindow(OverlayWindow):
         self.blank_avatar(context, pos_x, pos_y, avatar_size)
 
         # fallback default or fallback further to no image here
-        if not pixbuf:
+        if not pixbuf or not mask:
+            identifier = 'def'
             pixbuf = self.def_avatar
-            if not pixbuf:
-                return
-        if not mask:
             mask = self.def_avatar_mask
-            if not mask:
+            if not pixbuf or not mask:
                 return
+        if avatar_size < 1:
+            return
+        (pixbuf, mask) = self.get_scaled_avatar(
+            identifier, pixbuf, mask, avatar_size)
 
         # Draw the "border" by doing a scaled-up copy in a flat colour
         if border_colour:
             self.col(border_colour)
             if self.fancy_border:
                 context.set_operator(cairo.OPERATOR_SOURCE)
-                for off_x in range(-self.border_width, self.border_width+1):
-                    for off_y in range(-self.border_width, self.border_width+1):
-                        context.save()
-                        if self.round_avatar:
-                            context.new_path()
-                            context.arc(pos_x + off_x + (avatar_size / 2), pos_y + off_y +
-                                        (avatar_size / 2), avatar_size / 2, 0, 2 * math.pi)
-                            context.clip()
-                        draw_img_to_mask(mask, context, pos_x + off_x, pos_y + off_y,
-                                         avatar_size, avatar_size)
-                        context.restore()
+                context.mask_surface(self.get_avatar_halo(identifier),
+                                     pos_x - self.border_width,
+                                     pos_y - self.border_width)
             else:
                 if self.round_avatar:
                     context.new_path()
@@ -975,23 +1190,12 @@ class VoiceOverlayWindow(OverlayWindow):
 
             # Cut the image back out
             context.save()
-            if self.round_avatar:
-                context.new_path()
-                context.arc(pos_x + (avatar_size / 2), pos_y +
-                            (avatar_size / 2), avatar_size / 2, 0, 2 * math.pi)
-                context.clip()
             self.col([0.0, 0.0, 0.0, 0.0])
             context.set_operator(cairo.OPERATOR_SOURCE)
-            draw_img_to_mask(mask, context, pos_x, pos_y,
-                             avatar_size, avatar_size)
+            context.mask_surface(mask, pos_x, pos_y)
             context.restore()
         # Draw the image
         context.save()
-        if self.round_avatar:
-            context.new_path()
-            context.arc(pos_x + (avatar_size / 2), pos_y +
-                        (avatar_size / 2), avatar_size / 2, 0, 2 * math.pi)
-            context.clip()
         context.set_operator(cairo.OPERATOR_OVER)
         draw_img_to_rect(pixbuf, context, pos_x, pos_y,
                          avatar_size, avatar_size, False, False, 0, 0,
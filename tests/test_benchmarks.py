@@ -0,0 +1,51 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Runs each benchmark with a tiny workload, so changes that break them are noticed"""
+from benchmarks import (bench_fade, bench_image_decode, bench_rpc_replay,
+                        bench_startup, bench_user_order)
+
+
+def test_bench_fade(monkeypatch):
+    """bench_fade runs"""
+    monkeypatch.setattr(bench_fade, "USERS", 2)
+    monkeypatch.setattr(bench_fade, "STEPS", 2)
+    bench_fade.main()
+
+
+def test_bench_image_decode(monkeypatch):
+    """bench_image_decode runs, with every method"""
+    monkeypatch.setattr(bench_image_decode, "SIZES", {"tiny": (4, 4)})
+    monkeypatch.setattr("sys.argv", ["bench_image_decode", "--slow"])
+    bench_image_decode.main()
+
+
+def test_bench_rpc_replay(monkeypatch):
+    """bench_rpc_replay runs on synthesised frames"""
+    monkeypatch.setattr(bench_rpc_replay, "USERS", 3)
+    monkeypatch.setattr(bench_rpc_replay, "SPEAKING", 100)
+    monkeypatch.setattr(bench_rpc_replay, "MESSAGES", 5)
+    monkeypatch.setattr("sys.argv", ["bench_rpc_replay", "--repeat", "1"])
+    bench_rpc_replay.main()
+
+
+def test_bench_startup(monkeypatch):
+    """bench_startup runs, and start up imports nothing heavy"""
+    monkeypatch.setattr("sys.argv", ["bench_startup", "--repeat", "1"])
+    bench_startup.main()
+
+
+def test_bench_user_order(monkeypatch):
+    """bench_user_order runs"""
+    monkeypatch.setattr(bench_user_order, "USERS", 10)
+    monkeypatch.setattr(bench_user_order, "WAKEUPS", 5)
+    bench_user_order.main()
@@ -0,0 +1,65 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of sharing downloads between image requests"""
+from discover_overlay import image_getter
+
+URL = "https://example.com/emoji.gif"
+
+
+class FakePool():
+    """Records the jobs submitted instead of running them"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, job):
+        """Record job"""
+        self.jobs.append(job)
+
+
+def test_same_request_shares_download(monkeypatch):
+    """Two requests with the same options share one download"""
+    pool = FakePool()
+    monkeypatch.setattr(image_getter, "download_pool", pool)
+    monkeypatch.setattr(image_getter, "in_flight", {})
+    image_getter.get_surface(print, URL, "a", None, (16, 16), with_mask=False)
+    image_getter.get_surface(print, URL, "b", None, (16, 16), with_mask=False)
+    assert len(pool.jobs) == 1
+
+
+def test_different_options_download_separately(monkeypatch):
+    """A request isn't given an image decoded for other options"""
+    pool = FakePool()
+    monkeypatch.setattr(image_getter, "download_pool", pool)
+    monkeypatch.setattr(image_getter, "in_flight", {})
+    image_getter.get_surface(print, URL, "a", None, (16, 16), with_mask=False)
+    image_getter.get_surface(print, URL, "b", None, (16, 16), with_mask=False,
+                             animate=True)
+    image_getter.get_surface(print, URL, "c", None, (16, 16))
+    image_getter.get_surface(print, URL, "d", None, (64, 64), with_mask=False)
+    assert len(pool.jobs) == 4
+
+
+def test_failed_fetch_is_logged_and_finished(monkeypatch, caplog):
+    """An exception while fetching is logged, and the image can be asked for again"""
+    pool = FakePool()
+    monkeypatch.setattr(image_getter, "download_pool", pool)
+    monkeypatch.setattr(image_getter, "in_flight", {})
+
+    def fail(_self):
+        raise RuntimeError("broken")
+    monkeypatch.setattr(image_getter.SurfaceGetter, "get_url", fail)
+    image_getter.get_surface(print, URL, "a", None)
+    pool.jobs[0]()
+    assert "Unable to fetch" in caplog.text
+    assert not image_getter.in_flight
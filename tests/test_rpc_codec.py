@@ -0,0 +1,80 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of decoding RPC websocket messages, with each JSON backend"""
+import importlib.util
+import sys
+import pytest
+from discover_overlay import rpc_codec as installed_codec
+
+# In the order rpc_codec prefers them
+BACKENDS = ("msgspec", "orjson", "json")
+
+
+@pytest.fixture(name="rpc_codec", params=BACKENDS)
+def fixture_rpc_codec(request, monkeypatch):
+    """A fresh copy of rpc_codec using one backend, with those it would
+    prefer made unimportable"""
+    if request.param != "json":
+        pytest.importorskip(request.param)
+    for name in BACKENDS[:BACKENDS.index(request.param)]:
+        monkeypatch.setitem(sys.modules, name, None)
+    spec = importlib.util.spec_from_file_location(
+        f"rpc_codec_{request.param}", installed_codec.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert module.BACKEND == request.param
+    return module
+
+
+def test_speaking_event_is_typed(rpc_codec):
+    """Speaking events are decoded into SpeakingData"""
+    j = rpc_codec.decode('{"cmd": "DISPATCH", "evt": "SPEAKING_START", '
+                         '"data": {"user_id": "123", "channel_id": "456"}}')
+    assert j["cmd"] == "DISPATCH"
+    assert j["data"].user_id == "123"
+
+
+def test_badly_typed_event_is_malformed_not_undecodable(rpc_codec):
+    """An event with an unexpected field type only affects that message"""
+    with pytest.raises(rpc_codec.MalformedEvent) as error:
+        rpc_codec.decode('{"cmd": "DISPATCH", "evt": "SPEAKING_START", '
+                         '"data": {"user_id": 123}}')
+    assert not isinstance(error.value, rpc_codec.DECODE_ERRORS)
+
+
+def test_invalid_json_is_undecodable(rpc_codec):
+    """A message that isn't JSON raises one of DECODE_ERRORS"""
+    with pytest.raises(rpc_codec.DECODE_ERRORS):
+        rpc_codec.decode('{"cmd": ')
+
+
+def test_missing_data_is_none(rpc_codec):
+    """Messages without data still have the key, set to None"""
+    j = rpc_codec.decode('{"cmd": "AUTHORIZE", "evt": "ERROR"}')
+    assert j["data"] is None
+
+
+def test_voice_state_flags(rpc_codec):
+    """Voice state flags are combined into mute and deaf"""
+    j = rpc_codec.decode('{"cmd": "DISPATCH", "evt": "VOICE_STATE_UPDATE", '
+                         '"data": {"user": {"id": "1"}, "voice_state": '
+                         '{"self_mute": true, "deaf": false}}}')
+    assert j["data"].mute
+    assert not j["data"].deaf
+
+
+def test_badly_typed_voice_state_is_malformed(rpc_codec):
+    """A voice state flag that isn't a bool only affects that message"""
+    with pytest.raises(rpc_codec.MalformedEvent):
+        rpc_codec.decode('{"cmd": "DISPATCH", "evt": "VOICE_STATE_UPDATE", '
+                         '"data": {"user": {"id": "1"}, "voice_state": {"mute": 1}}}')
@@ -0,0 +1,93 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of the in-memory cache of attachments and emoji"""
+from types import SimpleNamespace
+from discover_overlay import text_overlay
+from discover_overlay.image_getter import SurfaceCache, Animation
+from discover_overlay.text_overlay import TextOverlayWindow
+
+
+class FakeSurface():
+    """Just enough of a cairo.ImageSurface to be measured"""
+
+    def __init__(self, size):
+        self.size = size
+
+    def get_stride(self):
+        """Bytes per row"""
+        return self.size
+
+    def get_height(self):
+        """Rows"""
+        return 1
+
+
+def draw_frame(overlay, urls):
+    """Use each of urls as TextOverlayWindow.overlay_draw does"""
+    overlay.attachment.begin_frame()
+    for url in urls:
+        TextOverlayWindow.use_attachment(overlay, url)
+    overlay.attachment.end_frame()
+
+
+def test_visible_images_over_budget_are_fetched_once(monkeypatch):
+    """Images on screen that don't fit the budget aren't dropped and refetched"""
+    requested = []
+    monkeypatch.setattr(text_overlay, "get_surface",
+                        lambda _func, url, *_args, **_kwargs: requested.append(url))
+    overlay = SimpleNamespace(attachment=SurfaceCache(100), recv_attach=None)
+    urls = [f"https://example.com/{idx}.png" for idx in range(4)]
+
+    for _frame in range(5):
+        draw_frame(overlay, urls)
+        # Downloads finish between frames, 60 bytes each
+        for url in requested:
+            if overlay.attachment.get(url) is None:
+                overlay.attachment.put(url, FakeSurface(60))
+
+    assert requested == urls
+    assert all(overlay.attachment.get(url) for url in urls)
+
+
+def test_images_no_longer_shown_are_dropped():
+    """Once a frame no longer uses an image it can be evicted"""
+    cache = SurfaceCache(100)
+    cache.begin_frame()
+    cache.keep("old")
+    cache.put("old", FakeSurface(60))
+    cache.end_frame()
+
+    cache.begin_frame()
+    cache.keep("new")
+    cache.put("new", FakeSurface(60))
+    cache.end_frame()
+    # "old" was still on screen last frame, so is kept until now
+    cache.put("other", FakeSurface(10))
+
+    assert "old" not in cache
+    assert "new" in cache
+
+
+def test_animation_too_big_is_kept_as_first_frame():
+    """An Animation that doesn't fit alongside the images shown is kept still"""
+    cache = SurfaceCache(100)
+    cache.begin_frame()
+    cache.keep("shown")
+    cache.put("shown", FakeSurface(60))
+    cache.end_frame()
+    first = FakeSurface(20)
+    cache.put("animated", Animation([first, FakeSurface(20), FakeSurface(20)],
+                                    [0.1, 0.1, 0.1]))
+
+    assert cache.get("animated") is first
+    assert "shown" in cache
@@ -0,0 +1,100 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of the store of recent text messages"""
+import random
+from types import SimpleNamespace
+from discover_overlay.text_store import TextStore
+
+
+def make_store(limit, count):
+    """A TextStore showing limit messages, after count were added"""
+    store = TextStore(limit)
+    for idx in range(count):
+        store.append(SimpleNamespace(id=str(idx)))
+    return store
+
+
+def ids(store):
+    """Ids of the messages shown, oldest first"""
+    return [message.id for message in store.messages()]
+
+
+def test_shows_newest_limit_messages():
+    """Only the newest limit messages are shown, oldest first"""
+    assert ids(make_store(3, 10)) == ["7", "8", "9"]
+    assert ids(make_store(3, 2)) == ["0", "1"]
+
+
+def test_delete_keeps_limit_messages_shown():
+    """Deleting a message shows an older one in its place"""
+    store = make_store(3, 10)
+    assert store.remove("8")
+    assert ids(store) == ["6", "7", "9"]
+    assert store.remove("9")
+    assert ids(store) == ["5", "6", "7"]
+
+
+def test_append_after_delete():
+    """Messages added after a delete are still in order and found by id"""
+    store = make_store(3, 10)
+    store.remove("7")
+    for idx in range(10, 20):
+        store.append(SimpleNamespace(id=str(idx)))
+        store.remove(str(idx - 2))
+    assert ids(store) == ["6", "18", "19"]
+    assert store.get("19").id == "19"
+    assert store.get("7") is None
+
+
+def test_edit_becomes_newest():
+    """Appending a message again with the same id makes it the newest"""
+    store = make_store(3, 5)
+    store.append(SimpleNamespace(id="2"))
+    assert ids(store) == ["3", "4", "2"]
+    assert len(store) == 5
+
+
+def test_set_limit_keeps_newest():
+    """Changing the limit keeps the newest messages"""
+    store = make_store(3, 10)
+    store.set_limit(5)
+    assert ids(store) == ["5", "6", "7", "8", "9"]
+    store.set_limit(2)
+    assert ids(store) == ["8", "9"]
+
+
+def test_delete_moves_no_other_message():
+    """Deleting leaves an empty slot rather than moving newer messages"""
+    store = make_store(3, 5)
+    before = dict(store.index)
+    store.remove("2")
+    del before["2"]
+    assert store.index == before
+    assert ids(store) == ["1", "3", "4"]
+
+
+def test_matches_a_bounded_list():
+    """Random adds and deletes show the same as a list of capacity messages"""
+    rng = random.Random(1)
+    store = TextStore(4)
+    held = []
+    for idx in range(2000):
+        if held and rng.random() < 0.3:
+            message_id = rng.choice(held)
+            held.remove(message_id)
+            store.remove(message_id)
+        else:
+            held = (held + [str(idx)])[-store.capacity:]
+            store.append(SimpleNamespace(id=str(idx)))
+        assert ids(store) == held[-4:]
+        assert len(store) == len(held)